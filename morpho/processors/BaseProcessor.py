@@ -65,6 +65,15 @@ class BaseProcessor():
         '''
         return
 
+    def Prepare(self, executor):
+        '''
+        This method can be called before Run to start long preparation
+        tasks (e.g. model compilation) in the background using the given
+        executor. It returns the corresponding future, or None if there is
+        nothing to prepare; Run must then wait for this future.
+        '''
+        return None
+
     def Run(self):
         '''
         This method will be called by nymph to run the processor
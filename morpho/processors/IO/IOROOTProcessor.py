@@ -6,7 +6,11 @@ Date: 06/26/18
 
 from __future__ import absolute_import
 
+import numbers
 import os
+import re
+
+import numpy as np
 
 from morpho.utilities import morphologging, reader
 logger = morphologging.getLogger(__name__)
@@ -58,6 +62,11 @@ class IOROOTProcessor(IOProcessor):
                 varName = key.decode("utf-8")
                 self.data.update(
                     {str(varName): self.data[str(varName)] + value.tolist()})
+        # The array entries keep the shape of their leaf (e.g. "x[2][3]/F")
+        for key in self.variables:
+            dims = _leaf_dims(tree[key].title)
+            if dims:
+                self.data[str(key)] = np.reshape(self.data[str(key)], (-1,) + dims).tolist()
         return True
 
     def Writer(self):
@@ -67,6 +76,8 @@ class IOROOTProcessor(IOProcessor):
             - "variable" is the variable name in the input dictionary,
             - "root_alias" is the name of the branch in the tree,
             - "type" is the type of data to be saved.
+        Entries can be (multi-dimensional) arrays of fixed shape, such as the
+        indexed parameters of a PyStanSamplingProcessor with keep_shape.
         '''
         logger.debug("Saving data in {}".format(self.file_name))
 
@@ -112,16 +123,21 @@ class IOROOTProcessor(IOProcessor):
                     logger.debug("Updating number datapoints")
                 numberData = len(self.data[varName])
                 hasUpdatedNumberData = True
-            if isinstance(self.data[varName][0], list):
+            # Each entry can be a (multi-dimensional) array of fixed shape
+            first = self.data[varName][0]
+            shape = np.shape(first)
+            if len(shape) > 0:
                 info_subDict = {
-                    "len": len(self.data[varName][0]),
-                    "type": _branch_element_type_from_string(varType) or _branch_element_type(self.data[varName][0][0]),
+                    "len": int(np.prod(shape)),
+                    "shape": shape,
+                    "type": _branch_element_type_from_string(varType) or _branch_element_type(np.ravel(first)[0]),
                     "root_alias": varRootAlias
                 }
             else:
                 info_subDict = {
                     "len": 0,
-                    "type": _branch_element_type_from_string(varType) or _branch_element_type(self.data[varName][0]),
+                    "shape": shape,
+                    "type": _branch_element_type_from_string(varType) or _branch_element_type(first),
                     "root_alias": varRootAlias
                 }
             info_data.update({str(varName): info_subDict})
@@ -142,8 +158,9 @@ class IOROOTProcessor(IOProcessor):
             else:
                 setattr(tempObject, str(key), array(info_data[key]['type'].lower(), int(
                     info_data[key]['len']) * [_get_zero_with_type(info_data[key]['type'])]))
+                dims = "".join("[{}]".format(a_dim) for a_dim in info_data[key]['shape'])
                 t.Branch(str(str(info_data[key]['root_alias'])), getattr(tempObject, str(
-                    key)), '{}[{}]/{}'.format(str(key), info_data[key]['len'], info_data[key]['type']))
+                    key)), '{}{}/{}'.format(str(key), dims, info_data[key]['type']))
 
         logger.debug("Adding data")
         for i in range(numberData):
@@ -152,8 +169,9 @@ class IOROOTProcessor(IOProcessor):
                 if info_data[key]["len"] == 0:
                     temp_var[0] = self.data[str(key)][i]
                 else:
-                    for j in range(info_data[key]["len"]):
-                        temp_var[j] = self.data[str(key)][i][j]
+                    # ROOT arrays are stored in row-major order
+                    for j, value in enumerate(np.ravel(self.data[str(key)][i])):
+                        temp_var[j] = value
                 setattr(tempObject, str(key), temp_var)
             t.Fill()
         f.cd()
@@ -164,15 +182,23 @@ class IOROOTProcessor(IOProcessor):
 
 
 def _branch_element_type(element):
-    if isinstance(element, int):
+    # numbers.Integral/Real also cover the numpy scalar types
+    if isinstance(element, numbers.Integral):
         return "I"
-    elif isinstance(element, float):
+    elif isinstance(element, numbers.Real):
         return "F"
     else:
         logger.warning("{} not supported; using float".format(type(element)))
         return "F"
 
 
+def _leaf_dims(title):
+    # The title of a branch is its leaf list, e.g. "x[2][3]/F"
+    if isinstance(title, bytes):
+        title = title.decode("utf-8")
+    return tuple(int(a_dim) for a_dim in re.findall(r"\[(\d+)\]", title.split("/")[0]))
+
+
 def _branch_element_type_from_string(string):
     if string == "float":
         return "F"
@@ -0,0 +1,78 @@
+'''
+Stan CSV sample files IO processor
+Date: 10/18/26
+'''
+
+from __future__ import absolute_import
+
+from morpho.processors.IO import IOProcessor
+from morpho.utilities import morphologging, reader, pystanLoader, stanCsv, summary
+logger = morphologging.getLogger(__name__)
+
+__all__ = []
+__all__.append(__name__)
+
+
+class IOStanCSVProcessor(IOProcessor):
+    '''
+    Reader of the Stan CSV sample files (e.g. written by a PyStanSamplingProcessor
+    with sample_file), which can be read while the chains are still running.
+    The files are parsed in chunks and only the requested variables are kept.
+
+    Parameters:
+        filename (required): sample_file of the sampling; with several chains, the
+            files "<name>_<chain>.csv" written by PyStan are read
+        variables (required): parameters to extract, as the interestParams of the
+            PyStanSamplingProcessor (flatnames, slices or wildcards);
+            lp_prob and the sampler diagnostics are always extracted
+        action: only "read" is supported (default="read")
+        chain: number of chains (default=1)
+        chunk_size: number of draws parsed at once (default=1000)
+        follow: wait for the draws being written (default=False)
+        iter: with follow, stop waiting once iter draws per chain have been read
+        poll_interval: time between the reads of the files in s, with follow (default=1)
+        timeout: with follow, stop waiting when no draw has been written for timeout s
+            (default=60)
+        warmup: number of warmup draws per chain in the files (default=None: the draws
+            before the "Adaptation terminated" comment; none if the sampling ended
+            without adaptation)
+
+    Input:
+        None
+
+    Results:
+        data: SampleTable containing the draws read (the chains are truncated to the
+            same number of draws; the warmup draws are flagged by is_sample)
+            and the summaries of the post-warmup draws
+    '''
+
+    def InternalConfigure(self, params):
+        super().InternalConfigure(params)
+        self.chains = int(reader.read_param(params, "chain", 1))
+        self.chunk_size = int(reader.read_param(params, "chunk_size", 1000))
+        self.follow = reader.read_param(params, "follow", False)
+        self.iter = reader.read_param(params, "iter", None)
+        self.poll_interval = float(reader.read_param(params, "poll_interval", 1.))
+        self.timeout = reader.read_param(params, "timeout", 60.)
+        self.warmup = reader.read_param(params, "warmup", None)
+        return True
+
+    def Reader(self):
+        sample_files = stanCsv.chain_sample_files(self.file_name, self.chains)
+        logger.debug("Reading {}".format(sample_files))
+        self.data = stanCsv.read_stan_csv(sample_files, self.variables, self.chunk_size,
+                                          self.follow, self.poll_interval, self.timeout,
+                                          self.iter, self.warmup)
+        if self.data.n_draws == 0:
+            logger.error("No draws in {}".format(sample_files))
+            return False
+        logger.debug("{} draws per chain read".format(self.data.n_iterations))
+        if self.data.n_iterations > self.data.warmup:
+            summary.add_summaries(self.data, pystanLoader.summary_columns(self.data))
+        else:
+            logger.info("The chains are still in their warmup: no summaries")
+        return True
+
+    def Writer(self):
+        logger.error("Writing Stan CSV files is not supported")
+        return False
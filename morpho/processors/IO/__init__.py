@@ -8,3 +8,4 @@ from .IOCVSProcessor import IOCVSProcessor
 from .IOJSONProcessor import IOJSONProcessor, IOYAMLProcessor
 from .IORProcessor import IORProcessor
 from .IOROOTProcessor import IOROOTProcessor
+from .IOStanCSVProcessor import IOStanCSVProcessor
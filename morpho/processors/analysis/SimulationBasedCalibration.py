@@ -0,0 +1,209 @@
+'''
+Simulation-based calibration of a Stan model, with the replications run in a process pool
+Date: 10/18/26
+'''
+
+from __future__ import absolute_import
+
+import copy
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from morpho.utilities import morphologging, reader, seeding
+from morpho.processors import BaseProcessor
+from morpho.processors.sampling import PyStanSamplingProcessor
+logger = morphologging.getLogger(__name__)
+
+__all__ = []
+__all__.append(__name__)
+
+# Configurations of the generator and analyzer in the worker processes
+_worker_configs = {}
+
+
+def _post_warmup(results, name, thin=1):
+    is_sample = np.asarray(results["is_sample"]) > 0
+    return np.asarray(results[name], dtype=float)[is_sample][::thin]
+
+
+def _init_worker(generator_config, analyzer_config):
+    '''
+    Load the generator and analyzer models once per worker process:
+    the processors of the replications then take them from the registry
+    of the loaded models
+    '''
+    _worker_configs['generator'] = generator_config
+    _worker_configs['analyzer'] = analyzer_config
+    for a_key, a_config in _worker_configs.items():
+        processor = PyStanSamplingProcessor(a_key)
+        processor.Configure(a_config)
+        processor._load_model()
+
+
+def _run_processor(name, config, input_data, seed):
+    config = copy.deepcopy(config)
+    config.setdefault('input_data', {}).update(input_data)
+    config['seed'] = seed
+    processor = PyStanSamplingProcessor(name)
+    if not processor.Configure(config) or not processor.Run():
+        raise RuntimeError("<{}> failed".format(name))
+    return processor.results
+
+
+def _replication(iReplication, truth, prior_sd, settings):
+    '''
+    Generate data from the true parameters, fit them and compare the
+    posterior to the true values
+    '''
+    generated = _run_processor("generator{}".format(iReplication), _worker_configs['generator'],
+                               truth, seeding.derive_seed(settings['seed'], 'generator', iReplication))
+    data = {a_name: _post_warmup(generated, a_name).tolist() for a_name in settings['generated_data']}
+    if settings['size_name'] is not None:
+        data[settings['size_name']] = len(data[settings['generated_data'][0]])
+    posterior = _run_processor("analyzer{}".format(iReplication), _worker_configs['analyzer'],
+                               data, seeding.derive_seed(settings['seed'], 'analyzer', iReplication))
+    output = {'replication': iReplication, 'truth': truth, 'rank': {}, 'n_draws': {},
+              'mean': {}, 'sd': {}, 'z_score': {}, 'shrinkage': {}}
+    for a_name in settings['parameters']:
+        draws = _post_warmup(posterior, a_name, settings['thin'])
+        mean, sd = float(np.mean(draws)), float(np.std(draws, ddof=1))
+        output['rank'][a_name] = int(np.sum(draws < truth[a_name]))
+        output['n_draws'][a_name] = len(draws)
+        output['mean'][a_name] = mean
+        output['sd'][a_name] = sd
+        output['z_score'][a_name] = (mean - truth[a_name])/sd
+        output['shrinkage'][a_name] = 1. - (sd/prior_sd[a_name])**2
+    return output
+
+
+class SimulationBasedCalibration(BaseProcessor):
+    '''
+    Simulation-based calibration (SBC) of a model: true parameters are drawn
+    from the prior (sampler), data are generated from them (generator) and
+    fitted (analyzer); the rank of each true value among the posterior draws
+    should be uniformly distributed.
+    The replications are run in a pool of worker processes, each of them
+    loading the compiled generator and analyzer models only once.
+
+    Parameters:
+        sampler (required): PyStanSamplingProcessor configuration of the prior sampling
+        generator (required): PyStanSamplingProcessor configuration of the data generator;
+            the true values of the parameters are added to its input_data
+        analyzer (required): PyStanSamplingProcessor configuration of the fit;
+            the generated data are added to its input_data
+        parameters (required): names of the parameters calibrated
+        generated_data: variables of the generator (post-warmup draws) given as data to
+            the analyzer (default=interestParams of the generator)
+        size_name: name of the analyzer data set to the number of generated draws
+            (e.g. "N") (default=None)
+        n_replications: number of replications (default=number of post-warmup prior draws)
+        n_workers: number of worker processes; 1 runs the replications in this process
+            (default=number of CPUs)
+        thin: thinning of the posterior draws used for the ranks (default=1)
+        output_file: JSON lines file where the results of each replication are written
+            as soon as it is done (default=None)
+        seed: seed from which the seeds of the replications are derived (default=random seed)
+
+    Input:
+        None
+
+    Results:
+        results: dictionary containing the results of each replication ("replications":
+            true values, ranks, number of posterior draws, posterior mean and sd, z-scores
+            and shrinkages), the arrays of "rank", "z_score" and "shrinkage" by parameter
+            (in the replications order), the "prior_sd" and the "failed" replications
+    '''
+
+    def InternalConfigure(self, params):
+        self.sampler_config = reader.read_param(params, 'sampler', 'required')
+        self.generator_config = reader.read_param(params, 'generator', 'required')
+        self.analyzer_config = reader.read_param(params, 'analyzer', 'required')
+        self.parameters = reader.read_param(params, 'parameters', 'required')
+        self.generated_data = reader.read_param(
+            params, 'generated_data', self.generator_config.get('interestParams', []))
+        if not self.generated_data:
+            logger.error("No generated data to give to the analyzer")
+            return False
+        self.size_name = reader.read_param(params, 'size_name', None)
+        self.n_replications = reader.read_param(params, 'n_replications', None)
+        self.n_workers = int(reader.read_param(params, 'n_workers', os.cpu_count() or 1))
+        self.thin = int(reader.read_param(params, 'thin', 1))
+        self.output_file = reader.read_param(params, 'output_file', None)
+        self.seed = seeding.processor_seed(params, self.name)
+        return True
+
+    def _prior_draws(self):
+        '''
+        Return the prior draws of the parameters (dictionary of arrays)
+        '''
+        prior = _run_processor(self.name + "_sampler", self.sampler_config, {},
+                               seeding.derive_seed(self.seed, 'sampler'))
+        return {a_name: _post_warmup(prior, a_name) for a_name in self.parameters}
+
+    def _run_replications(self, truths, prior_sd, settings):
+        '''
+        Yield the results of the replications as they are done
+        '''
+        if self.n_workers == 1:
+            _init_worker(self.generator_config, self.analyzer_config)
+            for iReplication, truth in enumerate(truths):
+                try:
+                    yield iReplication, _replication(iReplication, truth, prior_sd, settings), None
+                except Exception as err:
+                    yield iReplication, None, err
+            return
+        with ProcessPoolExecutor(max_workers=self.n_workers, initializer=_init_worker,
+                                 initargs=(self.generator_config, self.analyzer_config)) as executor:
+            futures = {executor.submit(_replication, iReplication, truth, prior_sd, settings):
+                       iReplication for iReplication, truth in enumerate(truths)}
+            for future in as_completed(futures):
+                try:
+                    yield futures[future], future.result(), None
+                except Exception as err:
+                    yield futures[future], None, err
+
+    def InternalRun(self):
+        prior = self._prior_draws()
+        n_draws = min(len(a_draws) for a_draws in prior.values())
+        n_replications = n_draws if self.n_replications is None else int(self.n_replications)
+        if n_replications > n_draws:
+            logger.error("{} replications requested but only {} prior draws".format(
+                n_replications, n_draws))
+            return False
+        prior_sd = {a_name: float(np.std(a_draws, ddof=1)) for a_name, a_draws in prior.items()}
+        truths = [{a_name: float(prior[a_name][iDraw]) for a_name in self.parameters}
+                  for iDraw in range(n_replications)]
+        settings = {'parameters': self.parameters, 'generated_data': self.generated_data,
+                    'size_name': self.size_name, 'thin': self.thin, 'seed': self.seed}
+
+        logger.info("Running {} replications with {} workers".format(n_replications, self.n_workers))
+        replications = [None]*n_replications
+        failed = []
+        output = None if self.output_file is None else open(self.output_file, 'w')
+        try:
+            for iDone, (iReplication, result, err) in enumerate(
+                    self._run_replications(truths, prior_sd, settings)):
+                if err is not None:
+                    logger.error("Replication {} failed: {}".format(iReplication, err))
+                    failed.append(iReplication)
+                    continue
+                replications[iReplication] = result
+                if output is not None:
+                    output.write(json.dumps(result) + "\n")
+                    output.flush()
+                logger.info("Replication {} done ({}/{}): ranks {}".format(
+                    iReplication, iDone + 1, n_replications, result['rank']))
+        finally:
+            if output is not None:
+                output.close()
+
+        replications = [a_result for a_result in replications if a_result is not None]
+        self.results = {'replications': replications, 'prior_sd': prior_sd,
+                        'failed': sorted(failed), 'seeds': {'seed': self.seed}}
+        for a_key in ('rank', 'z_score', 'shrinkage'):
+            self.results[a_key] = {a_name: np.array([a_result[a_key][a_name] for a_result in replications])
+                                   for a_name in self.parameters}
+        return len(replications) > 0
@@ -4,3 +4,4 @@
 from __future__ import absolute_import
 
 from .correlation import correlation
+from .SimulationBasedCalibration import SimulationBasedCalibration
@@ -5,7 +5,7 @@ Date: 11/26/2018
 '''
 
 from __future__ import absolute_import
-import math
+import numpy as np
 
 from morpho.utilities import morphologging, reader, pystanLoader
 from morpho.processors import BaseProcessor
@@ -23,7 +23,7 @@ class correlation(BaseProcessor):
         isOutput : False for no output. True by default.
 
     Input:
-        data: dictionary containing stan output
+        data: dictionary or SampleTable containing stan output
 
     Results:
         results: list containing correlation matrix
@@ -44,38 +44,13 @@ class correlation(BaseProcessor):
 
     def InternalRun(self):
 
-        mean = []
-        meanmean = []
-        sd = []
-        for iName, name1 in enumerate(self.namedata):
-            subdata1 = self.data[str(name1)]
-            is_sample = self.data["is_sample"]
-            onedimsum = 0
-            isample = 0
-            for iValue, value in enumerate(subdata1):
-                if is_sample[iValue]:
-                    onedimsum += value
-                    isample += 1
-            mean.append(float(onedimsum)/isample)
-            meanmean.append([])
-            # Calculate E(xy).
-            for jName, name2 in enumerate(self.namedata):
-                subdata2 = self.data[str(name2)]
-                twodimsum = 0
-                for iValue in range(len(subdata2)):
-                    if is_sample[iValue]:
-                        twodimsum += subdata1[iValue]*subdata2[iValue]
-                meanmean[iName].append(float(twodimsum)/isample)
-
-            sd.append(math.sqrt(meanmean[iName][iName] - mean[iName]**2))
-        
+        # Only the post-warmup draws are used
+        is_sample = np.asarray(self.data["is_sample"]) > 0
+        values = np.array([np.asarray(self.data[str(name)], dtype=float)[is_sample]
+                           for name in self.namedata])
+
         # Calculate correlation matrix.
-        correlation = []
-        for iName in range(len(mean)):
-            correlation.append([])
-            for jName in range(len(mean)):
-                rho = (meanmean[iName][jName]-mean[iName]*mean[jName])/sd[iName]/sd[jName]
-                correlation[iName].append(rho)
+        correlation = np.atleast_2d(np.corrcoef(values)).tolist()
         logger.debug("Correlation matrix calculated successfully for interested parameters.")
         if self.isOutput:
             print("{:10}".format(""), end='')
@@ -0,0 +1,147 @@
+'''
+Benchmark of the log density and gradient evaluations of a Stan model
+Date: 10/18/26
+'''
+
+from __future__ import absolute_import
+
+import os
+import time
+
+import numpy as np
+
+from morpho.utilities import morphologging, reader, pystanLoader, seeding
+from morpho.processors.sampling import PyStanSamplingProcessor
+logger = morphologging.getLogger(__name__)
+
+__all__ = []
+__all__.append(__name__)
+
+
+class StanGradientBenchmark(PyStanSamplingProcessor):
+    '''
+    Measure the cost of the log density (log_prob) and gradient (grad_log_prob)
+    evaluations of a Stan model on its data, and estimate the wall time of
+    its sampling.
+    The model is taken from the cache of the PyStanSamplingProcessor: the model,
+    cache, data and sampling parameters (iter, warmup, chain, n_jobs) are the
+    same as for the PyStanSamplingProcessor, so that the configuration of the
+    sampling to benchmark can be used as it is.
+    A short pilot sampling gives the number of leapfrog steps (gradient
+    evaluations) per iteration during the warmup and the sampling.
+
+    Parameters:
+        model_code (required): location of the Stan model
+        iter (required): total number of iterations of the sampling to estimate
+        warmup: number of warmup iterations of the sampling to estimate (default=iter/2)
+        chain: number of chains of the sampling to estimate (default=1)
+        n_jobs: number of chains run in parallel (default=-1: number of CPUs)
+        n_points: number of random points of the unconstrained space where the
+            evaluations are timed; the points are drawn uniformly in (-2, 2) as the
+            Stan initial values (default=20)
+        n_repeats: number of evaluations timed per point (default=10)
+        percentiles: percentiles of the latencies reported (default=[50, 90, 99])
+        pilot_iter: number of iterations (half of them warmup) of the pilot sampling (default=200)
+        seed: seed of the pilot sampling and of the random points (default=random seed)
+
+    Input:
+        data: dictionary containing model input data
+
+    Results:
+        results: dictionary containing the number of unconstrained parameters, the
+            "log_prob" and "grad_log_prob" evaluations per second and latencies (in s),
+            the mean number of leapfrog steps per warmup and sampling iteration of the
+            pilot, the estimated number of gradient evaluations and wall time (in s)
+            of the sampling, and the "seeds" used
+    '''
+
+    def InternalConfigure(self, params):
+        if not super().InternalConfigure(params):
+            return False
+        self.n_points = int(reader.read_param(params, 'n_points', 20))
+        self.n_repeats = int(reader.read_param(params, 'n_repeats', 10))
+        self.percentiles = reader.read_param(params, 'percentiles', [50, 90, 99])
+        self.pilot_iter = int(reader.read_param(params, 'pilot_iter', 200))
+        if self.pilot_iter < 2:
+            logger.error("The pilot sampling needs at least 2 iterations")
+            return False
+        return True
+
+    def _pilot(self):
+        '''
+        Run a short sampling of one chain
+        '''
+        pilot_args = dict(self.gen_arg_dict(), iter=self.pilot_iter,
+                          warmup=self.pilot_iter//2, chains=1, n_jobs=1,
+                          chain_id=self.chain_id[:1],
+                          seed=seeding.derive_seed(self.seed, 'pilot'))
+        if isinstance(pilot_args.get('init'), list):
+            pilot_args['init'] = pilot_args['init'][:1]
+        logger.info("Running the pilot sampling")
+        return self._run_stan(**pilot_args)
+
+    def _time(self, function, points):
+        '''
+        Return the latencies of the evaluations of a function on the points
+        '''
+        latencies = []
+        for a_point in points:
+            for _ in range(self.n_repeats):
+                start = time.perf_counter()
+                function(a_point, adjust_transform=True)
+                latencies.append(time.perf_counter() - start)
+        return np.array(latencies)
+
+    def _report(self, latencies):
+        return {
+            'evals_per_second': 1./np.mean(latencies),
+            'mean_latency': np.mean(latencies),
+            'latency': {'p{}'.format(a_percentile): np.percentile(latencies, a_percentile)
+                        for a_percentile in self.percentiles}
+        }
+
+    def InternalRun(self):
+        self._load_model()
+        if not self._has_parameters:
+            logger.error("The model has no parameters: no gradient to benchmark")
+            return False
+        pilot = self._pilot()
+        n_upars = len(pilot.unconstrain_pars(pystanLoader.last_position(pilot)[0]))
+        rng = np.random.RandomState(seeding.derive_seed(self.seed, 'points'))
+        points = rng.uniform(-2, 2, size=(self.n_points, n_upars))
+
+        # The first evaluation (memory allocations, caches) is not timed
+        pilot.grad_log_prob(points[0], adjust_transform=True)
+        log_prob = self._report(self._time(pilot.log_prob, points))
+        grad_log_prob = self._report(self._time(pilot.grad_log_prob, points))
+
+        n_leapfrog = np.asarray(pilot.get_sampler_params(inc_warmup=True)[0]['n_leapfrog__'])
+        warmup = self.pilot_iter//2
+        leapfrog_warmup = np.mean(n_leapfrog[:warmup])
+        leapfrog_sampling = np.mean(n_leapfrog[warmup:])
+        # Gradient evaluations per chain and number of chains run one after the other
+        n_gradients = self.warmup*leapfrog_warmup + (self.iter - self.warmup)*leapfrog_sampling
+        n_workers = self.n_jobs if self.n_jobs > 0 else (os.cpu_count() or 1)
+        n_rounds = -(-self.chains//n_workers)
+        wall_time = n_rounds*n_gradients*grad_log_prob['mean_latency']
+
+        self.results = {
+            'n_unconstrained': n_upars,
+            'log_prob': log_prob,
+            'grad_log_prob': grad_log_prob,
+            'n_leapfrog': {'warmup': leapfrog_warmup, 'sampling': leapfrog_sampling},
+            'gradient_evaluations': self.chains*n_gradients,
+            'estimated_wall_time': wall_time,
+            'seeds': {'seed': self.seed}
+        }
+        logger.info("{} unconstrained parameters".format(n_upars))
+        for a_name in ('log_prob', 'grad_log_prob'):
+            logger.info("{}: {:.1f} evals/s; latencies: {}".format(
+                a_name, self.results[a_name]['evals_per_second'],
+                ", ".join("{}={:.3g}s".format(a_key, a_value)
+                          for a_key, a_value in self.results[a_name]['latency'].items())))
+        logger.info("Leapfrog steps per iteration: {:.1f} (warmup), {:.1f} (sampling)".format(
+            leapfrog_warmup, leapfrog_sampling))
+        logger.info("Estimated sampling wall time: {:.1f}s ({:.3g} gradient evaluations)".format(
+            wall_time, self.chains*n_gradients))
+        return True
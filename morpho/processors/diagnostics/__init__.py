@@ -4,3 +4,4 @@
 from __future__ import absolute_import
 
 from .StanDiagnostics import StanDiagnostics
+from .StanGradientBenchmark import StanGradientBenchmark
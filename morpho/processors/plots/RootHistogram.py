@@ -4,6 +4,8 @@ Authors: M. Guigue
 Date: 06/26/18
 '''
 
+import numpy as np
+
 from morpho.utilities import morphologging, reader
 logger = morphologging.getLogger(__name__)
 
@@ -41,8 +43,8 @@ class RootHistogram(object):
         return self.histo.GetNbinsX()
 
     def Fill(self, input_data):
-        if not isinstance(input_data, list):
-            logger.error("Data given <{}> not a list")
+        if not isinstance(input_data, (list, np.ndarray)):
+            logger.error("Data given <{}> not a list".format(input_data))
             raise
         if self.x_min > self.x_max:
             logger.warning("Inappropriate x range: {}>{}".format(
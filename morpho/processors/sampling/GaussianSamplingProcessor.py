@@ -6,7 +6,7 @@ Date: 06/26/18
 
 from __future__ import absolute_import
 
-from morpho.utilities import morphologging, reader
+from morpho.utilities import morphologging, reader, seeding
 from morpho.processors import BaseProcessor
 logger = morphologging.getLogger(__name__)
 
@@ -24,12 +24,14 @@ class GaussianSamplingProcessor(BaseProcessor):
         iter (required): total number of iterations (warmup and sampling)
         mean: mean of the gaussian (default=0)
         width: width of the gaussian (default=0)
+        seed: seed of TRandom3 (default=random seed)
 
     Input:
         None
 
     Results:
         results: dictionary containing the result of the sampling of the parameters of interest
+            and the "seeds" used
     '''
 
     def InternalConfigure(self, input):
@@ -38,13 +40,14 @@ class GaussianSamplingProcessor(BaseProcessor):
         self.width = reader.read_param(input, "width", 1.)
         if self.width <= 0.:
             raise ValueError("Width is negative or null!")
+        self.seed = seeding.processor_seed(input, self.name)
         return True
 
     def InternalRun(self):
         from ROOT import TRandom3
-        ran = TRandom3()
+        ran = TRandom3(self.seed)
         data = []
         for _ in range(self.iter):
             data.append(ran.Gaus(self.mean, self.width))
-        self.results = {'x': data}
+        self.results = {'x': data, 'seeds': {'seed': self.seed}}
         return True
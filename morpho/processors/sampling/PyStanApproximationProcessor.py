@@ -0,0 +1,65 @@
+'''
+PyStan posterior approximation processor
+Date: 10/18/26
+'''
+
+from __future__ import absolute_import
+
+from morpho.utilities import morphologging, reader, pystanLoader
+from morpho.processors.sampling import PyStanSamplingProcessor
+logger = morphologging.getLogger(__name__)
+
+__all__ = []
+__all__.append(__name__)
+
+
+class PyStanApproximationProcessor(PyStanSamplingProcessor):
+    '''
+    Fast approximation of the posterior using a model compiled by PyStan:
+    the posterior mode (optimizing) or draws of the ADVI approximation (vb).
+    The model, cache, data and interestParams parameters are the same as
+    for the PyStanSamplingProcessor.
+
+    Parameters:
+        model_code (required): location of the Stan model
+        method: "optimizing" or "vb" (default="vb")
+        output_samples: number of draws of the vb approximation (default=1000)
+        interestParams: parameters to be saved in the results variable
+        keep_shape: store each indexed parameter as one array of shape (draws, *dims)
+            instead of one entry per flatname (default=False)
+        seed: seed of the optimization, ADVI and draws (default=random seed)
+
+    Input:
+        data: dictionary containing model input data
+
+    Results:
+        results: SampleTable (one chain, without warmup) containing the mode or
+            the approximated draws of the parameters of interest
+    '''
+
+    def InternalConfigure(self, params):
+        # No sampling iterations are run
+        params = dict({'iter': 0}, **params)
+        if not super().InternalConfigure(params):
+            return False
+        self.method = reader.read_param(params, 'method', 'vb')
+        if self.method not in ('optimizing', 'vb'):
+            logger.error("Unknown method <{}>".format(self.method))
+            return False
+        self.output_samples = int(reader.read_param(params, 'output_samples', 1000))
+        return True
+
+    def InternalRun(self):
+        self._load_model()
+        seed = self.seed
+        if self.method == 'optimizing':
+            mode, lp_prob = self._optimize(seed)
+            flatnames, values = pystanLoader.flatten(mode)
+            self.results = pystanLoader.table_from_draws(
+                self.__dict__, flatnames, values, [lp_prob])
+        else:
+            flatnames, draws, lp_prob = self._variational(seed, self.output_samples)
+            self.results = pystanLoader.table_from_draws(
+                self.__dict__, flatnames, draws, lp_prob)
+        self.results["seeds"] = {'seed': seed}
+        return True
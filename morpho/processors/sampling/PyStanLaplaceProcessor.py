@@ -0,0 +1,119 @@
+'''
+Laplace approximation processor using a model compiled by PyStan
+Date: 10/18/26
+'''
+
+from __future__ import absolute_import
+
+import numpy as np
+
+from morpho.utilities import morphologging, reader, pystanLoader
+from morpho.processors.sampling import PyStanApproximationProcessor
+logger = morphologging.getLogger(__name__)
+
+__all__ = []
+__all__.append(__name__)
+
+
+class PyStanLaplaceProcessor(PyStanApproximationProcessor):
+    '''
+    Laplace approximation of the posterior: gaussian approximation around the
+    posterior mode in the unconstrained space, with the covariance given by
+    the inverse of the (numerical) Hessian of the log density.
+    The mode found by optimizing is refined with Newton steps on the log
+    density including the Jacobian of the transforms; the draws are
+    transformed back into the constrained space.
+    The model, cache, data and interestParams parameters are the same as
+    for the PyStanSamplingProcessor.
+
+    Parameters:
+        model_code (required): location of the Stan model
+        output_samples: number of draws of the approximation (default=1000)
+        newton_steps: maximum number of Newton steps refining the mode (default=10)
+        hessian_step: relative step of the finite differences of the gradient (default=1e-5)
+        interestParams: parameters to be saved in the results variable
+        keep_shape: store each indexed parameter as one array of shape (draws, *dims)
+            instead of one entry per flatname (default=False)
+        seed: seed of the optimization and of the draws (default=random seed)
+
+    Input:
+        data: dictionary containing model input data
+
+    Results:
+        results: SampleTable (one chain, without warmup) containing the draws of the
+            parameters of interest
+    '''
+
+    def InternalConfigure(self, params):
+        if not super().InternalConfigure(params):
+            return False
+        self.newton_steps = int(reader.read_param(params, 'newton_steps', 10))
+        self.hessian_step = float(reader.read_param(params, 'hessian_step', 1e-5))
+        return True
+
+    def _hessian(self, fit, upar):
+        '''
+        Hessian of the log density, by central differences of its gradient
+        '''
+        hessian = np.empty((len(upar), len(upar)))
+        for i in range(len(upar)):
+            step = self.hessian_step * max(1., abs(upar[i]))
+            shift = np.zeros(len(upar))
+            shift[i] = step
+            hessian[:, i] = (np.asarray(fit.grad_log_prob(upar + shift, adjust_transform=True)) -
+                             np.asarray(fit.grad_log_prob(upar - shift, adjust_transform=True))) / (2*step)
+        return (hessian + hessian.T) / 2
+
+    def _refine_mode(self, fit, upar):
+        '''
+        Newton steps (with backtracking) towards the mode of the log density
+        '''
+        log_prob = fit.log_prob(upar, adjust_transform=True)
+        for _ in range(self.newton_steps):
+            gradient = np.asarray(fit.grad_log_prob(upar, adjust_transform=True))
+            if np.max(np.abs(gradient)) < 1e-8:
+                break
+            try:
+                step = np.linalg.solve(self._hessian(fit, upar), gradient)
+            except np.linalg.LinAlgError:
+                break
+            scale = 1.
+            while scale > 1e-4:
+                candidate = upar - scale*step
+                candidate_log_prob = fit.log_prob(candidate, adjust_transform=True)
+                if candidate_log_prob >= log_prob:
+                    upar, log_prob = candidate, candidate_log_prob
+                    break
+                scale /= 2
+            else:
+                break
+        return upar
+
+    def InternalRun(self):
+        self._load_model()
+        seed = self.seed
+        rng = np.random.RandomState(seed)
+        mode, _ = self._optimize(seed)
+        fit = self.stanModel.fit_class(self.data, seed)
+        upar = self._refine_mode(fit, np.asarray(fit.unconstrain_pars(mode), dtype=float))
+        try:
+            # Cholesky factor of the precision matrix (-Hessian)
+            precision = np.linalg.cholesky(-self._hessian(fit, upar))
+        except np.linalg.LinAlgError:
+            logger.error("Hessian not negative definite at the mode: cannot use the Laplace approximation")
+            return False
+        normal = rng.normal(size=(self.output_samples, len(upar)))
+        # u = mode + L^-T z has the covariance (L L^T)^-1
+        udraws = upar + np.linalg.solve(precision.T, normal.T).T
+        flatnames = None
+        draws = []
+        lp_prob = []
+        for a_draw in udraws:
+            names, values = pystanLoader.flatten(pystanLoader.constrain_pars(fit, a_draw))
+            flatnames = flatnames or names
+            draws.append(values)
+            lp_prob.append(fit.log_prob(a_draw, adjust_transform=True))
+        self.results = pystanLoader.table_from_draws(
+            self.__dict__, flatnames, np.array(draws), lp_prob)
+        self.results["seeds"] = {'seed': seed}
+        return True
@@ -0,0 +1,204 @@
+'''
+Fits of a PyStan model to several datasets, run in a process pool
+Date: 10/18/26
+'''
+
+from __future__ import absolute_import
+
+import copy
+import glob
+import os
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from morpho.utilities import morphologging, reader, seeding
+from morpho.processors.sampling import PyStanSamplingProcessor
+logger = morphologging.getLogger(__name__)
+
+__all__ = []
+__all__.append(__name__)
+
+# IO processors used to read the datasets, by file extension
+io_processors = {
+    '.json': 'IOJSONProcessor',
+    '.yaml': 'IOYAMLProcessor',
+    '.csv': 'IOCVSProcessor',
+    '.r': 'IORProcessor',
+    '.root': 'IOROOTProcessor'
+}
+
+# Configuration of the fits in the worker processes
+_worker_config = {}
+
+
+def _init_worker(fit_config):
+    '''
+    Load the model once per worker process: the processors of the fits
+    then take it from the registry of the loaded models
+    '''
+    _worker_config.clear()
+    _worker_config.update(fit_config)
+    processor = PyStanSamplingProcessor("worker")
+    processor.Configure(copy.deepcopy(fit_config))
+    processor._load_model()
+
+
+def _read_dataset(filename, variables, io_config):
+    '''
+    Read a dataset with the IO processor of its extension
+    '''
+    from morpho.processors import IO
+    extension = os.path.splitext(filename)[1].lower()
+    if extension not in io_processors:
+        raise ValueError("No IO processor for {}".format(filename))
+    processor = getattr(IO, io_processors[extension])(os.path.basename(filename))
+    processor.Configure(dict(io_config, filename=filename, variables=variables, action='read'))
+    if not processor.Run():
+        raise RuntimeError("Cannot read {}".format(filename))
+    return processor.data
+
+
+def _fit(name, dataset, seed):
+    '''
+    Fit a dataset: either a dictionary of data or the arguments of _read_dataset
+    '''
+    if not isinstance(dataset, dict):
+        dataset = _read_dataset(*dataset)
+    config = copy.deepcopy(_worker_config)
+    config['input_data'] = dict(config.get('input_data', {}), **dataset)
+    config['seed'] = seed
+    if config.get('checkpoint_dir') is not None:
+        config['checkpoint_dir'] = os.path.join(config['checkpoint_dir'], str(name))
+    processor = PyStanSamplingProcessor(str(name))
+    if not processor.Configure(config) or not processor.Run():
+        raise RuntimeError("Fit of <{}> failed".format(name))
+    # The lazy columns refer to the StanFit: load them before sending the table back
+    return processor.results.materialize()
+
+
+class PyStanMultiFitProcessor(PyStanSamplingProcessor):
+    '''
+    Fit the same Stan model to several datasets, concurrently in a pool of
+    worker processes; the model is compiled (or loaded from the cache) once,
+    and loaded only once per worker.
+    The model, cache, sampling and interestParams parameters are the same as
+    for the PyStanSamplingProcessor and apply to all the fits; the input_data
+    are common to all the datasets.
+
+    Parameters:
+        model_code (required): location of the Stan model
+        iter (required): total number of iterations (warmup and sampling)
+        datasets: list of data dictionaries (indexed by their position) or dictionary
+            of data dictionaries (indexed by their key)
+        data_dir: directory of the datasets files, read with the IO processor of their
+            extension (.json, .yaml, .csv, .r or .root) and indexed by their name
+            without extension
+        data_pattern: pattern of the datasets files in data_dir (default="*.json")
+        data_variables: variables read from the datasets files (required with data_dir)
+        io_config: additional configuration of the IO processors (e.g. tree_name)
+        n_workers: number of worker processes; 1 runs the fits in this process
+            (default=number of CPUs)
+        seed: seed from which the seeds of the fits are derived (default=random seed)
+        checkpoint_dir: the checkpoints of each fit are saved in <checkpoint_dir>/<dataset>
+
+    Input:
+        data: dictionary containing the input data common to all the datasets
+        datasets: list or dictionary of data dictionaries
+
+    Results:
+        results: dictionary of the SampleTable of each dataset, by dataset;
+            the datasets whose fit failed are listed in "failed" (attribute)
+    '''
+
+    @property
+    def datasets(self):
+        return self._datasets
+
+    @datasets.setter
+    def datasets(self, value):
+        if isinstance(value, (list, dict)):
+            self._datasets = value
+        else:
+            logger.warning("Not a list or dict: {}".format(type(value).__name__))
+
+    def __init__(self, name):
+        super().__init__(name)
+        self._datasets = None
+
+    def InternalConfigure(self, params):
+        self.fit_config = {a_key: a_value for a_key, a_value in params.items()
+                           if a_key not in ('datasets', 'data_dir', 'data_pattern', 'data_variables',
+                                            'io_config', 'n_workers', 'seed')}
+        if not super().InternalConfigure(params):
+            return False
+        if reader.read_param(params, 'datasets', None) is not None:
+            self.datasets = reader.read_param(params, 'datasets', None)
+        self.data_dir = reader.read_param(params, 'data_dir', None)
+        self.data_pattern = reader.read_param(params, 'data_pattern', '*.json')
+        self.data_variables = reader.read_param(params, 'data_variables', None)
+        if self.data_dir is not None and self.data_variables is None:
+            logger.error("data_variables required to read the datasets of {}".format(self.data_dir))
+            return False
+        self.io_config = reader.read_param(params, 'io_config', {})
+        self.n_workers = int(reader.read_param(params, 'n_workers', os.cpu_count() or 1))
+        return True
+
+    def _list_datasets(self):
+        '''
+        Return the datasets by name: data dictionaries or arguments of _read_dataset
+        '''
+        datasets = OrderedDict()
+        if isinstance(self._datasets, dict):
+            datasets.update(self._datasets)
+        elif self._datasets is not None:
+            datasets.update(enumerate(self._datasets))
+        if self.data_dir is not None:
+            for filename in sorted(glob.glob(os.path.join(self.data_dir, self.data_pattern))):
+                name = os.path.splitext(os.path.basename(filename))[0]
+                datasets[name] = (filename, self.data_variables, self.io_config)
+        return datasets
+
+    def _run_fits(self, datasets, fit_config):
+        '''
+        Yield the results of the fits as they are done
+        '''
+        seeds = {name: seeding.derive_seed(self.seed, name) for name in datasets}
+        if self.n_workers == 1:
+            _init_worker(fit_config)
+            for name, dataset in datasets.items():
+                try:
+                    yield name, _fit(name, dataset, seeds[name]), None
+                except Exception as err:
+                    yield name, None, err
+            return
+        with ProcessPoolExecutor(max_workers=self.n_workers, initializer=_init_worker,
+                                 initargs=(fit_config,)) as executor:
+            futures = {executor.submit(_fit, name, dataset, seeds[name]): name
+                       for name, dataset in datasets.items()}
+            for future in as_completed(futures):
+                try:
+                    yield futures[future], future.result(), None
+                except Exception as err:
+                    yield futures[future], None, err
+
+    def InternalRun(self):
+        datasets = self._list_datasets()
+        if not datasets:
+            logger.error("No datasets to fit")
+            return False
+        # Compile the model (or load it from the cache) before starting the workers
+        self._load_model()
+        fit_config = dict(self.fit_config, input_data=dict(self.data))
+        logger.info("Fitting {} datasets with {} workers".format(len(datasets), self.n_workers))
+        results = {}
+        self.failed = []
+        for name, table, err in self._run_fits(datasets, fit_config):
+            if err is not None:
+                logger.error("Fit of <{}> failed: {}".format(name, err))
+                self.failed.append(name)
+                continue
+            results[name] = table
+            logger.info("Fit of <{}> done ({}/{})".format(name, len(results) + len(self.failed),
+                                                          len(datasets)))
+        self.results = OrderedDict((name, results[name]) for name in datasets if name in results)
+        return len(self.results) > 0
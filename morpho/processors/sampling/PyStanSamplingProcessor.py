@@ -7,18 +7,19 @@ Date: 06/26/18
 from __future__ import absolute_import
 
 import os
-import random
-import re
-from hashlib import md5
+import shutil
+import tempfile
 from inspect import getargspec
-from datetime import datetime
+
+import numpy as np
 
 try:
     import pystan
 except ImportError:
     pass
 
-from morpho.utilities import morphologging, reader, pystanLoader
+from morpho.utilities import morphologging, reader, chunkedSampling, progress, pystanLoader, resultCache, seeding, stanCache, stanCsv, stanIncludes
+from morpho.utilities.checkpoint import fingerprint
 from morpho.processors import BaseProcessor
 logger = morphologging.getLogger(__name__)
 logger_stan = morphologging.getLogger('pystan')
@@ -40,18 +41,49 @@ class PyStanSamplingProcessor(BaseProcessor):
         iter (required): total number of iterations (warmup and sampling)
         warmup: number of warmup iterations (default=iter/2)
         chain: number of chains (default=1)
+        chain_id: id of the first chain, to rerun a chain alone (default=0)
         n_jobs: number of parallel cores running (default=1)
-        interestParams: parameters to be saved in the results variable
+        seed: seed of the sampling (default=random seed, recorded in the results)
+        interestParams: parameters to be saved in the results variable: names, flatnames,
+            slices ("theta[1:100]", Stan 1-based bounds) or wildcards ("sigma_*")
+        diagnostics: sampler diagnostics to be saved in the results variable (default=all)
+        keep_shape: save indexed parameters as arrays of shape (draws, *dims) (default=False)
+        algorithm: "NUTS", "HMC" or "Fixed_param" (default for models without parameters,
+            without warmup nor chunks, checkpoints, pre_stage and warm_start)
+        target_rhat, target_ess: sample in chunks until the split-Rhat is below/the bulk ESS
+            is above the target (value or dictionary per parameter)
+        chunk_iter: sampling iterations per chunk (default=iter-warmup)
+        chunk_warmup: warmup iterations of the following chunks (default=0)
+        readapt_warmup: warmup iterations of the following chunks without the adapted
+            metric (PyStan<2.18) (default=min(warmup, 100))
+        max_iter: maximum number of iterations per chain (default=10*iter)
+        checkpoint_dir: save the chunks in this directory and resume from them (default=None)
         no_cache: don't create cache
         force_recreate: force the cache regeneration
+        cache_max_size, cache_max_entries: limits of the model cache (MB, number of models)
+        compile_profile: "default", "debug" (-O0) or "release" (-O3)
+        march_native: optimize the compiled model for the local CPU (default=False)
+        result_cache: reuse the cached results of the same sampling with an explicit seed
+            (default=False)
+        result_cache_dir: location of the cached results (default=<cache_dir>/results)
+        result_cache_max_size, result_cache_max_entries: limits of the result cache
         init: initial values for the parameters
+        sample_file: file where Stan writes the draws
+        progress_interval: report the progress of the chains every progress_interval seconds
+        progress_file: JSON file where the progress reports are written
         control: PyStan sampling settings
+        warm_start_warmup: warmup iterations after a warm start (default=min(warmup, 100))
+        pre_stage: "optimizing" or "vb": initialize the chains from the posterior mode or
+            the ADVI approximation (default=None)
+        pre_stage_jitter: jitter of the initial values around the mode (default=0.1)
 
     Input:
         data: dictionary containing model input data
+        warm_start: results (or "sampler_state") of a previous sampling to start from
 
     Results:
-        results: dictionary containing the result of the sampling of the parameters of interest
+        results: SampleTable containing the result of the sampling of the parameters of
+            interest, the final "sampler_state" and the "seeds" used
     '''
     @property
     def data(self):
@@ -65,9 +97,23 @@ class PyStanSamplingProcessor(BaseProcessor):
         else:
             logger.warning("Not a dict: {}".format(input_dict))
 
+    @property
+    def warm_start(self):
+        return self._warm_start
+
+    @warm_start.setter
+    def warm_start(self, results):
+        if isinstance(results, dict) and "sampler_state" in results:
+            results = results["sampler_state"]
+        if isinstance(results, dict) and "init" in results and "stepsize" in results:
+            self._warm_start = results
+        else:
+            logger.warning("No sampler state in {}".format(type(results).__name__))
+
     def __init__(self, name):
         super().__init__(name)
         self._data = {}
+        self._warm_start = None
 
     def gen_arg_dict(self):
         d = self.__dict__
@@ -75,6 +121,8 @@ class PyStanSamplingProcessor(BaseProcessor):
         output_dict = {k: d[k] for k in (sa.args) if k in d}
         # We need to manually add the data to the dictionary because of the setter...
         output_dict.update({'data': self.data})
+        # chain_id is only a keyword argument (**kwargs) of sampling
+        output_dict['chain_id'] = self.chain_id
         return output_dict
 
     def _init_Stan_function(self):
@@ -102,75 +150,34 @@ class PyStanSamplingProcessor(BaseProcessor):
         '''
         Create and cache stan model, or access previously cached model
         '''
-        theModel = open(self.model_code, 'r+').read()
-        match = re.findall(
-            r'\s*include\s*=\s*(?P<function_name>\w+)\s*;*', theModel)
-        if self.function_files_location is not None:
-            logger.debug('Looking for the functions to import in {}'.format(
-                self.function_files_location))
-            from os import listdir
-            from os.path import isfile, join
-            onlyfiles = [f for f in listdir(self.function_files_location) if isfile(
-                join(self.function_files_location, f))]
-        else:
-            logger.debug('No functions file location given')
-            onlyfiles = []
-        for matches in match:
-            found = False
-            for filename in onlyfiles:
-                if filename.endswith('.functions'):
-                    key = filename[:-10]
-                elif filename.endswith('.stan'):
-                    key = filename[:-5]
-                else:
-                    continue
-                if (key == matches):
-                    StanFunctions = open(
-                        self.function_files_location+'/'+filename, 'r+').read()
-                    theModel = re.sub(r'\s*include\s*=\s*'+matches+'\s*;*\n',
-                                      StanFunctions, theModel, flags=re.IGNORECASE)
-                    found = True
-                    logger.debug(
-                        'Function file <{}> to import was found'.format(matches))
-                    continue
-            if not found:
-                logger.critical(
-                    'A function <{}> to import is missing'.format(matches))
-        logger.debug('Import function files: complete')
-
-        code_hash = md5(theModel.encode('ascii')).hexdigest()
-        if self.model_name is None:
-            cache_fn = '{}/cached-model-{}.pkl'.format(
-                self.cache_dir, code_hash)
-        else:
-            cache_fn = '{}/cached-{}-{}.pkl'.format(
-                self.cache_dir, self.model_name, code_hash)
-        # Cache creation and saving?
+        # The code with the includes expanded is only generated for compilation
+        includes = stanIncludes.resolve_includes(
+            self.model_code, self.function_files_location)
+        cache = stanCache.StanModelCache(
+            self.cache_dir, self.cache_max_size, self.cache_max_entries)
         if self.force_recreate:
             logger.debug("Forced to recreate Stan cache!")
-            self._create_and_save_model(theModel, cache_fn)
-        else:
-            import pickle
-            try:
-                logger.debug("Trying to load cached StanModel")
-                self.stanModel = pickle.load(open(cache_fn, 'rb'))
-            except:
-                logger.debug("None exists -> creating Stan cache")
-                self._create_and_save_model(theModel, cache_fn)
-            else:
-                logger.debug("Using cached StanModel: {}".format(cache_fn))
-
-    def _create_and_save_model(self, theModel, cache_fn):
-        self.stanModel = pystan.StanModel(model_code=theModel)
-        if not self.no_cache:
-            cdir = os.path.dirname(cache_fn)
-            if not os.path.exists(cdir):
-                os.makedirs(cdir)
-                logger.info("Creating 'cache' folder: {}".format(cdir))
-            logger.debug("Saving Stan cache in {}".format(cache_fn))
-            import pickle
-            with open(cache_fn, 'wb') as f:
-                pickle.dump(self.stanModel, f)
+        self.stanModel = cache.get_model(includes.expand, includes.key, self.model_name,
+                                         force_recreate=self.force_recreate,
+                                         no_cache=self.no_cache,
+                                         compile_profile=self.compile_profile,
+                                         march_native=self.march_native)
+
+    @property
+    def _has_parameters(self):
+        '''
+        Check if the model declares parameters
+        '''
+        return stanIncludes.resolve_includes(
+            self.model_code, self.function_files_location).has_parameters()
+
+    def _use_fixed_param(self):
+        '''
+        Check if the Fixed_param sampler is used: when requested, or by default
+        for models without parameters
+        '''
+        return self.algorithm == 'Fixed_param' or \
+            (self.algorithm is None and not self._has_parameters)
 
     def _run_stan(self, *args, **kwargs):
         logger.info("Starting the sampling")
@@ -183,9 +190,122 @@ class PyStanSamplingProcessor(BaseProcessor):
             elif key == "init":
                 text = text + "init\t[...]\n"
         logger.info(text)
-        # returns the arguments for sampling and the result of the sampling
-        return self.stanModel.sampling(**(kwargs))
-        # return self.stanModel.sampling(**(self.gen_arg_dict()))
+        if self.progress_interval is None:
+            # returns the arguments for sampling and the result of the sampling
+            return self.stanModel.sampling(**(kwargs))
+            # return self.stanModel.sampling(**(self.gen_arg_dict()))
+        # The progress is read from the draws written by Stan
+        tmp_dir = None
+        if kwargs.get('sample_file') is None:
+            tmp_dir = tempfile.mkdtemp(prefix='morpho-')
+            kwargs['sample_file'] = os.path.join(tmp_dir, 'samples.csv')
+        chains = kwargs.get('chains', 1)
+        monitor = progress.ProgressMonitor(
+            self.name, chains, kwargs['iter'], kwargs['warmup'], self.progress_interval,
+            self.progress_file, stanCsv.chain_sample_files(kwargs['sample_file'], chains))
+        try:
+            with monitor:
+                return self.stanModel.sampling(**(kwargs))
+        finally:
+            if tmp_dir is not None:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def _checkpoint_config(self):
+        '''
+        Settings which must not change when resuming from a checkpoint
+        '''
+        config = {a_key: getattr(self, a_key) for a_key in (
+            'model_code', 'iter', 'warmup', 'chains', 'chain_id', 'interestParams', 'keep_shape',
+            'target_rhat', 'target_ess', 'chunk_iter', 'chunk_warmup', 'readapt_warmup',
+            'max_iter')}
+        config['model'] = stanIncludes.resolve_includes(
+            self.model_code, self.function_files_location).key
+        config['data'] = fingerprint(self.data)
+        # Without an explicit seed, the sampling resumes with the seed of the checkpoint
+        config['seed'] = self.params.get('seed')
+        return config
+
+    def _sample_chunk(self, chunk_args):
+        '''
+        Run a chunk of the sampling and return its draws and final sampler state
+        '''
+        stan_results = self._run_stan(**chunk_args)
+        table = pystanLoader.extract_data_from_outputdata(
+            dict(self.__dict__, warmup=chunk_args['warmup']), stan_results)
+        return table, pystanLoader.sampler_state(stan_results)
+
+    def _run_chunks(self, sampling_args):
+        '''
+        Sample in chunks until the targets are reached, with checkpoints if requested
+        '''
+        chunks = chunkedSampling.ChunkedSampling(
+            self._sample_chunk, self.iter - self.warmup, self.chunk_iter, self.chunk_warmup,
+            self.readapt_warmup, self.max_iter, self.target_rhat, self.target_ess,
+            self.checkpoint_dir,
+            self._checkpoint_config() if self.checkpoint_dir is not None else None)
+        # Without an explicit seed, a resumed sampling keeps the seed of the checkpoint
+        results = chunks.run(sampling_args, self._first_args,
+                             resume_seed=self.params.get('seed') is None)
+        self.seed = chunks.seed
+        results["seeds"] = dict(self._seeds(), chunks=chunks.chunk_seeds)
+        return results
+
+    def _first_args(self, sampling_args, n_samples):
+        '''
+        Sampling arguments of the first run, started from the warm_start state if any
+        '''
+        if self._warm_start is None:
+            if self.pre_stage is not None:
+                sampling_args = dict(sampling_args, init=self._pre_stage_inits(sampling_args))
+            return dict(sampling_args, iter=self.warmup + n_samples, warmup=self.warmup)
+        logger.info("Starting from the state of a previous sampling")
+        return chunkedSampling.continue_args(sampling_args, self._warm_start,
+                                             self.warm_start_warmup, n_samples,
+                                             self.readapt_warmup)
+
+    def _seeds(self):
+        '''
+        Seeds used by the sampling, recorded in the results
+        '''
+        return {'seed': self.seed, 'chain_id': list(self.chain_id)}
+
+    def _optimize(self, seed):
+        '''
+        Return the posterior mode (dictionary of parameters) and its log density
+        '''
+        logger.info("Looking for the posterior mode")
+        optimum = self.stanModel.optimizing(data=self.data, seed=seed, as_vector=False)
+        return optimum['par'], optimum['value']
+
+    def _variational(self, seed, n_draws):
+        '''
+        Return the flatnames, draws (shape (draws, flatnames)) and log densities
+        of the ADVI approximation of the posterior
+        '''
+        logger.info("Running the ADVI approximation of the posterior")
+        output = self.stanModel.vb(data=self.data, seed=seed, output_samples=n_draws)
+        names = list(output['sampler_param_names'])
+        values = np.array(output['sampler_params'], dtype=float).T
+        lp_prob = values[:, names.index('log_p__')] if 'log_p__' in names else None
+        keep = [iKey for iKey, a_name in enumerate(names) if not a_name.endswith('__')]
+        return [names[iKey] for iKey in keep], values[:, keep], lp_prob
+
+    def _pre_stage_inits(self, sampling_args):
+        '''
+        Initial values of the chains from the optimizing or vb pre-stage
+        '''
+        seed = seeding.derive_seed(self.seed, 'pre_stage')
+        rng = np.random.RandomState(seed)
+        if self.pre_stage == 'optimizing':
+            mode, _ = self._optimize(seed)
+            fit = self.stanModel.fit_class(self.data, seed)
+            upar = np.asarray(fit.unconstrain_pars(mode), dtype=float)
+            return [dict(pystanLoader.constrain_pars(
+                fit, upar + self.pre_stage_jitter*rng.normal(size=upar.shape)))
+                for _ in range(self.chains)]
+        flatnames, draws, _ = self._variational(seed, max(100, self.chains))
+        rows = rng.choice(len(draws), self.chains, replace=len(draws) < self.chains)
+        return [dict(pystanLoader.unflatten(flatnames, draws[iRow])) for iRow in rows]
 
     def InternalConfigure(self, params):
         self.params = params
@@ -201,15 +321,51 @@ class PyStanSamplingProcessor(BaseProcessor):
         # number of jobs to run (-1: all, 1: good for debugging)
         self.n_jobs = int(reader.read_param(params, 'n_jobs', -1))
         self.interestParams = reader.read_param(params, 'interestParams', [])
+        self.diagnostics = reader.read_param(
+            params, 'diagnostics', pystanLoader.diagnosticVariableName)
+        self.keep_shape = reader.read_param(params, 'keep_shape', False)
+        self.algorithm = reader.read_param(params, 'algorithm', None)
+        self.target_rhat = reader.read_param(params, 'target_rhat', None)
+        self.target_ess = reader.read_param(params, 'target_ess', None)
+        self.chunk_iter = int(reader.read_param(params, 'chunk_iter', self.iter - self.warmup))
+        self.chunk_warmup = int(reader.read_param(params, 'chunk_warmup', 0))
+        self.max_iter = int(reader.read_param(params, 'max_iter', 10*self.iter))
+        self.checkpoint_dir = reader.read_param(params, 'checkpoint_dir', None)
+        self.readapt_warmup = int(reader.read_param(
+            params, 'readapt_warmup', min(self.warmup, 100)))
+        self.warm_start_warmup = int(reader.read_param(
+            params, 'warm_start_warmup', min(self.warmup, 100)))
+        self.pre_stage = reader.read_param(params, 'pre_stage', None)
+        if self.pre_stage not in (None, 'optimizing', 'vb'):
+            logger.error("Unknown pre_stage <{}>".format(self.pre_stage))
+            return False
+        self.pre_stage_jitter = float(reader.read_param(params, 'pre_stage_jitter', 0.1))
         self.no_cache = reader.read_param(params, 'no_cache', False)
         self.force_recreate = reader.read_param(
             params, 'force_recreate', False)
-        self.seed = random.seed(datetime.now())
-        # logger.debug("Autoseed activated")
+        self.cache_max_size = reader.read_param(params, 'cache_max_size', None)
+        self.cache_max_entries = reader.read_param(params, 'cache_max_entries', None)
+        self.compile_profile = reader.read_param(params, 'compile_profile', 'default')
+        self.march_native = reader.read_param(params, 'march_native', False)
+        self.seed = seeding.processor_seed(params, self.name)
         logger.debug("seed = {}".format(self.seed))
+        self.result_cache = reader.read_param(params, 'result_cache', False)
+        if self.result_cache and 'seed' not in params:
+            logger.warning("No explicit seed: the results of <{}> are not cached".format(self.name))
+            self.result_cache = False
+        self.result_cache_dir = reader.read_param(
+            params, 'result_cache_dir', os.path.join(self.cache_dir, 'results'))
+        self.result_cache_max_size = reader.read_param(params, 'result_cache_max_size', None)
+        self.result_cache_max_entries = reader.read_param(params, 'result_cache_max_entries', None)
+        # Stan derives an independent stream of the seed for each chain_id
+        first_chain = int(reader.read_param(params, 'chain_id', 0))
+        self.chain_id = list(range(first_chain, first_chain + self.chains))
 
         # self.thin = reader.read_param(params, 'thin', 1)
         self.init_per_chain = reader.read_param(params, 'init', '')
+        self.sample_file = reader.read_param(params, 'sample_file', None)
+        self.progress_interval = reader.read_param(params, 'progress_interval', None)
+        self.progress_file = reader.read_param(params, 'progress_file', None)
 
         self.init = self._init_Stan_function()
         if isinstance(reader.read_param(params, 'control', None), dict):
@@ -219,11 +375,104 @@ class PyStanSamplingProcessor(BaseProcessor):
                 logger.debug("stan.run.control should be a dict: {}", str(reader.read_param(yd, 'control', None)))
         return True
 
+    def Prepare(self, executor):
+        '''
+        Compile or load the Stan model in the background, unless the results
+        are in the result cache
+        '''
+        if self.result_cache and self._cached_results(self._result_key()) is not None:
+            logger.debug("Results of <{}> cached: the model is not loaded".format(self.name))
+            return None
+        self._model_future = executor.submit(self._stan_cache)
+        return self._model_future
+
+    def _load_model(self):
+        if getattr(self, '_model_future', None) is not None:
+            logger.debug("Waiting for the Stan model")
+            # Raises the exceptions of the background preparation
+            self._model_future.result()
+            self._model_future = None
+        else:
+            self._stan_cache()
+
+    def _result_key(self):
+        '''
+        Key of the results in the result cache
+        '''
+        includes = stanIncludes.resolve_includes(
+            self.model_code, self.function_files_location)
+        settings = {a_key: getattr(self, a_key) for a_key in (
+            'interestParams', 'diagnostics', 'keep_shape', 'target_rhat', 'target_ess',
+            'chunk_iter', 'chunk_warmup', 'readapt_warmup', 'max_iter', 'pre_stage',
+            'pre_stage_jitter', 'warm_start_warmup')}
+        settings['warm_start'] = self._warm_start
+        return resultCache.result_key(includes.key, self.data, self.gen_arg_dict(),
+                                      self.seed, settings)
+
+    def _result_cache(self):
+        return resultCache.SamplingResultCache(
+            self.result_cache_dir, self.result_cache_max_size, self.result_cache_max_entries)
+
+    def _cached_results(self, key):
+        '''
+        Return the results stored in the result cache with this key, or None
+        '''
+        hit = getattr(self, '_result_hit', None)
+        if hit is not None and hit[0] == key:
+            return hit[1]
+        results = self._result_cache().load_results(key)
+        if results is not None:
+            self._result_hit = (key, results)
+        return results
+
     def InternalRun(self):
-        self._stan_cache()
-        stan_results = self._run_stan(**(self.gen_arg_dict()))
+        if not self.result_cache:
+            return self._sample()
+        # The input data may have changed since the preparation
+        key = self._result_key()
+        results = self._cached_results(key)
+        if results is not None:
+            logger.info("Using the cached results {}".format(key))
+            self.results = results
+            return True
+        if not self._sample():
+            return False
+        self._result_cache().save_results(key, self.results, processor=self.name)
+        return True
+
+    def _sample(self):
+        self._load_model()
+        sampling_args = self.gen_arg_dict()
+        conf = self.__dict__
+        if self._use_fixed_param():
+            # No adaptation needed: only the sampling iterations are run
+            logger.info("Using the Fixed_param sampler without warmup")
+            ignored = [a_key for a_key in ('target_rhat', 'target_ess', 'checkpoint_dir',
+                                           'pre_stage', '_warm_start')
+                       if getattr(self, a_key) is not None]
+            if ignored:
+                logger.warning("Options not used by the Fixed_param sampler: {}".format(
+                    ", ".join(a_key.lstrip('_') for a_key in ignored)))
+            sampling_args.update({'algorithm': 'Fixed_param',
+                                  'iter': self.iter - self.warmup,
+                                  'warmup': 0})
+            conf = dict(conf, warmup=0)
+        elif self.target_rhat is not None or self.target_ess is not None or \
+                self.checkpoint_dir is not None:
+            self.results = self._run_chunks(sampling_args)
+            return True
+        else:
+            sampling_args = self._first_args(sampling_args, self.iter - self.warmup)
+            conf = dict(conf, warmup=sampling_args['warmup'])
+        stan_results = self._run_stan(**sampling_args)
         logger.debug("Stan Results:\n"+str(stan_results))
-        # Put the data into a nice dictionary
+        # Put the data into a nice (lazy) dictionary
         self.results = pystanLoader.extract_data_from_outputdata(
-            self.__dict__, stan_results)
+            conf, stan_results)
+        if sampling_args.get('algorithm') != 'Fixed_param':
+            # Fixed_param has no step size nor metric to continue from
+            self.results.add_lazy_entry(
+                "sampler_state", lambda: pystanLoader.sampler_state(stan_results))
+        self.results["seeds"] = self._seeds()
         return True
+
@@ -9,7 +9,10 @@ try:
 except ImportError:
     pass
 
-from morpho.utilities import morphologging, reader
+import numpy as np
+
+from morpho.utilities import morphologging, progress, reader, seeding, summary
+from morpho.utilities.sampleTable import SampleTable
 from morpho.processors import BaseProcessor
 logger = morphologging.getLogger(__name__)
 
@@ -33,13 +36,18 @@ class RooFitLikelihoodSampler(BaseProcessor):
         chain: number of chains (default=1)
         n_jobs: number of parallel cores running (default=1)
         binned: should do binned analysis (default=false)
+        seed: seed of the RooFit random generator (default=random seed)
+        progress_interval: report the phase (fit, sampling, done) and elapsed time every
+            progress_interval seconds (default=None: no report)
+        progress_file: JSON file where the progress reports are written (default=None)
         options: other options
 
     Input:
         data: dictionary containing model input data
 
     Results:
-        results: dictionary containing the result of the sampling of the parameters of interest
+        results: SampleTable containing the result of the sampling of the parameters of interest
+            and the "seeds" used
     '''
 
     def _defineDataset(self, wspace):
@@ -94,9 +102,22 @@ class RooFitLikelihoodSampler(BaseProcessor):
         self.numCPU = int(reader.read_param(config_dict, "n_jobs", 1))
         self.binned = int(reader.read_param(config_dict, "binned", False))
         self.options = reader.read_param(config_dict, "options", dict())
+        self.seed = seeding.processor_seed(config_dict, self.name)
+        self.progress_interval = reader.read_param(config_dict, "progress_interval", None)
+        self.progress_file = reader.read_param(config_dict, "progress_file", None)
         return True
 
     def InternalRun(self):
+        if self.progress_interval is None:
+            return self._sample(None)
+        # The Markov chain is built by RooStats in one call: only the phases are reported
+        monitor = progress.ProgressMonitor(self.name, 1, self.iter, self.warmup,
+                                           self.progress_interval, self.progress_file)
+        with monitor:
+            return self._sample(monitor)
+
+    def _sample(self, monitor):
+        ROOT.RooRandom.randomGenerator().SetSeed(self.seed)
         wspace = ROOT.RooWorkspace()
         wspace = self._defineDataset(wspace)
         wspace = self.definePdf(wspace)
@@ -113,6 +134,8 @@ class RooFitLikelihoodSampler(BaseProcessor):
         logger.debug("Creating likelihood")
         nll = pdf.createNLL(dataset, ROOT.RooFit.NumCPU(self.numCPU))
 
+        if monitor is not None:
+            monitor.update(0, 0, phase='fit')
         logger.debug("Estimating best fits for proposal function...")
         result = pdf.fitTo(dataset, ROOT.RooFit.Save(), ROOT.RooFit.NumCPU(self.numCPU))
         logger.debug("...done!\nResults:")
@@ -144,24 +167,32 @@ class RooFitLikelihoodSampler(BaseProcessor):
         mh.SetProposalFunction(pdfProp)
         mh.SetNumIters(self.iter)
         mh.SetNumBurnInSteps(self.warmup)
+        if monitor is not None:
+            monitor.update(0, 0, phase='sampling')
         logger.debug("Starting Markov Chain...")
         chain = mh.ConstructChain()
         logger.debug("Markov Chain complete!")
+        if monitor is not None:
+            monitor.update(0, self.iter)
 
         chainData = chain.GetAsDataSet()
 
-        self.results = {}
+        nEntries = int(chainData.numEntries())
+        columns = {}
         for name in self.paramOfInterestNames:
-            self.results.update({name: []})
-        self.results.update({"lp_prob": []})
+            columns.update({name: np.empty(nEntries)})
+        columns.update({"lp_prob": np.empty(nEntries)})
 
-        for i in range(0, chainData.numEntries()):
-            for item in self.results:
+        for i in range(0, nEntries):
+            entry = chainData.get(i)
+            for item in columns:
                 if item == "lp_prob":
-                    self.results[item].append(-chainData.get(i).getRealValue("nll_MarkovChain_local_"))
+                    columns[item][i] = -entry.getRealValue("nll_MarkovChain_local_")
                 else:
-                    self.results[item].append(chainData.get(i).getRealValue(item))
+                    columns[item][i] = entry.getRealValue(item)
 
-        self.results.update({"is_sample": [0]*self.warmup + [1]*(int(chainData.numEntries())-self.warmup)})
+        self.results = SampleTable(columns, n_chains=1, warmup=self.warmup,
+                                   entries={"seeds": {'seed': self.seed}})
+        summary.add_summaries(self.results, self.paramOfInterestNames)
 
         return True
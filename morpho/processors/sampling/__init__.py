@@ -5,5 +5,8 @@ from __future__ import absolute_import
 
 from .GaussianSamplingProcessor import GaussianSamplingProcessor
 from .PyStanSamplingProcessor import PyStanSamplingProcessor
+from .PyStanApproximationProcessor import PyStanApproximationProcessor
+from .PyStanLaplaceProcessor import PyStanLaplaceProcessor
+from .PyStanMultiFitProcessor import PyStanMultiFitProcessor
 from .RooFitLikelihoodSampler import RooFitLikelihoodSampler
 from .LinearFitRooFitLikelihoodProcessor import LinearFitRooFitLikelihoodProcessor
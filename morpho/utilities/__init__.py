@@ -5,7 +5,18 @@ from __future__ import absolute_import
 
 from .morphologging import *
 from .reader import *
+from .sampleTable import *
+from .summary import *
 from .pystanLoader import *
+from .checkpoint import *
+from .chunkedSampling import *
+from .seeding import *
+from .stanCsv import *
+from .progress import *
+from .stanIncludes import *
+from .stanCache import *
+from .resultCache import *
+from .precompile import *
 from .plots import *
 from .toolbox import *
 from .parser import *
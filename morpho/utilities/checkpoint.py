@@ -0,0 +1,116 @@
+'''
+On-disk checkpoints of a sampling run in segments
+Date: 10/18/26
+'''
+
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+
+from morpho.utilities import morphologging
+from morpho.utilities.sampleTable import SampleTable
+logger = morphologging.getLogger(__name__)
+
+
+def _to_json(value):
+    '''
+    Convert the numpy arrays and scalars of a structure into lists and numbers
+    '''
+    if isinstance(value, dict):
+        return {str(a_key): _to_json(a_value) for a_key, a_value in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_to_json(a_value) for a_value in value]
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def fingerprint(value):
+    '''
+    Hash of a structure of dictionaries, lists, numbers, strings and numpy arrays
+    '''
+    return hashlib.sha256(json.dumps(_to_json(value), sort_keys=True,
+                                     default=str).encode()).hexdigest()
+
+
+class SamplingCheckpoint(object):
+    '''
+    Checkpoint of a sampling run in segments, stored in a directory:
+    the draws of each segment ("segment-<n>.npz") and a state file
+    ("state.json") with the configuration of the sampling, the segments
+    saved and the state needed to continue (e.g. the sampler state).
+    Each file is written into a temporary file and then renamed; the state
+    file is written last, so that an interrupted save leaves the previous
+    checkpoint valid.
+
+    Arguments:
+        directory: location of the checkpoint
+    '''
+
+    state_name = 'state.json'
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _write_atomic(self, name, writer):
+        fd, tmp_fn = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                writer(f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_fn, self._path(name))
+        except BaseException:
+            if os.path.exists(tmp_fn):
+                os.remove(tmp_fn)
+            raise
+
+    def load(self, config):
+        '''
+        Return the tables of the segments saved and the state, or None if there
+        is no checkpoint or if it was made with another configuration
+        '''
+        try:
+            with open(self._path(self.state_name), 'r') as f:
+                saved = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        if saved.get('config') != _to_json(config):
+            logger.warning("Checkpoint in {} made with another configuration: ignored".format(
+                self.directory))
+            return None
+        tables = []
+        for a_segment in saved['segments']:
+            with np.load(self._path(a_segment['file'])) as columns:
+                tables.append(SampleTable({a_name: columns[a_name] for a_name in columns.files},
+                                          n_chains=a_segment['n_chains'],
+                                          warmup=a_segment['warmup']))
+        logger.info("Loaded {} segments from {}".format(len(tables), self.directory))
+        return tables, saved['state']
+
+    def save(self, tables, state, config):
+        '''
+        Save the last of the tables of the segments and the state
+        '''
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory, exist_ok=True)
+        segments = []
+        for iSegment, a_table in enumerate(tables):
+            segments.append({'file': 'segment-{:04d}.npz'.format(iSegment),
+                             'n_chains': a_table.n_chains, 'warmup': a_table.warmup})
+        columns = {a_name: tables[-1][a_name] for a_name in tables[-1].columns}
+        self._write_atomic(segments[-1]['file'], lambda f: np.savez(f, **columns))
+        self._write_atomic(self.state_name, lambda f: f.write(json.dumps({
+            'config': _to_json(config),
+            'segments': segments,
+            'state': _to_json(state)
+        }, indent=2).encode()))
+        logger.debug("Checkpoint of {} segments saved in {}".format(len(tables), self.directory))
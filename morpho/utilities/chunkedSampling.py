@@ -0,0 +1,198 @@
+'''
+Sampling in chunks continuing from the sampler state of the previous chunk
+Date: 10/18/26
+'''
+
+from morpho.utilities import morphologging, pystanLoader, seeding, summary
+from morpho.utilities.checkpoint import SamplingCheckpoint
+from morpho.utilities.sampleTable import concatenate_tables
+logger = morphologging.getLogger(__name__)
+
+
+def convergence_target(targets, flatname):
+    '''
+    Convergence target of a flatname: targets is either a value or a dictionary
+    of values per parameter name or flatname
+    '''
+    if isinstance(targets, dict):
+        if flatname in targets:
+            return targets[flatname]
+        return targets.get(flatname.split('[')[0])
+    return targets
+
+
+def converged(results, names, target_rhat=None, target_ess=None):
+    '''
+    Check the Rhat and bulk ESS targets of the parameters names of a SampleTable
+    '''
+    flatnames, draws = summary.stack_draws(results, names)
+    rhats = summary.split_rhat(draws)
+    bulk_ess = summary.bulk_effective_sample_size(draws)
+    is_converged = True
+    for a_name, rhat, ess in zip(flatnames, rhats, bulk_ess):
+        a_target_rhat = convergence_target(target_rhat, a_name)
+        a_target_ess = convergence_target(target_ess, a_name)
+        if a_target_rhat is not None and not rhat <= a_target_rhat:
+            logger.debug("<{}>: Rhat={} > {}".format(a_name, rhat, a_target_rhat))
+            is_converged = False
+        if a_target_ess is not None and not ess >= a_target_ess:
+            logger.debug("<{}>: bulk ESS={} < {}".format(a_name, ess, a_target_ess))
+            is_converged = False
+    return is_converged
+
+
+def continue_warmup(state, warmup, readapt_warmup):
+    '''
+    Number of warmup iterations when continuing from a sampler state:
+    without the adapted metric (PyStan<2.18), the step size (tuned for it)
+    must be re-adapted during readapt_warmup iterations
+    '''
+    if warmup == 0 and 'inv_metric' not in state:
+        return readapt_warmup
+    return warmup
+
+
+def continue_args(sampling_args, state, warmup, n_samples, readapt_warmup, warn=True):
+    '''
+    Sampling arguments continuing the sampling from a sampler state
+    '''
+    init = state['init']
+    if warmup == 0 and 'inv_metric' not in state:
+        if warn:
+            logger.warning("No adapted metric in the sampler state (PyStan<2.18): "
+                           "re-adapting during {} iterations".format(readapt_warmup))
+        warmup = continue_warmup(state, warmup, readapt_warmup)
+    chains = sampling_args.get('chains', 1)
+    chunk_args = dict(sampling_args, iter=warmup + n_samples, warmup=warmup,
+                      init=[init[i % len(init)] for i in range(chains)])
+    control = dict(sampling_args.get('control') or {})
+    control['stepsize'] = state['stepsize']
+    if warmup == 0:
+        control['adapt_engaged'] = False
+    if 'inv_metric' in state:
+        control['inv_metric'] = state['inv_metric']
+    chunk_args['control'] = control
+    return chunk_args
+
+
+class ChunkedSampling(object):
+    '''
+    Sampling in chunks of chunk_iter iterations, each chunk starting from the
+    last draws and adapted step size (and metric) of the previous one, until
+    the target Rhat and bulk ESS are reached or max_iter iterations have been
+    run (without targets: until n_samples sampling iterations have been run).
+    With a checkpoint_dir, the draws and the sampler state are saved after
+    each chunk and the sampling resumes from the last checkpoint made with
+    the same checkpoint_config.
+
+    Arguments:
+        sample: function running a sampling with the given sampling() arguments
+            and returning the SampleTable of its draws and its final sampler state
+        n_samples: number of sampling iterations without targets
+        chunk_iter: number of sampling iterations per chunk
+        chunk_warmup: number of warmup iterations of the following chunks (default=0)
+        readapt_warmup: number of warmup iterations of the following chunks when
+            there is no adapted metric (default=100)
+        max_iter: maximum number of iterations per chain (default=no limit)
+        target_rhat, target_ess: convergence targets, either values or dictionaries
+            of values per parameter name or flatname (default=None)
+        checkpoint_dir: location of the checkpoint (default=None: no checkpoint)
+        checkpoint_config: settings which must not change when resuming
+    '''
+
+    def __init__(self, sample, n_samples, chunk_iter, chunk_warmup=0, readapt_warmup=100,
+                 max_iter=None, target_rhat=None, target_ess=None, checkpoint_dir=None,
+                 checkpoint_config=None):
+        self.sample = sample
+        self.n_samples = n_samples
+        self.chunk_iter = chunk_iter
+        self.chunk_warmup = chunk_warmup
+        self.readapt_warmup = readapt_warmup
+        self.max_iter = max_iter
+        self.target_rhat = target_rhat
+        self.target_ess = target_ess
+        self.checkpoint_dir = checkpoint_dir
+        self.checkpoint_config = checkpoint_config
+        self.targets = target_rhat is not None or target_ess is not None
+        self.seed = None
+        self.chunk_seeds = []
+
+    def _next_args(self, sampling_args, tables, state, n_iter):
+        '''
+        Sampling arguments of the next chunk, or None when the sampling is done
+        '''
+        if self.targets:
+            # Only the parameters of interest are gathered for the convergence check
+            names = pystanLoader.summary_columns(tables[0])
+            if converged(concatenate_tables(tables, names), names,
+                         self.target_rhat, self.target_ess):
+                logger.info("Convergence reached after {} iterations".format(n_iter))
+                return None
+            n_samples = self.chunk_iter
+        else:
+            # The warmup draws of the following chunks are dropped
+            n_samples = min(self.chunk_iter, self.n_samples - sum(
+                a_table.n_iterations - a_table.warmup for a_table in tables))
+            if n_samples <= 0:
+                return None
+        warmup = continue_warmup(state, self.chunk_warmup, self.readapt_warmup)
+        if self.max_iter is not None and n_iter + warmup + self.chunk_iter > self.max_iter:
+            if self.targets:
+                logger.warning("Convergence not reached after {} iterations".format(n_iter))
+            return None
+        iChunk = len(tables)
+        chunk_args = continue_args(sampling_args, state, self.chunk_warmup, n_samples,
+                                   self.readapt_warmup, warn=iChunk <= 1)
+        chunk_args['seed'] = seeding.derive_seed(self.seed, 'chunk', iChunk)
+        return chunk_args
+
+    def run(self, sampling_args, first_args, resume_seed=False):
+        '''
+        Sample in chunks and return the SampleTable of all the chunks, with the
+        final "sampler_state".
+        first_args returns the sampling() arguments of the first chunk from
+        sampling_args and its number of sampling iterations; the seeds of the
+        following chunks are derived from the seed of sampling_args, or from the
+        seed of the checkpoint with resume_seed. The seed used and the seeds of
+        the chunks are then in seed and chunk_seeds.
+        '''
+        checkpoint = None
+        tables = []
+        state = None
+        n_iter = 0
+        self.seed = sampling_args['seed']
+        self.chunk_seeds = []
+        if self.checkpoint_dir is not None:
+            checkpoint = SamplingCheckpoint(self.checkpoint_dir)
+            resumed = checkpoint.load(self.checkpoint_config)
+            if resumed is not None:
+                tables, saved = resumed
+                state = saved['sampler_state']
+                n_iter = saved['n_iter']
+                self.chunk_seeds = saved['seeds']['chunks']
+                if resume_seed:
+                    # The following chunks use the seed of the interrupted sampling
+                    self.seed = saved['seeds']['seed']
+                    sampling_args = dict(sampling_args, seed=self.seed)
+                logger.info("Resuming the sampling after {} iterations".format(n_iter))
+        while True:
+            if tables:
+                chunk_args = self._next_args(sampling_args, tables, state, n_iter)
+                if chunk_args is None:
+                    break
+            else:
+                chunk_args = first_args(sampling_args, self.chunk_iter if self.targets
+                                        else min(self.chunk_iter, self.n_samples))
+            self.chunk_seeds.append(chunk_args['seed'])
+            table, state = self.sample(chunk_args)
+            tables.append(table)
+            n_iter += chunk_args['iter']
+            if checkpoint is not None:
+                checkpoint.save(tables, {'sampler_state': state, 'n_iter': n_iter,
+                                         'seeds': {'seed': self.seed, 'chunks': self.chunk_seeds}},
+                                self.checkpoint_config)
+        names = pystanLoader.summary_columns(tables[0])
+        results = concatenate_tables(tables)
+        summary.add_summaries(results, names)
+        results["sampler_state"] = state
+        return results
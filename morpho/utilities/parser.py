@@ -25,14 +25,22 @@ def parse_args():
                    metavar='<configuration file>',
                    help='Full path to the configuration file used by morpho',
                    required=True)
-    # p.add_argument('--job_id',
-    #                metavar='<job_id>',
-    #                help='Job id number or string for batching',
-    #                required=False)
-    # p.add_argument('-s','--seed',
-    #                metavar='<seed>',
-    #                help='Add random seed number to file',
-    #                required=False)
+    p.add_argument('--job_id',
+                   metavar='<job_id>',
+                   default=None,
+                   help='Job id number or string for batching: the seeds of the processors are derived from the master seed and the job id',
+                   required=False)
+    p.add_argument('-s', '--seed',
+                   metavar='<seed>',
+                   type=int,
+                   default=None,
+                   help='Master seed from which the seeds of the processors are derived (Default: random seeds)',
+                   required=False)
+    p.add_argument('--no-result-cache',
+                   dest='no_result_cache',
+                   action='store_true',
+                   help='Sample again instead of using the cached results of the processors (result_cache)',
+                   required=False)
     # p.add_argument('-nas','--noautoseed',
     #                action='store_false',
     #                default=True,
@@ -54,6 +62,59 @@ def parse_args():
     return p.parse_args()
 
 
+def parse_precompile_args(argv=None):
+    '''Parse the command line arguments provided to "morpho precompile"
+    Args:
+        argv: list of arguments (default: sys.argv[2:])
+    Returns:
+        namespace: Namespace containing the arguments
+    '''
+    import sys
+    if argv is None:
+        argv = sys.argv[2:]
+    p = ArgumentParser(prog='morpho precompile', description='''
+        Compile the Stan models used by a configuration file, or the models
+        of a directory, and store them in the model cache.
+    ''')
+    source = p.add_mutually_exclusive_group(required=True)
+    source.add_argument('-c', '--config',
+                        metavar='<configuration file>',
+                        help='Configuration file whose PyStanSamplingProcessor models are compiled')
+    source.add_argument('-d', '--directory',
+                        metavar='<directory>',
+                        help='Directory containing the .stan models to compile')
+    p.add_argument('-f', '--function_files_location',
+                   metavar='<directory>', default=None,
+                   help='Location of the Stan functions (with --directory)')
+    p.add_argument('--model_name', default='anon_model',
+                   metavar='<model name>',
+                   help='Name of the cached models (with --directory; Default: anon_model)')
+    p.add_argument('--cache_dir', default='.',
+                   metavar='<cache directory>',
+                   help='Location of the cache folder (with --directory; Default: .)')
+    p.add_argument('--compile_profile', default='default',
+                   choices=['default', 'debug', 'release'],
+                   help='Compiler settings of the models (with --directory; Default: default)')
+    p.add_argument('--march_native', action='store_true',
+                   help='Optimize the models for the local CPU (with --directory)')
+    p.add_argument('-j', '--n_jobs', default=None, type=int,
+                   metavar='<n_jobs>',
+                   help='Number of models compiled in parallel (Default: number of CPUs)')
+    p.add_argument('--force_recreate', action='store_true',
+                   help='Recompile the models already cached')
+    p.add_argument('-v', '--verbosity', default='INFO',
+                   metavar='<verbosity>',
+                   help="Specify verbosity of the logger, with options DEBUG, INFO, WARNING, ERROR, or CRITICAL (Default: INFO)",
+                   choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
+                   required=False)
+    p.add_argument('-sev', '--stderr-verbosity', default='WARNING',
+                   metavar='<stderr_verbosity>',
+                   help="Messages with level greater than or equal to the given verbosity will be redirected to stderr (Default: WARNING)",
+                   choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
+                   required=False)
+    return p.parse_args(argv)
+
+
 def update_from_arguments(the_dict, args):
     '''Update a dictionary
     Args:
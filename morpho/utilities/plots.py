@@ -4,6 +4,8 @@ Authors: J. Johnston, M. Guigue, T. Weiss
 Date: 06/26/18
 '''
 
+import numpy as np
+
 from morpho.utilities import morphologging
 logger = morphologging.getLogger(__name__)
 
@@ -187,7 +189,7 @@ def _fill_hist_grid(input_dict, name_grid,
     '''
     rows, cols = len(name_grid), len(name_grid[0])
     hist_grid = [[None]*cols for i in range(rows)]
-    warmup = input_dict["is_sample"].count(0)
+    is_sample = np.asarray(input_dict["is_sample"]) > 0
     # tree = myfile.Get(input_tree)
     # n = tree.GetEntries()
     # n = len(input_dict[list(input_dict.keys())[0]])
@@ -200,8 +202,8 @@ def _fill_hist_grid(input_dict, name_grid,
                 # tree.GetEntry(i)
                 # list_dataY.append(getattr(tree, names[0]))
                 # list_dataX.append(getattr(tree, names[1]))
-                list_dataY = input_dict[names[0]][warmup:]
-                list_dataX = input_dict[names[1]][warmup:]
+                list_dataY = np.asarray(input_dict[names[0]])[is_sample]
+                list_dataX = np.asarray(input_dict[names[1]])[is_sample]
                 histo = _get2Dhisto(list_dataX, list_dataY, [nbins_x, nbins_y],
                                     [0, 0], '{}_{}'.format(names[0], names[1]))
                 histo.SetTitle("")
@@ -213,7 +215,7 @@ def _fill_hist_grid(input_dict, name_grid,
                 # for i in range(0,n):
                 # tree.GetEntry(i)
                 # list_data.append(getattr(tree, names[0]))
-                list_data = input_dict[names[0]][warmup:]
+                list_data = np.asarray(input_dict[names[0]])[is_sample]
                 x_range = _autoRangeList(list_data)
                 histo = ROOT.TH1F("%s_%i_%i" % (names[0], r, c), names[0],
                                   nbins_x, x_range[0], x_range[1])
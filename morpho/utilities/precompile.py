@@ -0,0 +1,166 @@
+'''
+Compile the Stan models used by a configuration in advance, in parallel
+Date: 10/18/26
+'''
+
+import glob
+import importlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from morpho.utilities import morphologging, reader, stanCache, stanIncludes
+logger = morphologging.getLogger(__name__)
+
+
+def _processor_class(procClass):
+    '''
+    Return the class of a processor type of a toolbox configuration, or None
+    '''
+    if ":" in procClass:
+        module_name, processor_name = procClass.split(":")
+    else:
+        module_name, processor_name = "morpho", procClass
+    try:
+        return getattr(importlib.import_module(module_name), processor_name)
+    except (ImportError, AttributeError) as err:
+        logger.warning("Cannot import {}: {}".format(procClass, err))
+        return None
+
+
+def _model(params):
+    return {
+        'model_code': reader.read_param(params, 'model_code', 'required'),
+        'function_files_location': reader.read_param(params, 'function_files_location', None),
+        'model_name': reader.read_param(params, 'model_name', "anon_model"),
+        'cache_dir': reader.read_param(params, 'cache_dir', '.'),
+        'cache_max_size': reader.read_param(params, 'cache_max_size', None),
+        'cache_max_entries': reader.read_param(params, 'cache_max_entries', None),
+        'compile_profile': reader.read_param(params, 'compile_profile', 'default'),
+        'march_native': reader.read_param(params, 'march_native', False)
+    }
+
+
+def models_from_config(config_dict):
+    '''
+    List the models used by the processors of a toolbox configuration: the
+    PyStanSamplingProcessor and its subclasses, and the model configurations
+    nested in the processor configurations (e.g. the sampler, generator and
+    analyzer of a SimulationBasedCalibration)
+    '''
+    from morpho.processors.sampling import PyStanSamplingProcessor
+    models = []
+    for a_dict in config_dict["processors-toolbox"]["processors"]:
+        params = config_dict.get(a_dict["name"], {})
+        procClass = _processor_class(a_dict["type"])
+        if isinstance(procClass, type) and issubclass(procClass, PyStanSamplingProcessor):
+            models.append(_model(params))
+        for a_value in params.values():
+            if isinstance(a_value, dict) and 'model_code' in a_value:
+                models.append(_model(a_value))
+    return models
+
+
+def models_from_directory(directory, function_files_location=None,
+                          model_name="anon_model", cache_dir='.',
+                          compile_profile='default', march_native=False):
+    '''
+    List the .stan models of a directory.
+    Files included by other models or located in function_files_location
+    are considered as function files and are not compiled.
+    '''
+    filenames = sorted(glob.glob(os.path.join(directory, '*.stan')))
+    included = set()
+    for filename in filenames:
+        with open(filename, 'r') as f:
+            included.update(stanIncludes.included_names(f.read()))
+    models = []
+    for filename in filenames:
+        key = os.path.basename(filename)[:-5]
+        if key in included:
+            continue
+        if function_files_location is not None and os.path.samefile(
+                os.path.dirname(filename), function_files_location):
+            continue
+        models.append({
+            'model_code': filename,
+            'function_files_location': function_files_location,
+            'model_name': model_name,
+            'cache_dir': cache_dir,
+            'compile_profile': compile_profile,
+            'march_native': march_native
+        })
+    return models
+
+
+def _compile_model(model, code_hash, force_recreate):
+    '''
+    Compile a model into the cache (run in the worker processes)
+    '''
+    includes = stanIncludes.resolve_includes(
+        model['model_code'], model['function_files_location'])
+    model_code = includes.expand()
+    cache = stanCache.StanModelCache(model['cache_dir'], model.get('cache_max_size'),
+                                     model.get('cache_max_entries'))
+    cache.get_model(model_code, code_hash, model['model_name'],
+                    force_recreate=force_recreate, **_profile(model))
+    return cache.filename(code_hash, model['model_name'], stanCache.profile_tag(**_profile(model)))
+
+
+def _profile(model):
+    return {'compile_profile': model.get('compile_profile', 'default'),
+            'march_native': model.get('march_native', False)}
+
+
+def precompile_models(models, n_jobs=None, force_recreate=False):
+    '''
+    Compile the models missing from their cache, concurrently in a process pool.
+    Args:
+        models: list of dictionaries with the model_code, function_files_location,
+            model_name and cache_dir of the models (as in the PyStanSamplingProcessor)
+        n_jobs: number of worker processes (default=number of CPUs)
+        force_recreate: recompile the models already cached
+    Returns:
+        bool: True if all the models were compiled successfully
+    '''
+    to_compile = {}
+    for model in models:
+        code_hash = stanIncludes.resolve_includes(
+            model['model_code'], model['function_files_location']).key
+        cache = stanCache.StanModelCache(model['cache_dir'])
+        cache_fn = cache.filename(code_hash, model['model_name'],
+                                  stanCache.profile_tag(**_profile(model)))
+        if cache_fn in to_compile:
+            continue
+        if not force_recreate and cache.is_cached(cache_fn):
+            logger.info("<{}> already cached in {}".format(model['model_code'], cache_fn))
+            continue
+        to_compile[cache_fn] = (model, code_hash)
+    if not to_compile:
+        logger.info("All models are already cached")
+        return True
+    logger.info("Compiling {} models".format(len(to_compile)))
+    success = True
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        futures = {executor.submit(_compile_model, model, code_hash, force_recreate):
+                   model['model_code'] for model, code_hash in to_compile.values()}
+        for future, model_code in futures.items():
+            try:
+                logger.info("<{}> compiled into {}".format(model_code, future.result()))
+            except Exception as err:
+                logger.error("Compilation of <{}> failed:\n{}".format(model_code, err))
+                success = False
+    return success
+
+
+def run_precompile(args):
+    '''
+    Entry point of "morpho precompile"
+    '''
+    if args.config is not None:
+        from morpho.utilities import toolbox
+        models = models_from_config(toolbox.ToolBox(args).config_dict)
+    else:
+        models = models_from_directory(args.directory, args.function_files_location,
+                                       args.model_name, args.cache_dir,
+                                       args.compile_profile, args.march_native)
+    return precompile_models(models, args.n_jobs, args.force_recreate)
@@ -0,0 +1,202 @@
+'''
+Periodic progress and throughput reports of running samplers
+Date: 10/18/26
+'''
+
+import json
+import os
+import tempfile
+import threading
+import time
+
+from morpho.utilities import morphologging
+from morpho.utilities.stanCsv import CsvTail
+logger = morphologging.getLogger(__name__)
+
+
+class ProgressMonitor(object):
+    '''
+    Report the progress of a sampling every interval seconds, as log records
+    and (optionally) as a JSON side file, rewritten atomically at each report.
+    The progress of each chain is read from its sample file (as written by
+    PyStan with sample_file) or given with update() by the sampler.
+    Each report contains, per chain and in total, the number of iterations,
+    the iterations and leapfrog steps per second, the phase (warmup or
+    sampling) and the estimated time to completion (ETA, in s).
+
+    Arguments:
+        name: name of the sampler reported
+        n_chains: number of chains
+        n_iter: total number of iterations per chain (warmup included)
+        warmup: number of warmup iterations per chain
+        interval: time between reports in s (default=10)
+        side_file: JSON file where the reports are written (default=None)
+        sample_files: sample files of the chains (default=None)
+    '''
+
+    def __init__(self, name, n_chains, n_iter, warmup, interval=10.,
+                 side_file=None, sample_files=None):
+        self.name = name
+        self.n_iter = int(n_iter)
+        self.warmup = int(warmup)
+        self.interval = float(interval)
+        self.side_file = side_file
+        self._tails = [CsvTail(a_file) for a_file in sample_files or []]
+        # Column of n_leapfrog__ in the sample files (None until the header is read)
+        self._leapfrog_columns = [None]*len(self._tails)
+        self._iterations = [0]*n_chains
+        self._leapfrogs = [0]*n_chains
+        self._phases = [None]*n_chains
+        self._last = None
+        self._start = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        '''
+        Start the periodic reports in a background thread
+        '''
+        self._start = time.time()
+        self._last = (self._start, list(self._iterations), list(self._leapfrogs))
+        self._thread = threading.Thread(target=self._loop, name="progress-"+self.name)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        '''
+        Stop the reports, after a final one
+        '''
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self.report(final=True)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def update(self, chain, iterations, n_leapfrog=None, phase=None):
+        '''
+        Record the progress of a chain: number of iterations done, total number
+        of leapfrog steps and phase (default: deduced from the iterations)
+        '''
+        with self._lock:
+            self._iterations[chain] = iterations
+            if n_leapfrog is not None:
+                self._leapfrogs[chain] = n_leapfrog
+            self._phases[chain] = phase
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.report()
+            except Exception as err:
+                logger.warning("Progress report of <{}> failed: {}".format(self.name, err))
+
+    def _poll(self):
+        '''
+        Read the draws added to the sample files
+        '''
+        for iChain, a_tail in enumerate(self._tails):
+            n_rows = 0
+            n_leapfrog = 0
+            for a_line in a_tail.read():
+                if not a_line.strip() or a_line.startswith('#'):
+                    continue
+                column = self._leapfrog_columns[iChain]
+                if column is None:
+                    header = a_line.strip().split(',')
+                    self._leapfrog_columns[iChain] = header.index(
+                        'n_leapfrog__') if 'n_leapfrog__' in header else -1
+                    continue
+                n_rows += 1
+                if column >= 0:
+                    n_leapfrog += float(a_line.split(',')[column])
+            with self._lock:
+                self._iterations[iChain] += n_rows
+                self._leapfrogs[iChain] += n_leapfrog
+
+    def _phase(self, iChain):
+        if self._phases[iChain] is not None:
+            return self._phases[iChain]
+        if self._iterations[iChain] >= self.n_iter:
+            return 'done'
+        return 'warmup' if self._iterations[iChain] < self.warmup else 'sampling'
+
+    def snapshot(self):
+        '''
+        Return the current progress as a dictionary
+        '''
+        self._poll()
+        now = time.time()
+        with self._lock:
+            iterations = list(self._iterations)
+            leapfrogs = list(self._leapfrogs)
+            phases = [self._phase(iChain) for iChain in range(len(iterations))]
+        last_time, last_iterations, last_leapfrogs = self._last
+        self._last = (now, iterations, leapfrogs)
+        elapsed = now - self._start
+        period = max(now - last_time, 1e-9)
+        chains = []
+        etas = []
+        for iChain, (n_iterations, n_leapfrogs) in enumerate(zip(iterations, leapfrogs)):
+            chains.append({
+                'chain': iChain,
+                'iterations': n_iterations,
+                'phase': phases[iChain],
+                'iterations_per_second': (n_iterations - last_iterations[iChain])/period,
+                'leapfrog_per_second': (n_leapfrogs - last_leapfrogs[iChain])/period
+            })
+            # Average speed of the chain since the start
+            if n_iterations >= self.n_iter:
+                etas.append(0.)
+            elif n_iterations > 0:
+                etas.append((self.n_iter - n_iterations)*elapsed/n_iterations)
+        if all(a_chain['phase'] == phases[0] for a_chain in chains):
+            phase = phases[0]
+        else:
+            phase = 'warmup' if 'warmup' in phases else 'sampling'
+        return {
+            'name': self.name,
+            'time': now,
+            'elapsed': elapsed,
+            'phase': phase,
+            'iterations': sum(iterations),
+            'total_iterations': self.n_iter*len(iterations),
+            'iterations_per_second': sum(a_chain['iterations_per_second'] for a_chain in chains),
+            'leapfrog_per_second': sum(a_chain['leapfrog_per_second'] for a_chain in chains),
+            'eta': max(etas) if len(etas) == len(chains) else None,
+            'chains': chains
+        }
+
+    def report(self, final=False):
+        '''
+        Log the current progress and write it into the side file
+        '''
+        progress = self.snapshot()
+        if final:
+            progress['phase'] = 'done'
+        eta = progress['eta']
+        logger.info("<{}> [{}] {}/{} iterations, {:.1f} it/s per chain, {:.1f} leapfrog/s, ETA {}".format(
+            self.name, progress['phase'], progress['iterations'], progress['total_iterations'],
+            progress['iterations_per_second']/max(len(progress['chains']), 1),
+            progress['leapfrog_per_second'],
+            "unknown" if eta is None else "{:.0f}s".format(eta)))
+        if self.side_file is not None:
+            self._write(progress)
+        return progress
+
+    def _write(self, progress):
+        dirname = os.path.dirname(self.side_file) or '.'
+        if not os.path.exists(dirname):
+            os.makedirs(dirname, exist_ok=True)
+        fd, tmp_fn = tempfile.mkstemp(dir=dirname, prefix='.tmp-')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(progress, f, indent=2)
+        os.replace(tmp_fn, self.side_file)
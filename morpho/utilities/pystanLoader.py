@@ -4,80 +4,387 @@ Authors: M. Guigue
 Date: 06/26/18
 '''
 
-from morpho.utilities import morphologging
+import fnmatch
+import re
+from collections import OrderedDict
+
+import numpy as np
+
+from morpho.utilities import morphologging, summary
+from morpho.utilities.sampleTable import SampleTable
 logger = morphologging.getLogger(__name__)
 
+diagnosticVariableName = ['accept_stat__', 'stepsize__',
+                          'n_leapfrog__', 'treedepth__', 'divergent__', 'energy__']
+
+
+def _chain_major(array):
+    '''
+    Reorder an array of shape (iterations, chains, ...) so that the
+    chains are concatenated one after the other (chain-major order).
+    '''
+    array = np.asarray(array)
+    return np.swapaxes(array, 0, 1).reshape((-1,) + array.shape[2:])
+
+
+def _parameter_dims(flatnames):
+    '''
+    Return the dimensions of an indexed parameter from its flatnames
+    (e.g. ['x[1,1]', 'x[2,1]', 'x[1,2]', 'x[2,2]'] -> (2, 2))
+    '''
+    indexes = np.array([[int(i) for i in a_name[a_name.index('[')+1:-1].split(',')]
+                        for a_name in flatnames])
+    return tuple(indexes.max(axis=0))
+
+
+class FlatnameIndex(object):
+    '''
+    Prefix index of the flatnames of a Stan model, used to resolve the
+    parameters of interest into column indices in one pass.
+    The interestParams entries can be:
+        - a parameter name (e.g. "theta"): all its elements,
+        - a flatname (e.g. "theta[3]" or "theta[1,2]"),
+        - a slice using Stan 1-based inclusive bounds (e.g. "theta[1:100]",
+          "theta[2,:]" or "theta[:10,1]"),
+        - a wildcard pattern on the parameter names (e.g. "theta*" or "sigma_?"),
+          possibly followed by indexes or slices.
+    '''
+
+    def __init__(self, flatnames):
+        self.flatnames = list(flatnames)
+        # parameter name -> (columns, indexes with shape (elements, ndim))
+        self._index = OrderedDict()
+        columns = OrderedDict()
+        for iKey, a_name in enumerate(self.flatnames):
+            columns.setdefault(a_name.split('[')[0], []).append(iKey)
+        for a_base, iKeys in columns.items():
+            if '[' in self.flatnames[iKeys[0]]:
+                indexes = np.array([[int(i) for i in self.flatnames[iKey].split('[')[1][:-1].split(',')]
+                                    for iKey in iKeys])
+            else:
+                indexes = np.zeros((1, 0), dtype=int)
+            self._index[a_base] = (np.array(iKeys), indexes)
+
+    def _bases(self, pattern):
+        if '*' in pattern or '?' in pattern:
+            return fnmatch.filter(self._index.keys(), pattern)
+        if pattern in self._index:
+            return [pattern]
+        return []
+
+    def resolve(self, interestParams):
+        '''
+        Resolve the parameters of interest.
+        Returns:
+            list: columns of the selected flatnames, in the flatnames order
+            dict: columns of the indexed parameters requested as a whole, by name
+        '''
+        selected = np.zeros(len(self.flatnames), dtype=bool)
+        whole = OrderedDict()
+        for a_key in interestParams:
+            match = re.match(r'^\s*([^\[\s]+)\s*(?:\[(.*)\])?\s*$', str(a_key))
+            if match is None:
+                logger.warning("Cannot interpret interest parameter <{}>".format(a_key))
+                continue
+            bases = self._bases(match.group(1))
+            if not bases:
+                logger.debug("No flatname matching <{}>".format(a_key))
+            for a_base in bases:
+                iKeys, indexes = self._index[a_base]
+                if match.group(2) is None:
+                    selected[iKeys] = True
+                    if indexes.shape[1] > 0:
+                        whole[a_base] = list(iKeys)
+                    continue
+                specs = match.group(2).split(',')
+                if len(specs) != indexes.shape[1]:
+                    logger.warning("<{}> does not match the dimensions of <{}>".format(
+                        a_key, a_base))
+                    continue
+                mask = np.ones(len(iKeys), dtype=bool)
+                for iDim, a_spec in enumerate(specs):
+                    mask &= _index_mask(indexes[:, iDim], a_spec)
+                selected[iKeys[mask]] = True
+        return list(np.flatnonzero(selected)), whole
+
+
+def _index_mask(indexes, spec):
+    '''
+    Select indexes using a Stan-like (1-based, inclusive) index or slice
+    '''
+    spec = spec.strip()
+    if ':' not in spec:
+        return indexes == int(spec)
+    lower, upper = spec.split(':')
+    mask = np.ones(len(indexes), dtype=bool)
+    if lower.strip():
+        mask &= indexes >= int(lower)
+    if upper.strip():
+        mask &= indexes <= int(upper)
+    return mask
+
+
+class _StanFitSource(object):
+    '''
+    Keep a reference to the arrays of a StanFit output and convert them on demand.
+    When the first sampled column is accessed, the samples array is extracted
+    and all the requested columns are gathered with a single fancy-index into
+    a contiguous block; the columns are then views of this block.
+    '''
+
+    def __init__(self, theOutput, columns):
+        self._fit = theOutput
+        self._columns = list(columns)
+        self._rows = None
+        self._block = None
+        self._diagnostics = None
+
+    def _load_samples(self):
+        logger.debug("Extracting samples from pyStan output")
+        # Array of shape (iterations, chains, flatnames + lp__)
+        samples = np.asarray(self._fit.extract(permuted=False, inc_warmup=True))
+        # Array of shape (columns, draws)
+        self._block = np.ascontiguousarray(
+            _chain_major(samples[:, :, self._columns]).T)
+        self._rows = {iKey: iRow for iRow, iKey in enumerate(self._columns)}
+
+    def column(self, iKey, dims=None):
+        '''
+        Return the draws of the iKey-th flatname.
+        If dims is given, iKey is the list of the (column-major ordered)
+        flatnames of an indexed parameter and the draws are returned with
+        the shape (draws, *dims).
+        '''
+        if self._block is None:
+            self._load_samples()
+        if dims is None:
+            return self._block[self._rows[iKey]]
+        values = self._block[[self._rows[i] for i in iKey]].T
+        # Stan flattens the indexed parameters in column-major order
+        return np.reshape(values, (len(values),) + tuple(dims), order='F')
+
+    def _load_diagnostics(self):
+        if self._diagnostics is None:
+            logger.debug("Extracting sampler diagnostics from pyStan output")
+            self._diagnostics = self._fit.get_sampler_params(inc_warmup=True)
+        return self._diagnostics
+
+    def diagnostic_names(self):
+        '''
+        Return the names of the diagnostics reported by the sampler
+        (e.g. only accept_stat__ with Fixed_param)
+        '''
+        diagnostics = self._load_diagnostics()
+        return list(diagnostics[0].keys()) if diagnostics else []
+
+    def diagnostic(self, key):
+        '''
+        Return the sampler diagnostic as an array of shape (chains, iterations)
+        '''
+        return np.array([a_chain[key] for a_chain in self._load_diagnostics()])
+
+    def delta_energy(self):
+        energy = self.diagnostic('energy__')
+        delta_energy = np.zeros_like(energy)
+        delta_energy[:, 1:] = np.diff(energy, axis=1)
+        return delta_energy.ravel()
 
-def extract_data_from_outputdata(conf, theOutput):
-    # Extract the data into a dictionary
-    logger.debug("Extracting samples from pyStan output")
-    theOutputDiagnostics = theOutput.get_sampler_params(inc_warmup=True)
-    diagnosticVariableName = ['accept_stat__', 'stepsize__',
-                              'n_leapfrog__', 'treedepth__', 'divergent__', 'energy__']
-    theOutputData = theOutput.extract(permuted=False, inc_warmup=True)
 
+def summary_columns(table):
+    '''
+    Columns of a SampleTable holding parameters (not indexes nor sampler diagnostics)
+    '''
+    others = ["chain", "iteration", "is_sample", "lp_prob", "delta_energy__"] + \
+        diagnosticVariableName
+    return [a_name for a_name in table.columns if a_name not in others]
+
+
+def last_position(theOutput):
+    '''
+    Return the values of the variables at the last iteration of each chain,
+    as a list of dictionaries usable as initial values
+    '''
+    flatnames = list(theOutput.flatnames)
+    # Array of shape (chains, flatnames)
+    last = np.asarray(theOutput.extract(permuted=False, inc_warmup=True))[-1, :, :len(flatnames)]
+    return [dict(unflatten(flatnames, a_chain)) for a_chain in last]
+
+
+def sampler_state(theOutput):
+    '''
+    Return the state of the sampler at the end of a pyStan output:
+        init: last position of each chain
+        stepsize: mean adapted step size of the chains
+        inv_metric: mean adapted inverse metric of the chains (if PyStan provides it)
+    '''
+    if hasattr(theOutput, 'get_last_position'):
+        init = theOutput.get_last_position()
+    else:
+        init = last_position(theOutput)
+    stepsizes = [a_chain['stepsize__'][-1]
+                 for a_chain in theOutput.get_sampler_params(inc_warmup=True)]
+    state = {'init': init, 'stepsize': float(np.mean(stepsizes))}
+    if hasattr(theOutput, 'get_inv_metric'):
+        state['inv_metric'] = np.mean([np.asarray(a_metric) for a_metric in
+                                       theOutput.get_inv_metric()], axis=0)
+    return state
+
+
+class _ArraySource(object):
+    '''
+    Columns of an array of draws with shape (draws, flatnames)
+    '''
+
+    def __init__(self, draws):
+        self._draws = np.asarray(draws, dtype=float)
+
+    def column(self, iKey, dims=None):
+        if dims is None:
+            return self._draws[:, iKey]
+        return np.reshape(self._draws[:, iKey], (len(self._draws),) + tuple(dims), order='F')
+
+
+def _add_parameter_columns(table, conf, flatnames, desired_col, indexed_var, source):
+    '''
+    Add the (lazy) columns of the parameters of interest to a SampleTable
+    and return the names of the columns to summarize
+    '''
+    keep_shape = conf.get('keep_shape', False)
+    shaped_var = {iKey: a_base for a_base, iKeys in indexed_var.items()
+                  for iKey in iKeys} if keep_shape else {}
+    summary_var = []
+    for iKey in desired_col:
+        if iKey in shaped_var:
+            # One array of shape (draws, *dims) per indexed parameter
+            a_base = shaped_var[iKey]
+            if a_base not in table:
+                iKeys = indexed_var[a_base]
+                dims = _parameter_dims([flatnames[i] for i in iKeys])
+                table.add_lazy_column(
+                    str(a_base), lambda iKeys=iKeys, dims=dims: source.column(iKeys, dims))
+                summary_var.append(a_base)
+        else:
+            table.add_lazy_column(
+                str(flatnames[iKey]), lambda iKey=iKey: source.column(iKey))
+            summary_var.append(flatnames[iKey])
+    return summary_var
+
+
+def table_from_draws(conf, flatnames, draws, lp_prob=None):
+    '''
+    Create a SampleTable (one chain, without warmup) from an array of draws
+    with shape (draws, flatnames), e.g. from an approximation of the posterior.
+    The parameters of interest are selected as for the sampling results.
+    '''
+    flatnames = list(flatnames)
+    draws = np.atleast_2d(draws)
+    desired_col, indexed_var = FlatnameIndex(flatnames).resolve(
+        conf['interestParams'])
+    table = SampleTable(n_chains=1, warmup=0, n_draws=len(draws))
+    summary_var = _add_parameter_columns(
+        table, conf, flatnames, desired_col, indexed_var, _ArraySource(draws))
+    if lp_prob is None:
+        lp_prob = np.full(len(draws), np.nan)
+    table.add_column("lp_prob", np.asarray(lp_prob, dtype=float))
+    summary.add_summaries(table, summary_var)
+    return table
+
+
+def flatten(pars):
+    '''
+    Flatten a dictionary of (indexed) variables into Stan flatnames and values
+    (e.g. {'x': [[1, 2]]} -> ['x[1,1]', 'x[1,2]'], [1, 2])
+    '''
+    flatnames = []
+    values = []
+    for a_name, a_value in pars.items():
+        a_value = np.asarray(a_value, dtype=float)
+        if a_value.ndim == 0:
+            flatnames.append(a_name)
+            values.append(float(a_value))
+            continue
+        for index in range(a_value.size):
+            flatnames.append(summary._flatname(a_name, index, a_value.shape))
+        values += list(a_value.ravel(order='F'))
+    return flatnames, np.array(values)
+
+
+def unflatten(flatnames, values):
+    '''
+    Gather the values of Stan flatnames into a dictionary of (indexed) variables
+    '''
+    columns = OrderedDict()
+    for iKey, a_name in enumerate(flatnames):
+        columns.setdefault(a_name.split('[')[0], []).append(iKey)
+    values = np.asarray(values, dtype=float)
+    pars = OrderedDict()
+    for a_base, iKeys in columns.items():
+        if '[' in flatnames[iKeys[0]]:
+            dims = _parameter_dims([flatnames[i] for i in iKeys])
+            pars[a_base] = np.reshape(values[iKeys], dims, order='F')
+        elif a_base != 'lp__':
+            pars[a_base] = float(values[iKeys[0]])
+    return pars
+
+
+def constrain_pars(theOutput, upar):
+    '''
+    Transform unconstrained parameters into a dictionary of constrained parameters
+    '''
+    values = theOutput.constrain_pars(upar)
+    if isinstance(values, dict):
+        return values
+    values = np.asarray(values, dtype=float).ravel()
+    pars = OrderedDict()
+    start = 0
+    for a_name, dims in zip(theOutput._get_param_names(), theOutput._get_param_dims()):
+        size = int(np.prod(dims)) if len(dims) > 0 else 1
+        if start + size > len(values):
+            break
+        if len(dims) > 0:
+            pars[a_name] = np.reshape(values[start:start+size], dims, order='F')
+        else:
+            pars[a_name] = float(values[start])
+        start += size
+    return pars
+
+
+def extract_data_from_outputdata(conf, theOutput):
+    '''
+    Create a lazy SampleTable from the pyStan output.
+    The columns of the parameters of interest and of the sampler diagnostics
+    listed in conf['diagnostics'] are only converted when accessed.
+    '''
     logger.debug("Transformation into a dict")
-    nEventsPerChain = len(theOutputData)
+    nEventsPerChain = theOutput.sim['n_save'][0]
+    nChains = theOutput.sim['chains']
     # get the variables in the Stan4Model
-    flatnames = theOutput.flatnames
-    # add the diagnostic variable names
-    flatnames.extend(diagnosticVariableName)
-    # make list of desired variables
-    desired_var = []
-    for a_name in flatnames:
-        for a_key in conf['interestParams']:
-            # this means the desired var is a list
-            if a_name.startswith(a_key+'[') or a_name == a_key:
-                desired_var.append(a_name)
-
-    # Clustering the data together
-    theOutputDataDict = {}
-    for key in desired_var:
-        theOutputDataDict.update({str(key): []})
-    for key in diagnosticVariableName:
-        theOutputDataDict.update({str(key): []})
-    theOutputDataDict.update({"lp_prob": []})
-    theOutputDataDict.update({"delta_energy__": []})
-    theOutputDataDict.update({"is_sample": []})
-
-    for iChain in range(0, conf['chains']):
-        for iEvents in range(0, nEventsPerChain):
-            for iKey, key in enumerate(flatnames):
-                if key in diagnosticVariableName:
-                    theOutputDataDict[str(key)].append(
-                        theOutputDiagnostics[iChain][key][iEvents])
-                else:
-                    if key in desired_var:
-                        theOutputDataDict[str(key)].append(
-                            theOutputData[iEvents][iChain][iKey])
-            if iEvents is not 0:
-                theOutputDataDict["delta_energy__"].append(
-                    theOutputDiagnostics[iChain]['energy__'][iEvents]-theOutputDiagnostics[iChain]['energy__'][iEvents-1])
-            else:
-                theOutputDataDict["delta_energy__"].append(0)
-            theOutputDataDict["lp_prob"].append(
-                theOutputData[iEvents][iChain][len(theOutput.flatnames)])
-            theOutputDataDict["is_sample"].append(
-                0 if iEvents < conf['warmup'] else 1)
-
-    # Add all stan summaries in output dictionary
-    mean = {}
-    se_mean = {}
-    sd = {}
-    n_eff = {}
-    Rhat = {}
-    for iKey, key in enumerate(flatnames):
-        if key in desired_var:
-            mean[str(key)] = theOutput.summary(pars=str(key))['summary'][0][0]
-            se_mean[str(key)] = theOutput.summary(pars=str(key))['summary'][0][1]
-            sd[str(key)] = theOutput.summary(pars=str(key))['summary'][0][2]
-            n_eff[str(key)] = theOutput.summary(pars=str(key))['summary'][0][8]
-            Rhat[str(key)] = theOutput.summary(pars=str(key))['summary'][0][9]
-
-    theOutputDataDict["mean"] = mean
-    theOutputDataDict["se_mean"] = se_mean
-    theOutputDataDict["sd"] = sd
-    theOutputDataDict["n_eff"] = n_eff
-    theOutputDataDict["Rhat"] = Rhat
+    flatnames = list(theOutput.flatnames)
+    # resolve the desired variables into columns of the output
+    desired_col, indexed_var = FlatnameIndex(flatnames).resolve(
+        conf['interestParams'])
+
+    # The lp__ column comes after the flatnames
+    source = _StanFitSource(theOutput, desired_col + [len(flatnames)])
+    reported = source.diagnostic_names()
+    kept_diagnostics = [key for key in diagnosticVariableName if key in reported and
+                        (key in conf.get('diagnostics', diagnosticVariableName)
+                         or key in conf['interestParams'])]
+    # The chain, iteration and is_sample columns are added by the table
+    theOutputDataDict = SampleTable(n_chains=nChains, warmup=conf['warmup'],
+                                    n_draws=nChains*nEventsPerChain)
+    summary_var = _add_parameter_columns(
+        theOutputDataDict, conf, flatnames, desired_col, indexed_var, source)
+    for key in kept_diagnostics:
+        theOutputDataDict.add_lazy_column(
+            str(key), lambda key=key: source.diagnostic(key).ravel())
+    theOutputDataDict.add_lazy_column(
+        "lp_prob", lambda: source.column(len(flatnames)))
+    if 'energy__' in kept_diagnostics:
+        theOutputDataDict.add_lazy_column(
+            "delta_energy__", source.delta_energy)
+
+    # Add all stan summaries in output dictionary (computed when accessed)
+    summary.add_summaries(theOutputDataDict, summary_var)
 
     return theOutputDataDict
@@ -0,0 +1,66 @@
+'''
+On-disk cache of the results of the sampling processors
+Date: 10/18/26
+'''
+
+import hashlib
+import json
+import os
+
+from morpho.utilities import morphologging
+from morpho.utilities.checkpoint import _to_json
+from morpho.utilities.stanCache import StanModelCache
+logger = morphologging.getLogger(__name__)
+
+# sampling() arguments which do not change the draws (the data are hashed separately)
+ignored_args = ('data', 'n_jobs', 'sample_file', 'diagnostic_file', 'verbose')
+
+
+def result_key(model_key, data, sampling_args, seed, settings=None):
+    '''
+    Hash of everything the results of a sampling depend on: the key of the
+    model code (with its includes expanded), the input data, the sampling()
+    arguments changing the draws, the seed and other settings (e.g. the
+    parameters kept)
+    '''
+    description = json.dumps(_to_json({
+        'model': model_key,
+        'data': data,
+        'sampling': {a_key: a_value for a_key, a_value in sampling_args.items()
+                     if a_key not in ignored_args},
+        'seed': seed,
+        'settings': settings or {}
+    }), sort_keys=True, default=str)
+    return hashlib.sha256(description.encode()).hexdigest()
+
+
+class SamplingResultCache(StanModelCache):
+    '''
+    Cache of sampling results, stored as "result-<key>.pkl" pickles, with the
+    manifest and the least recently used eviction of the StanModelCache:
+    results obtained with other PyStan versions are ignored, and the least
+    recently used results are removed when the cache exceeds max_size
+    (in MB) or max_entries.
+    '''
+
+    file_pattern = 'result-*.pkl'
+
+    def filename(self, key, model_name=None, tag=''):
+        return os.path.join(self.cache_dir, 'result-{}.pkl'.format(key))
+
+    def load_results(self, key):
+        '''
+        Return the results stored with this key, or None
+        '''
+        return self.load(self.filename(key))
+
+    def save_results(self, key, results, **info):
+        '''
+        Store results (their lazy columns and entries are loaded first)
+        '''
+        try:
+            if hasattr(results, 'materialize'):
+                results.materialize()
+            self.save(results, self.filename(key), **info)
+        except Exception as err:
+            logger.warning("Cannot cache the results {}: {}".format(key, err))
@@ -0,0 +1,252 @@
+'''
+Columnar container for the results of sampling processors
+Date: 10/18/26
+'''
+
+import numpy as np
+
+from morpho.utilities import morphologging
+logger = morphologging.getLogger(__name__)
+
+
+class SampleTable(dict):
+    '''
+    Columnar container for sampling results.
+    Each sampled variable is a contiguous numpy array holding all the draws,
+    stored chain after chain. The "chain", "iteration" and "is_sample" index
+    columns locate every draw in its chain.
+    Other entries (e.g. the "mean" or "sd" summary dictionaries) are kept as
+    regular dictionary items, so that the table can be used wherever a
+    results dictionary is expected.
+    Columns can be lazy: they are then only converted into arrays when they
+    are accessed for the first time.
+
+    Arguments:
+        columns: dictionary of 1D arrays of equal length (chain after chain)
+        n_chains: number of chains (default=1)
+        warmup: number of warmup iterations at the start of each chain (default=0)
+        entries: dictionary of additional (non-column) entries
+        n_draws: total number of draws (only needed if all columns are lazy)
+    '''
+
+    def __init__(self, columns=None, n_chains=1, warmup=0, entries=None, n_draws=None):
+        super().__init__()
+        self.n_chains = int(n_chains)
+        self.warmup = int(warmup)
+        self._columns = []
+        self._lazy = {}
+        self.n_draws = n_draws
+        if columns is not None:
+            for a_name, a_column in columns.items():
+                self.add_column(a_name, a_column)
+        if self.n_draws is not None and self.n_draws % self.n_chains != 0:
+            logger.error("Number of draws <{}> not a multiple of the number of chains <{}>".format(
+                self.n_draws, self.n_chains))
+            raise ValueError("Inconsistent number of chains")
+        if self.n_draws is not None and "chain" not in self:
+            self.add_column("chain", np.repeat(
+                np.arange(self.n_chains, dtype=np.int32), self.n_iterations))
+        if self.n_draws is not None and "iteration" not in self:
+            self.add_column("iteration", np.tile(
+                np.arange(self.n_iterations, dtype=np.int32), self.n_chains))
+        if self.n_draws is not None and "is_sample" not in self:
+            self.add_column("is_sample", np.tile(
+                (np.arange(self.n_iterations) >= self.warmup).astype(np.int8), self.n_chains))
+        if entries is not None:
+            self.update(entries)
+
+    @property
+    def columns(self):
+        '''
+        Names of the columns (sampled variables and index columns)
+        '''
+        return list(self._columns)
+
+    @property
+    def n_iterations(self):
+        '''
+        Number of iterations (warmup included) per chain
+        '''
+        if self.n_draws is None:
+            return 0
+        return self.n_draws // self.n_chains
+
+    def add_column(self, name, values):
+        '''
+        Add a column to the table.
+        The values are stored as a contiguous numpy array, without copy when possible.
+        '''
+        values = np.ascontiguousarray(values)
+        if self.n_draws is None:
+            self.n_draws = len(values)
+        elif len(values) != self.n_draws:
+            logger.error("Column <{}> has {} draws instead of {}".format(
+                name, len(values), self.n_draws))
+            raise ValueError("Inconsistent column size")
+        if name not in self._columns:
+            self._columns.append(name)
+        self._lazy.pop(name, None)
+        dict.__setitem__(self, name, values)
+
+    def add_lazy_column(self, name, loader):
+        '''
+        Add a column whose values are given by loader() when first accessed
+        '''
+        if self.n_draws is None:
+            logger.error("Number of draws unknown: cannot add lazy column <{}>".format(name))
+            raise ValueError("Unknown number of draws")
+        if name not in self._columns:
+            self._columns.append(name)
+        dict.pop(self, name, None)
+        self._lazy[name] = loader
+
+    def add_lazy_entry(self, name, loader):
+        '''
+        Add a (non-column) entry whose value is given by loader() when first accessed
+        '''
+        dict.pop(self, name, None)
+        self._lazy[name] = loader
+
+    def is_loaded(self, name):
+        '''
+        Return True if the column or entry has already been loaded
+        '''
+        return name not in self._lazy
+
+    def materialize(self):
+        '''
+        Load all the lazy columns and entries (e.g. before pickling the table)
+        '''
+        for name in list(self._lazy):
+            self[name]
+        return self
+
+    def __missing__(self, key):
+        if key not in self._lazy:
+            raise KeyError(key)
+        if key in self._columns:
+            logger.debug("Loading column <{}>".format(key))
+            self.add_column(key, self._lazy[key]())
+        else:
+            dict.__setitem__(self, key, self._lazy[key]())
+            del self._lazy[key]
+        return dict.__getitem__(self, key)
+
+    def __contains__(self, key):
+        return dict.__contains__(self, key) or key in self._lazy
+
+    def __iter__(self):
+        for key in dict.__iter__(self):
+            yield key
+        for key in list(self._lazy):
+            if not dict.__contains__(self, key):
+                yield key
+
+    def __len__(self):
+        return dict.__len__(self) + len(self._lazy)
+
+    def __getstate__(self):
+        self.materialize()
+        return self.__dict__
+
+    def keys(self):
+        return list(self)
+
+    def values(self):
+        return [self[key] for key in self]
+
+    def items(self):
+        return [(key, self[key]) for key in self]
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+    def _view(self, select, n_draws, n_chains, warmup, lazy=False):
+        '''
+        Return a table of the values select(name) of each column; with lazy, the
+        columns are only selected when accessed
+        '''
+        table = SampleTable(n_chains=n_chains, warmup=warmup, n_draws=n_draws)
+        for a_name in self._columns:
+            if self.is_loaded(a_name) and not lazy:
+                table.add_column(a_name, select(a_name))
+            else:
+                table.add_lazy_column(a_name, lambda a_name=a_name: select(a_name))
+        for a_key, a_value in dict.items(self):
+            if a_key not in self._columns:
+                dict.__setitem__(table, a_key, a_value)
+        for a_key in self._lazy:
+            if a_key not in self._columns:
+                table.add_lazy_entry(a_key, lambda a_key=a_key: self[a_key])
+        return table
+
+    def chain(self, iChain):
+        '''
+        Return a (zero-copy) view of the table restricted to one chain
+        '''
+        if not 0 <= iChain < self.n_chains:
+            logger.error("Chain <{}> does not exist".format(iChain))
+            raise IndexError(iChain)
+        start = iChain * self.n_iterations
+        return self._view(lambda a_name: self[a_name][start:start + self.n_iterations],
+                          self.n_iterations, 1, self.warmup)
+
+    def chains(self):
+        '''
+        Return the list of per-chain views of the table
+        '''
+        return [self.chain(iChain) for iChain in range(self.n_chains)]
+
+    def draws(self, name, inc_warmup=False):
+        '''
+        Return a (zero-copy) view of a column with shape (chains, iterations)
+        '''
+        values = self[name].reshape((self.n_chains, self.n_iterations) + self[name].shape[1:])
+        if inc_warmup:
+            return values
+        return values[:, self.warmup:]
+
+    def post_warmup(self):
+        '''
+        Return the table without the warmup draws.
+        With a single chain, the columns are zero-copy views. With several
+        chains, the post-warmup draws are not contiguous in the columns (chain
+        after chain): each column is gathered from its zero-copy draws() view,
+        with one copy, when it is first accessed. draws(name) gives the
+        post-warmup draws of a column without any copy.
+        '''
+        n_draws = self.n_chains * (self.n_iterations - self.warmup)
+        if self.n_chains == 1:
+            return self._view(lambda a_name: self[a_name][self.warmup:], n_draws, 1, 0)
+
+        def select(a_name):
+            values = self.draws(a_name)
+            return values.reshape((-1,) + values.shape[2:])
+        return self._view(select, n_draws, self.n_chains, 0, lazy=True)
+
+def concatenate_tables(tables, names=None):
+    '''
+    Concatenate the chains of successive SampleTables (e.g. chunks of a sampling
+    continued from the previous one).
+    The warmup draws of the first table are kept; those of the following
+    tables (re-adaptation) are dropped.
+    Args:
+        tables: list of SampleTables with the same number of chains
+        names: columns to concatenate (default: columns of the first table)
+    Returns:
+        SampleTable: table holding all the draws
+    '''
+    first = tables[0]
+    if names is None:
+        names = [a_name for a_name in first.columns
+                 if a_name not in ("chain", "iteration", "is_sample")]
+    columns = {}
+    for a_name in names:
+        # Arrays of shape (chains, iterations, *dims)
+        values = [first.draws(a_name, inc_warmup=True)] + \
+            [a_table.draws(a_name) for a_table in tables[1:]]
+        values = np.concatenate(values, axis=1)
+        columns[a_name] = values.reshape((-1,) + values.shape[2:])
+    return SampleTable(columns, n_chains=first.n_chains, warmup=first.warmup)
@@ -0,0 +1,45 @@
+'''
+Reproducible seeds of the samplers, derived from a master seed
+Date: 10/18/26
+'''
+
+import os
+from hashlib import sha256
+
+from morpho.utilities import morphologging, reader
+logger = morphologging.getLogger(__name__)
+
+# Seeds are in [1, max_seed): valid for Stan, numpy and ROOT
+# (TRandom3 uses a time-based seed for 0)
+max_seed = 2**31 - 1
+
+
+def random_seed():
+    '''
+    Return a fresh seed drawn from the entropy of the system
+    '''
+    return int.from_bytes(os.urandom(8), 'little') % (max_seed - 1) + 1
+
+
+def derive_seed(master_seed, *keys):
+    '''
+    Return the seed of an independent stream identified by keys (job id,
+    processor name, chain number...), derived from a master seed.
+    The seed only depends on the master seed and on the keys, so that any
+    stream (e.g. one job of a batch) can be regenerated alone on any machine.
+    '''
+    text = ":".join(str(a_key) for a_key in (master_seed,) + keys)
+    digest = sha256(text.encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'little') % (max_seed - 1) + 1
+
+
+def processor_seed(params, name):
+    '''
+    Return the seed of a processor: the "seed" of its configuration, or
+    a fresh random seed (logged, so that the run can be reproduced)
+    '''
+    seed = reader.read_param(params, 'seed', None)
+    if seed is None:
+        seed = random_seed()
+        logger.info("<{}>: using random seed {}".format(name, seed))
+    return int(seed)
@@ -0,0 +1,395 @@
+'''
+Concurrency-safe cache of compiled Stan models
+Date: 10/18/26
+'''
+
+import glob
+import json
+import os
+import pickle
+import platform
+import shlex
+import subprocess
+import sysconfig
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    import pystan
+except ImportError:
+    pass
+
+from morpho.utilities import morphologging
+logger = morphologging.getLogger(__name__)
+
+manifest_name = 'manifest.json'
+
+# Extra compiler arguments of the compile profiles
+# (default: PyStan settings, debug: fast build, release: optimized code)
+compile_profiles = {
+    'default': [],
+    'debug': ['-O0'],
+    'release': ['-O3']
+}
+
+
+def compile_args(compile_profile='default', march_native=False):
+    '''
+    Return the extra_compile_args of a compile profile
+    '''
+    if compile_profile not in compile_profiles:
+        logger.error("Unknown compile profile <{}>; available: {}".format(
+            compile_profile, sorted(compile_profiles)))
+        raise ValueError("Unknown compile profile")
+    args = list(compile_profiles[compile_profile])
+    if march_native:
+        args.append('-march=native')
+    return args
+
+
+def profile_tag(compile_profile='default', march_native=False):
+    '''
+    Tag of a compile profile in the cache file names (empty for the default profile)
+    '''
+    tags = [] if compile_profile == 'default' else [compile_profile]
+    if march_native:
+        tags.append('native')
+    return '-'.join(tags)
+
+
+@contextmanager
+def file_lock(path):
+    '''
+    Exclusive lock on a file, shared between processes.
+    Processes trying to acquire the lock wait until it is released.
+    '''
+    with open(path, 'a') as lock_file:
+        if fcntl is not None:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except (IOError, OSError):
+                logger.debug("Waiting for the lock on {}".format(path))
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+# Versions of the compilers: compiler command -> first line of "<compiler> --version"
+_compiler_versions = {}
+
+
+def compiler_version():
+    '''
+    Version of the C compiler used to build the models (the compiler command
+    if it cannot be run); it is only queried once per process
+    '''
+    compiler = os.environ.get('CC') or sysconfig.get_config_var('CC') or 'cc'
+    if compiler not in _compiler_versions:
+        version = compiler
+        try:
+            output = subprocess.run(shlex.split(compiler)[:1] + ['--version'],
+                                    stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                    universal_newlines=True, timeout=30).stdout
+            if output.strip():
+                version = output.strip().splitlines()[0]
+        except (OSError, ValueError, subprocess.SubprocessError) as err:
+            logger.debug("Cannot get the version of {}: {}".format(compiler, err))
+        _compiler_versions[compiler] = version
+    return _compiler_versions[compiler]
+
+
+def build_info():
+    '''
+    Versions of the tools used to compile the models
+    '''
+    try:
+        pystan_version = pystan.__version__
+    except NameError:
+        pystan_version = None
+    return {
+        'pystan': pystan_version,
+        'compiler': compiler_version(),
+        'python': platform.python_version()
+    }
+
+
+class StanModelCache(object):
+    '''
+    Cache of compiled Stan models, stored as "cached-<name>-<hash>.pkl" pickles
+    ("cached-<name>-<profile>-<hash>.pkl" for non-default compile profiles).
+    A single process compiles a given model while the others wait for it;
+    the pickles are written to a temporary file and then renamed, so that
+    they are never read half-written.
+    The manifest (manifest.json) records the PyStan and compiler versions used
+    for each model (models built with other versions are recompiled), their
+    size and last access time.
+    The least recently used models are removed when the cache exceeds
+    max_size (in MB) or max_entries.
+    '''
+
+    file_pattern = 'cached-*.pkl'
+
+    def __init__(self, cache_dir='.', max_size=None, max_entries=None):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.max_entries = max_entries
+
+    def filename(self, code_hash, model_name=None, tag=''):
+        if model_name is None:
+            model_name = 'model'
+        if tag:
+            model_name = '{}-{}'.format(model_name, tag)
+        return os.path.join(self.cache_dir, 'cached-{}-{}.pkl'.format(model_name, code_hash))
+
+    def _ensure_dir(self):
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir, exist_ok=True)
+            logger.info("Creating 'cache' folder: {}".format(self.cache_dir))
+
+    @contextmanager
+    def _manifest(self):
+        '''
+        Context giving the manifest dictionary, written back on exit if it changed
+        '''
+        self._ensure_dir()
+        manifest_fn = os.path.join(self.cache_dir, manifest_name)
+        with file_lock(manifest_fn + '.lock'):
+            try:
+                with open(manifest_fn, 'r') as f:
+                    manifest = json.load(f)
+            except (IOError, OSError, ValueError):
+                manifest = {}
+            saved = json.dumps(manifest, sort_keys=True)
+            yield manifest
+            if json.dumps(manifest, sort_keys=True) == saved:
+                return
+            self._write_atomic(manifest_fn, lambda f: f.write(
+                json.dumps(manifest, indent=2, sort_keys=True).encode()))
+
+    def manifest(self):
+        '''
+        Return a copy of the manifest entries
+        '''
+        with self._manifest() as manifest:
+            return dict(manifest)
+
+    def _write_atomic(self, path, writer):
+        '''
+        Write a file using writer(file) into a temporary file, then rename it
+        '''
+        fd, tmp_fn = tempfile.mkstemp(
+            dir=os.path.dirname(path) or '.', prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                writer(f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_fn, path)
+        except BaseException:
+            if os.path.exists(tmp_fn):
+                os.remove(tmp_fn)
+            raise
+
+    def is_cached(self, cache_fn, touch=False):
+        '''
+        Check that a model exists in the cache and was built with the current
+        versions of PyStan and of the compiler
+        '''
+        if not os.path.exists(cache_fn):
+            return False
+        name = os.path.basename(cache_fn)
+        with self._manifest() as manifest:
+            entry = manifest.get(name)
+            if entry is not None:
+                versions = {key: entry.get(key) for key in build_info()}
+                if versions != build_info():
+                    logger.info("Cached model {} built with {}: recompiling".format(
+                        name, versions))
+                    return False
+                if touch:
+                    entry['last_access'] = time.time()
+        return True
+
+    def load(self, cache_fn):
+        '''
+        Load a cached model: return None if it does not exist, is unreadable
+        or was built with other versions of PyStan or of the compiler
+        '''
+        if not self.is_cached(cache_fn, touch=True):
+            return None
+        try:
+            with open(cache_fn, 'rb') as f:
+                return pickle.load(f)
+        except Exception as err:
+            logger.warning("Cannot load cached model {}: {}".format(cache_fn, err))
+            return None
+
+    def save(self, model, cache_fn, **info):
+        '''
+        Publish a model in the cache and record it in the manifest
+        '''
+        self._ensure_dir()
+        logger.debug("Saving Stan cache in {}".format(cache_fn))
+        self._write_atomic(cache_fn, lambda f: pickle.dump(model, f))
+        with self._manifest() as manifest:
+            entry = build_info()
+            entry.update(info)
+            entry.update({
+                'size': os.path.getsize(cache_fn),
+                'created': time.time(),
+                'last_access': time.time()
+            })
+            manifest[os.path.basename(cache_fn)] = entry
+        self.evict(keep=cache_fn)
+
+    def evict(self, keep=None):
+        '''
+        Remove the least recently used files until the cache fits in
+        max_size (MB) and max_entries
+        '''
+        if self.max_size is None and self.max_entries is None:
+            return []
+        removed = []
+        with self._manifest() as manifest:
+            files = []
+            for cache_fn in glob.glob(os.path.join(self.cache_dir, self.file_pattern)):
+                entry = manifest.get(os.path.basename(cache_fn), {})
+                try:
+                    last_access = entry.get('last_access', os.path.getmtime(cache_fn))
+                    files.append((last_access, os.path.getsize(cache_fn), cache_fn))
+                except OSError:
+                    continue
+            files.sort()
+            total_size = sum(a_file[1] for a_file in files)
+            n_entries = len(files)
+            for _, size, cache_fn in files:
+                too_big = self.max_size is not None and total_size > self.max_size*1024**2
+                too_many = self.max_entries is not None and n_entries > self.max_entries
+                if not (too_big or too_many):
+                    break
+                if keep is not None and os.path.abspath(cache_fn) == os.path.abspath(keep):
+                    continue
+                logger.info("Removing cached file {}".format(cache_fn))
+                try:
+                    os.remove(cache_fn)
+                except OSError:
+                    continue
+                # The (empty) lock file is kept: processes may be waiting on it
+                manifest.pop(os.path.basename(cache_fn), None)
+                total_size -= size
+                n_entries -= 1
+                removed.append(cache_fn)
+        return removed
+
+    def get_model(self, model_code, code_hash, model_name=None,
+                  force_recreate=False, no_cache=False,
+                  compile_profile='default', march_native=False):
+        '''
+        Return the compiled StanModel of model_code, which can also be a
+        function returning the code (only called if the model is compiled).
+        The model is taken from the process-wide registry if it has already
+        been loaded, then from the cache; it is compiled otherwise.
+        '''
+        extra_compile_args = compile_args(compile_profile, march_native)
+        tag = profile_tag(compile_profile, march_native)
+        key = '{}-{}'.format(tag, code_hash) if tag else code_hash
+        with _registry_lock(key):
+            if not force_recreate and key in _registry:
+                logger.debug("Using StanModel already loaded: {}".format(key))
+                return _registry[key]
+            model = self._load_or_compile(model_code, code_hash, model_name,
+                                          force_recreate, no_cache,
+                                          extra_compile_args, tag)
+            _registry[key] = model
+        return model
+
+    def _load_or_compile(self, model_code, code_hash, model_name,
+                         force_recreate, no_cache, extra_compile_args, tag):
+        if callable(model_code):
+            model_code = _LazyCode(model_code)
+        if no_cache:
+            return _compile(model_code, extra_compile_args)
+        cache_fn = self.filename(code_hash, model_name, tag)
+        if not force_recreate:
+            logger.debug("Trying to load cached StanModel")
+            model = self.load(cache_fn)
+            if model is not None:
+                logger.debug("Using cached StanModel: {}".format(cache_fn))
+                return model
+        self._ensure_dir()
+        with file_lock(cache_fn + '.lock'):
+            # Another process may have compiled the model while we were waiting
+            if not force_recreate:
+                model = self.load(cache_fn)
+                if model is not None:
+                    logger.debug("Using StanModel cached by another process: {}".format(
+                        cache_fn))
+                    return model
+            logger.debug("None exists -> creating Stan cache")
+            model = _compile(model_code, extra_compile_args)
+            self.save(model, cache_fn, model_name=model_name, code_hash=code_hash,
+                      extra_compile_args=extra_compile_args)
+        return model
+
+
+def _compile(model_code, extra_compile_args):
+    if extra_compile_args:
+        logger.debug("Compiling with {}".format(" ".join(extra_compile_args)))
+        return pystan.StanModel(model_code=str(model_code),
+                                extra_compile_args=extra_compile_args)
+    return pystan.StanModel(model_code=str(model_code))
+
+
+class _LazyCode(object):
+    '''
+    Model code generated when first converted into a string
+    '''
+
+    def __init__(self, generator):
+        self._generator = generator
+        self._code = None
+
+    def __str__(self):
+        if self._code is None:
+            self._code = self._generator()
+        return self._code
+
+
+# Process-wide registry of the loaded models: (profile tag and) code hash -> StanModel
+_registry = {}
+_registry_locks = {}
+_registry_main_lock = threading.Lock()
+
+
+def _registry_lock(code_hash):
+    '''
+    Lock of a registry entry, so that a model is only loaded once per process
+    '''
+    with _registry_main_lock:
+        return _registry_locks.setdefault(code_hash, threading.RLock())
+
+
+def registered_model(code_hash, compile_profile='default', march_native=False):
+    '''
+    Return the StanModel already loaded in this process, or None
+    '''
+    tag = profile_tag(compile_profile, march_native)
+    return _registry.get('{}-{}'.format(tag, code_hash) if tag else code_hash)
+
+
+def clear_registry():
+    '''
+    Forget the StanModels loaded in this process
+    '''
+    with _registry_main_lock:
+        _registry.clear()
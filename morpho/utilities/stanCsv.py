@@ -0,0 +1,247 @@
+'''
+Streaming reader of the Stan CSV sample files
+Date: 10/18/26
+'''
+
+import io
+import os
+import re
+import time
+
+import numpy as np
+
+from morpho.utilities import morphologging
+from morpho.utilities.pystanLoader import FlatnameIndex
+from morpho.utilities.sampleTable import SampleTable
+logger = morphologging.getLogger(__name__)
+
+
+def chain_sample_files(sample_file, n_chains):
+    '''
+    Return the files where PyStan writes the draws of each chain when
+    sampling with sample_file ("<name>_<chain>.csv" for several chains)
+    '''
+    if n_chains == 1:
+        return [sample_file]
+    dirname, basename = os.path.split(sample_file)
+    files = []
+    for iChain in range(n_chains):
+        name = re.sub(r'\.csv\s*$', '_{}.csv'.format(iChain), basename)
+        if name == basename:
+            name = '{}_{}.csv'.format(basename, iChain)
+        files.append(os.path.join(dirname, name))
+    return files
+
+
+def stan_flatname(name):
+    '''
+    Convert a column name of a Stan CSV file into a flatname
+    ("theta.1.2" -> "theta[1,2]"; "lp__" -> "lp_prob")
+    '''
+    if name == 'lp__':
+        return 'lp_prob'
+    parts = name.split('.')
+    if len(parts) == 1:
+        return name
+    return '{}[{}]'.format(parts[0], ','.join(parts[1:]))
+
+
+class CsvTail(object):
+    '''
+    Incremental reader of a text file being written: each call to read()
+    returns the lines completed since the previous call
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self._offset = 0
+        self._partial = ''
+
+    def read(self):
+        try:
+            with open(self.path, 'r') as f:
+                f.seek(self._offset)
+                text = f.read()
+                self._offset = f.tell()
+        except (IOError, OSError):
+            # Not created yet
+            return []
+        lines = (self._partial + text).split('\n')
+        # The last line is incomplete (or empty)
+        self._partial = lines.pop()
+        return lines
+
+
+class StanCsvReader(object):
+    '''
+    Tailing reader of a Stan CSV sample file (one chain), which can be read
+    while Stan is still writing it.
+    The draws are parsed in chunks; only the selected columns are kept.
+    The number of warmup draws is given by the warmup argument, or else by
+    the "Adaptation terminated" comment: until it is written, all the draws
+    are warmup draws, unless the file is complete (timing comments written
+    by Stan at the end) or was written by the Fixed_param sampler, in which
+    case no draw is warmup (e.g. sampling continued without adaptation).
+
+    Arguments:
+        path: sample file
+        names: interestParams-like list of the parameters to keep (as for the
+            PyStanSamplingProcessor); the lp__ (as "lp_prob") and sampler
+            diagnostic columns are always kept (default=None: all the columns)
+        chunk_size: maximum number of draws per batch (default=1000)
+        keep: keep the draws read, for columns() and table() (default=True)
+        warmup: number of warmup draws in the file, if known (default=None)
+    '''
+
+    def __init__(self, path, names=None, chunk_size=1000, keep=True, warmup=None):
+        self.path = path
+        self.names = names
+        self.chunk_size = int(chunk_size)
+        self.keep = keep
+        self.flatnames = None
+        self.n_draws = 0
+        self.known_warmup = warmup
+        self._warmup = None
+        self._fixed_param = False
+        self._complete = False
+        self._tail = CsvTail(path)
+        self._usecols = None
+        self._pending = []
+        self._chunks = []
+
+    @property
+    def warmup(self):
+        '''
+        Number of warmup draws read (all of them until the end of the warmup)
+        '''
+        if self.known_warmup is not None:
+            return min(int(self.known_warmup), self.n_draws)
+        if self._warmup is not None:
+            return self._warmup
+        return 0 if self._fixed_param or self._complete else self.n_draws
+
+    def _set_header(self, line):
+        names = [stan_flatname(a_name) for a_name in line.strip().split(',')]
+        self._usecols = list(range(len(names)))
+        if self.names is not None:
+            parameters = [iKey for iKey, a_name in enumerate(names)
+                          if a_name != 'lp_prob' and not a_name.endswith('__')]
+            selected, _ = FlatnameIndex([names[iKey] for iKey in parameters]).resolve(self.names)
+            selected = set(parameters[iKey] for iKey in selected)
+            self._usecols = [iKey for iKey in self._usecols
+                             if iKey in selected or iKey not in parameters]
+        self.flatnames = [names[iKey] for iKey in self._usecols]
+
+    def _parse(self, lines):
+        if not lines:
+            return None
+        values = np.loadtxt(io.StringIO('\n'.join(lines)), delimiter=',',
+                            usecols=self._usecols, ndmin=2)
+        return {a_name: values[:, iCol] for iCol, a_name in enumerate(self.flatnames)}
+
+    def _poll(self):
+        '''
+        Read the lines added to the file; the draws are queued in self._pending
+        '''
+        for a_line in self._tail.read():
+            if a_line.startswith('#'):
+                if 'Adaptation terminated' in a_line and self._warmup is None:
+                    self._warmup = self.n_draws + len(self._pending)
+                elif 'fixed_param' in a_line.lower():
+                    self._fixed_param = True
+                elif 'Elapsed Time' in a_line and self.flatnames is not None:
+                    # End of the sampling without adaptation
+                    self._complete = True
+                continue
+            if not a_line.strip():
+                continue
+            if self.flatnames is None:
+                self._set_header(a_line)
+                continue
+            self._pending.append(a_line)
+
+    def read(self):
+        '''
+        Return the draws added since the previous call (dictionary of arrays,
+        by flatname), in batches of at most chunk_size draws; None if there
+        are no new draws
+        '''
+        if len(self._pending) < self.chunk_size:
+            self._poll()
+        lines, self._pending = self._pending[:self.chunk_size], self._pending[self.chunk_size:]
+        batch = self._parse(lines)
+        if batch is not None:
+            self.n_draws += len(lines)
+            if self.keep:
+                self._chunks.append(batch)
+        return batch
+
+    def batches(self, follow=False, poll_interval=1., timeout=None, n_draws=None):
+        '''
+        Iterate over the batches of new draws.
+        With follow, wait for new draws (polling every poll_interval seconds)
+        until n_draws draws have been read or no draw was written during
+        timeout seconds (default: forever).
+        '''
+        last = time.time()
+        while True:
+            batch = self.read()
+            if batch is not None:
+                last = time.time()
+                yield batch
+                continue
+            if not follow or (n_draws is not None and self.n_draws >= n_draws) or \
+                    (timeout is not None and time.time() - last > timeout):
+                return
+            time.sleep(poll_interval)
+
+    def columns(self):
+        '''
+        Return all the draws kept (dictionary of arrays, by flatname)
+        '''
+        if not self._chunks:
+            return {a_name: np.empty(0) for a_name in self.flatnames or []}
+        if len(self._chunks) > 1:
+            # Merge the chunks, so that they are only concatenated once
+            self._chunks = [{a_name: np.concatenate([a_chunk[a_name] for a_chunk in self._chunks])
+                             for a_name in self.flatnames}]
+        return dict(self._chunks[0])
+
+    def table(self):
+        '''
+        Return the draws kept as a SampleTable (one chain)
+        '''
+        return merge_readers([self])
+
+
+def merge_readers(readers, n_draws=None):
+    '''
+    Merge the draws of the StanCsvReader of several chains into a SampleTable.
+    The chains are truncated to the same number of draws (or to n_draws).
+    '''
+    columns = [a_reader.columns() for a_reader in readers]
+    length = min(a_reader.n_draws for a_reader in readers)
+    if n_draws is not None:
+        length = min(length, n_draws)
+    warmup = min(min(a_reader.warmup for a_reader in readers), length)
+    names = readers[0].flatnames or []
+    return SampleTable({a_name: np.concatenate([a_chain[a_name][:length] for a_chain in columns])
+                        for a_name in names},
+                       n_chains=len(readers), warmup=warmup, n_draws=length*len(readers))
+
+
+def read_stan_csv(sample_files, names=None, chunk_size=1000,
+                  follow=False, poll_interval=1., timeout=None, n_draws=None, warmup=None):
+    '''
+    Read Stan CSV sample files (one per chain) into a SampleTable.
+    The files can still be being written: the chains are then truncated
+    to the number of draws of the shortest one (see StanCsvReader.batches
+    for follow, poll_interval, timeout and n_draws, and StanCsvReader for warmup).
+    '''
+    if isinstance(sample_files, str):
+        sample_files = [sample_files]
+    readers = [StanCsvReader(a_file, names, chunk_size, warmup=warmup) for a_file in sample_files]
+    for a_reader in readers:
+        for _ in a_reader.batches(follow, poll_interval, timeout, n_draws):
+            pass
+    return merge_readers(readers)
@@ -0,0 +1,176 @@
+'''
+Resolution of the "include=<name>;" statements of Stan models
+Date: 10/18/26
+'''
+
+import os
+import re
+import threading
+from hashlib import md5
+
+from morpho.utilities import morphologging
+logger = morphologging.getLogger(__name__)
+
+include_pattern = re.compile(r'\s*\binclude\s*=\s*(?P<function_name>\w+)\s*;*\n?')
+
+# Content of the files read: path -> (mtime, size, text, hash, included names)
+_files = {}
+# Function files of the directories listed: directory -> (mtime, {name: path})
+_directories = {}
+# Models declaring parameters: key of the include graph -> bool
+_has_parameters = {}
+_lock = threading.RLock()
+
+
+def included_names(theModel):
+    '''
+    Names of the function files included by a Stan code
+    '''
+    return [a_match.group('function_name') for a_match in include_pattern.finditer(theModel)]
+
+
+def _read(path):
+    '''
+    Return the text, hash and included names of a file, reading it only if
+    it changed since the last call
+    '''
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    with _lock:
+        cached = _files.get(path)
+        if cached is not None and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+            return cached[2:]
+        logger.debug("Reading {}".format(path))
+        with open(path, 'r') as f:
+            text = f.read()
+        cached = (stat.st_mtime_ns, stat.st_size, text,
+                  md5(text.encode('utf-8')).hexdigest(), included_names(text))
+        _files[path] = cached
+        return cached[2:]
+
+
+def _function_files(function_files_location):
+    '''
+    Return the function files (name -> path) of a directory, listing it
+    only if it changed since the last call.
+    <name>.functions files take precedence over <name>.stan files.
+    '''
+    if function_files_location is None:
+        return {}
+    directory = os.path.abspath(function_files_location)
+    mtime = os.stat(directory).st_mtime_ns
+    with _lock:
+        cached = _directories.get(directory)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        logger.debug('Looking for the functions to import in {}'.format(directory))
+        files = {}
+        for filename in sorted(os.listdir(directory)):
+            path = os.path.join(directory, filename)
+            if filename.endswith('.functions') and os.path.isfile(path):
+                files[filename[:-10]] = path
+            elif filename.endswith('.stan') and os.path.isfile(path):
+                files.setdefault(filename[:-5], path)
+        _directories[directory] = (mtime, files)
+        return files
+
+
+def has_parameters_block(theModel):
+    '''
+    Check if a Stan code declares parameters (in a non-empty "parameters" block)
+    '''
+    # Remove the string literals and the comments
+    theModel = re.sub(r'"(?:[^"\\\n]|\\.)*"|/\*.*?\*/|//[^\n]*|#[^\n]*', '',
+                      theModel, flags=re.DOTALL)
+    for a_match in re.finditer(r'(\w+\s+)?\bparameters\s*\{\s*(\}?)', theModel):
+        if a_match.group(1) is not None and a_match.group(1).strip() == 'transformed':
+            continue
+        return not a_match.group(2)
+    return False
+
+
+class IncludeGraph(object):
+    '''
+    Include dependency graph of a Stan model.
+    The includes are resolved recursively; the content of each file is only
+    re-read when its modification time changes.
+
+    Arguments:
+        model_code: location of the Stan model
+        function_files_location: location of the included function files
+    '''
+
+    def __init__(self, model_code, function_files_location=None):
+        self.model_code = os.path.abspath(model_code)
+        self.function_files_location = function_files_location
+        # path -> list of included paths (None for missing includes)
+        self.dependencies = {}
+        self.hashes = {}
+        self.missing = []
+        self.key = self._visit(self.model_code, [])
+
+    def _visit(self, path, stack):
+        if path in stack:
+            chain = " -> ".join(os.path.basename(a_path) for a_path in stack + [path])
+            logger.error("Circular include: {}".format(chain))
+            raise ValueError("Circular include: {}".format(chain))
+        _, file_hash, names = _read(path)
+        self.hashes[path] = file_hash
+        files = _function_files(self.function_files_location)
+        children = []
+        keys = [file_hash]
+        for name in names:
+            if name not in files:
+                logger.critical('A function <{}> to import is missing'.format(name))
+                self.missing.append(name)
+                children.append(None)
+                keys.append("missing:" + name)
+                continue
+            children.append(files[name])
+            keys.append(self._visit(files[name], stack + [path]))
+        self.dependencies[path] = children
+        # Composite key: content of the file and of all its includes
+        return md5(":".join(keys).encode('utf-8')).hexdigest()
+
+    def files(self):
+        '''
+        List of the files the model depends on (the model itself included)
+        '''
+        return list(self.dependencies)
+
+    def expand(self):
+        '''
+        Return the code of the model with the includes replaced by the
+        content of the function files
+        '''
+        return self._expand(self.model_code)
+
+    def has_parameters(self):
+        '''
+        Check if the model declares parameters (the code is only expanded
+        the first time for a given content of the model and of its includes)
+        '''
+        with _lock:
+            if self.key not in _has_parameters:
+                _has_parameters[self.key] = has_parameters_block(self.expand())
+            return _has_parameters[self.key]
+
+    def _expand(self, path):
+        text = _read(path)[0]
+        children = iter(self.dependencies[path])
+
+        def replace(a_match):
+            child = next(children)
+            if child is None:
+                return a_match.group(0)
+            logger.debug('Function file <{}> to import was found'.format(
+                a_match.group('function_name')))
+            return self._expand(child)
+        return include_pattern.sub(replace, text)
+
+
+def resolve_includes(model_code, function_files_location=None):
+    '''
+    Return the include dependency graph of a Stan model
+    '''
+    return IncludeGraph(model_code, function_files_location)
@@ -0,0 +1,248 @@
+'''
+Posterior summaries (mean, sd, se_mean, n_eff, split-Rhat) computed in one
+batched pass over the draws of all the parameters
+Date: 10/18/26
+'''
+
+import numpy as np
+
+from morpho.utilities import morphologging
+logger = morphologging.getLogger(__name__)
+
+summary_names = ['mean', 'se_mean', 'sd', 'n_eff', 'Rhat']
+
+
+def autocovariance(draws):
+    '''
+    Autocovariance of each chain and parameter, computed using FFT.
+    Args:
+        draws: array of shape (iterations, chains, params)
+    Returns:
+        array: autocovariance with shape (lags, chains, params)
+    '''
+    n = draws.shape[0]
+    centered = draws - draws.mean(axis=0)
+    n_fft = 2**int(np.ceil(np.log2(2*n)))
+    freq = np.fft.rfft(centered, n=n_fft, axis=0)
+    acov = np.fft.irfft(freq * np.conjugate(freq), n=n_fft, axis=0)[:n]
+    return acov / n
+
+
+def split_chains(draws):
+    '''
+    Split each chain in two halves (the middle draw of odd chains is dropped).
+    Args:
+        draws: array of shape (iterations, chains, params)
+    Returns:
+        array: draws with shape (iterations/2, 2*chains, params)
+    '''
+    half = draws.shape[0] // 2
+    return np.concatenate([draws[:half], draws[draws.shape[0]-half:]], axis=1)
+
+
+def effective_sample_size(draws):
+    '''
+    Effective sample size using Geyer's initial monotone sequence estimator.
+    Args:
+        draws: array of shape (iterations, chains, params)
+    Returns:
+        array: effective sample size of each parameter
+    '''
+    n, m = draws.shape[:2]
+    if n < 4:
+        return np.full(draws.shape[2:], np.nan)
+    acov = autocovariance(draws)
+    chain_mean = draws.mean(axis=0)
+    mean_var = acov[0].mean(axis=0) * n / (n - 1.)
+    var_plus = mean_var * (n - 1.) / n
+    if m > 1:
+        var_plus = var_plus + chain_mean.var(axis=0, ddof=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rho = 1. - (mean_var - acov.mean(axis=1)) / var_plus
+    rho[0] = 1.
+    # Sums of consecutive pairs of autocorrelations, truncated at the first
+    # non-positive pair and forced to be monotonically decreasing
+    n_pairs = n // 2
+    pairs = rho[0:2*n_pairs:2] + rho[1:2*n_pairs:2]
+    positive = np.cumprod(pairs > 0, axis=0).astype(bool)
+    pairs = np.minimum.accumulate(np.where(positive, pairs, 0.), axis=0)
+    tau = -1. + 2. * pairs.sum(axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ess = m * n / tau
+    return np.minimum(ess, m * n * np.log10(m * n))
+
+
+def split_rhat(draws):
+    '''
+    Potential scale reduction factor computed on split chains.
+    Args:
+        draws: array of shape (iterations, chains, params)
+    Returns:
+        array: split-Rhat of each parameter
+    '''
+    draws = split_chains(draws)
+    n = draws.shape[0]
+    if n < 2:
+        return np.full(draws.shape[2:], np.nan)
+    within = draws.var(axis=0, ddof=1).mean(axis=0)
+    between = draws.mean(axis=0).var(axis=0, ddof=1)
+    var_plus = within * (n - 1.) / n + between
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.sqrt(var_plus / within)
+
+
+def normal_ppf(p):
+    '''
+    Quantile function of the standard normal distribution
+    (rational approximation of P. J. Acklam, relative error < 1.2e-9)
+    '''
+    a = [-3.969683028665376e+01, 2.209460984245205e+02, -2.759285104469687e+02,
+         1.383577518672690e+02, -3.066479806614716e+01, 2.506628277459239e+00]
+    b = [-5.447609879822406e+01, 1.615858368580409e+02, -1.556989798598866e+02,
+         6.680131188771972e+01, -1.328068155288572e+01]
+    c = [-7.784894002430293e-03, -3.223964580411365e-01, -2.400758277161838e+00,
+         -2.549732539343734e+00, 4.374664141464968e+00, 2.938163982698783e+00]
+    d = [7.784695709041462e-03, 3.224671290700398e-01, 2.445134137142996e+00,
+         3.754408661907416e+00]
+    p = np.asarray(p, dtype=float)
+    # Use the symmetry of the distribution for the upper tail
+    q = np.minimum(p, 1. - p)
+    x = np.empty_like(q)
+    low = q < 0.02425
+    with np.errstate(divide='ignore', invalid='ignore'):
+        r = np.sqrt(-2. * np.log(q[low]))
+        x[low] = (((((c[0]*r + c[1])*r + c[2])*r + c[3])*r + c[4])*r + c[5]) / \
+            ((((d[0]*r + d[1])*r + d[2])*r + d[3])*r + 1.)
+    r = q[~low] - 0.5
+    t = r * r
+    x[~low] = (((((a[0]*t + a[1])*t + a[2])*t + a[3])*t + a[4])*t + a[5])*r / \
+        (((((b[0]*t + b[1])*t + b[2])*t + b[3])*t + b[4])*t + 1.)
+    return np.where(p > 0.5, -x, x)
+
+
+def rank_normalize(draws):
+    '''
+    Replace the draws by the normal scores of their ranks (over all chains)
+    Args:
+        draws: array of shape (iterations, chains, params)
+    Returns:
+        array: rank-normalized draws with the same shape
+    '''
+    n_draws = draws.shape[0] * draws.shape[1]
+    flat = draws.reshape((n_draws, -1))
+    # Average rank of ties
+    order = np.argsort(flat, axis=0, kind='mergesort')
+    ranks = np.empty_like(flat, dtype=float)
+    np.put_along_axis(ranks, order, np.arange(1, n_draws + 1, dtype=float)[:, np.newaxis], axis=0)
+    for iParam in range(flat.shape[1]):
+        values, inverse, counts = np.unique(flat[:, iParam], return_inverse=True,
+                                            return_counts=True)
+        if len(values) < n_draws:
+            sums = np.bincount(inverse.ravel(), weights=ranks[:, iParam])
+            ranks[:, iParam] = (sums / counts)[inverse.ravel()]
+    return normal_ppf((ranks - 3./8) / (n_draws + 1./4)).reshape(draws.shape)
+
+
+def bulk_effective_sample_size(draws):
+    '''
+    Bulk effective sample size: effective sample size of the rank-normalized
+    split chains (Vehtari et al., 2021)
+    Args:
+        draws: array of shape (iterations, chains, params)
+    Returns:
+        array: bulk effective sample size of each parameter
+    '''
+    draws = split_chains(np.asarray(draws, dtype=float))
+    return effective_sample_size(rank_normalize(draws))
+
+
+def stack_draws(table, names):
+    '''
+    Gather the post-warmup draws of columns of a SampleTable.
+    Columns storing indexed parameters with shape (draws, *dims) are
+    split per element, using Stan flatnames (e.g. "x[1,2]").
+    Returns:
+        list: flatnames of the parameters
+        array: draws with shape (iterations, chains, params)
+    '''
+    flatnames = []
+    draws = []
+    for name in names:
+        # Array of shape (chains, iterations, *dims)
+        values = table.draws(name)
+        dims = values.shape[2:]
+        if dims:
+            flatnames += [_flatname(name, index, dims)
+                          for index in range(int(np.prod(dims)))]
+            values = values.reshape(values.shape[:2] + (-1,), order='F')
+        else:
+            flatnames.append(name)
+            values = values[:, :, np.newaxis]
+        draws.append(values)
+    if not draws:
+        return flatnames, np.zeros((table.n_iterations - table.warmup, table.n_chains, 0))
+    return flatnames, np.swapaxes(np.concatenate(draws, axis=2), 0, 1)
+
+
+def summarize(draws):
+    '''
+    Compute the posterior summaries of all parameters at once.
+    Args:
+        draws: array of shape (iterations, chains, params) without warmup
+    Returns:
+        dict: arrays of mean, se_mean, sd, n_eff and Rhat of each parameter
+    '''
+    draws = np.asarray(draws, dtype=float)
+    n_draws = draws.shape[0] * draws.shape[1]
+    mean = draws.mean(axis=(0, 1))
+    if n_draws > 1:
+        sd = draws.reshape((n_draws,) + draws.shape[2:]).std(axis=0, ddof=1)
+    else:
+        sd = np.full(mean.shape, np.nan)
+    n_eff = effective_sample_size(split_chains(draws))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        se_mean = sd / np.sqrt(n_eff)
+    return {
+        'mean': mean,
+        'se_mean': se_mean,
+        'sd': sd,
+        'n_eff': n_eff,
+        'Rhat': split_rhat(draws)
+    }
+
+
+def add_summaries(table, names):
+    '''
+    Add the mean, se_mean, sd, n_eff and Rhat dictionaries of the given
+    columns to a SampleTable.
+    They are computed together, the first time one of them is accessed.
+    Columns storing indexed parameters with shape (draws, *dims) are
+    summarized per element, using Stan flatnames (e.g. "x[1,2]").
+    '''
+    names = [str(name) for name in names]
+    summaries = {}
+
+    def compute():
+        if not summaries:
+            logger.debug("Computing summaries of {} columns".format(len(names)))
+            flatnames, draws = stack_draws(table, names)
+            if flatnames:
+                values = summarize(draws)
+            else:
+                values = {key: [] for key in summary_names}
+            for key in summary_names:
+                summaries[key] = {name: float(value)
+                                  for name, value in zip(flatnames, values[key])}
+        return summaries
+
+    for key in summary_names:
+        table.add_lazy_entry(key, lambda key=key: compute()[key])
+    return table
+
+
+def _flatname(name, index, dims):
+    '''
+    Stan flatname of the index-th element (column-major order) of an indexed parameter
+    '''
+    indexes = np.unravel_index(index, dims, order='F')
+    return "{}[{}]".format(name, ",".join(str(i+1) for i in indexes))
@@ -7,8 +7,9 @@ Date: 06/26/18
 '''
 import os
 import importlib
+from concurrent.futures import ThreadPoolExecutor
 
-from morpho.utilities import morphologging, parser
+from morpho.utilities import morphologging, parser, seeding
 logger = morphologging.getLogger(__name__)
 
 
@@ -17,13 +18,25 @@ class ToolBox:
     Manages processors requested by the user at run-time.
     Via a configuration file, the user defines which processor to use, how to
     configure them and how to connect them.
+    Once configured, the processors can prepare themselves (e.g. compile
+    their Stan model) in a background worker while the chain is running,
+    unless "prepare_in_background" is set to false in "processors-toolbox".
+    If a master seed is given (--seed or "seed" in "processors-toolbox"),
+    each processor without its own "seed" gets a seed derived from the master
+    seed, the job id (--job_id or "job_id") and its name, so that each job of
+    a batch can be reproduced alone.
+    The result cache of the processors is disabled by --no-result-cache
+    (or "no_result_cache" in "processors-toolbox").
     '''
 
     def __init__(self, args):
         self._ReadConfigFile(args.config)
         self._UpdateConfigFromCLI(args)
+        self._ReadSeeds(args)
         self._processors_dict = dict()
         self._chain_processors = []
+        self._executor = None
+        self._preparations = []
 
     def _ReadConfigFile(self, filename):
         if os.path.exists(filename):
@@ -51,6 +64,19 @@ class ToolBox:
             self.config_dict = parser.update_from_arguments(
                 self.config_dict, args.param)
 
+    def _ReadSeeds(self, args):
+        toolbox_dict = self.config_dict["processors-toolbox"]
+        self.master_seed = getattr(args, "seed", None)
+        if self.master_seed is None:
+            self.master_seed = toolbox_dict.get("seed")
+        self.job_id = getattr(args, "job_id", None)
+        if self.job_id is None:
+            self.job_id = toolbox_dict.get("job_id", 0)
+        if self.master_seed is not None:
+            logger.info("Master seed: {}; job id: {}".format(self.master_seed, self.job_id))
+        self.no_result_cache = getattr(args, "no_result_cache", False) or \
+            toolbox_dict.get("no_result_cache", False)
+
     def _CreateAndConfigureProcessors(self):
         for a_dict in self.config_dict["processors-toolbox"]["processors"]:
             if not self._CreateOneProcessor(a_dict["name"], a_dict["type"]):
@@ -63,6 +89,12 @@ class ToolBox:
                 config_dict = self.config_dict[procName]
             else:
                 config_dict = dict()
+            if self.master_seed is not None and "seed" not in config_dict:
+                config_dict = dict(config_dict, seed=seeding.derive_seed(
+                    self.master_seed, self.job_id, procName))
+            if self.no_result_cache and config_dict.get("result_cache"):
+                logger.info("Result cache of <{}> disabled".format(procName))
+                config_dict = dict(config_dict, result_cache=False)
             try:
                 processor["object"].Configure(config_dict)
             except Exception as err:
@@ -71,6 +103,36 @@ class ToolBox:
                 return False
         return True
 
+    def _PrepareProcessors(self):
+        '''
+        Start the background preparation of the processors
+        '''
+        if not self.config_dict["processors-toolbox"].get("prepare_in_background", True):
+            return True
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        for procName, processor in self._processors_dict.items():
+            if not hasattr(processor["object"], "Prepare"):
+                continue
+            try:
+                future = processor["object"].Prepare(self._executor)
+            except Exception as err:
+                logger.error(
+                    "Preparation of <{}> failed: \n{}".format(procName, err))
+                return False
+            if future is not None:
+                logger.debug("Preparing <{}> in the background".format(procName))
+                self._preparations.append(future)
+        return True
+
+    def _StopPreparations(self):
+        if self._executor is None:
+            return
+        for future in self._preparations:
+            future.cancel()
+        self._executor.shutdown(wait=False)
+        self._executor = None
+        self._preparations = []
+
     def _CreateOneProcessor(self, procName, procClass):
         # Parsing procClass
         if ":" in procClass:
@@ -186,12 +248,18 @@ class ToolBox:
         if not self._CreateAndConfigureProcessors():
             logger.error("Error while creating and configuring processors!")
             return False
-        if not self._DefineChain():
-            logger.error("Error while defining processors chain!")
-            return False
-        if not self._RunChain():
-            logger.error("Error while running processors!")
-            return False
+        try:
+            if not self._PrepareProcessors():
+                logger.error("Error while preparing processors!")
+                return False
+            if not self._DefineChain():
+                logger.error("Error while defining processors chain!")
+                return False
+            if not self._RunChain():
+                logger.error("Error while running processors!")
+                return False
+        finally:
+            self._StopPreparations()
 
     def GetProcessor(procName):
         if self._processors_dict[str(procName)]['deleted']:
@@ -69,6 +69,29 @@ class IOTests(unittest.TestCase):
             logger.info("{} -> size = {}".format(key, len(data2[key])))
             self.assertEqual(len(data2[key]), 6)
 
+    def test_JSONIO_shape(self):
+        logger.info("JSONIO shape test")
+        import numpy as np
+        from morpho.processors.IO import IOJSONProcessor
+        writer_config = {
+            "action": "write",
+            "filename": "myTest_shape.json",
+            "variables": ["matrix"]
+        }
+        reader_config = {
+            "action": "read",
+            "filename": "myTest_shape.json",
+            "variables": ["matrix"]
+        }
+        a = IOJSONProcessor("WriterJSON")
+        b = IOJSONProcessor("ReaderJSON")
+        a.Configure(writer_config)
+        b.Configure(reader_config)
+        a.data = {"matrix": np.arange(24.).reshape(4, 2, 3)}
+        a.Run()
+        b.Run()
+        self.assertEqual(np.shape(b.data["matrix"]), (4, 2, 3))
+
     def test_ROOTIO(self):
         logger.info("IOROOT test")
         from morpho.processors.IO import IOROOTProcessor
@@ -111,6 +134,32 @@ class IOTests(unittest.TestCase):
             logger.info("{} -> size = {}".format(key, len(data[key])))
             self.assertEqual(len(data[key]), 6)
 
+    def test_ROOTIO_shape(self):
+        logger.info("IOROOT shape test")
+        import numpy as np
+        from morpho.processors.IO import IOROOTProcessor
+        writer_config = {
+            "action": "write",
+            "tree_name": "test",
+            "filename": "myTest_shape.root",
+            "variables": ["matrix"]
+        }
+        reader_config = {
+            "action": "read",
+            "tree_name": "test",
+            "filename": "myTest_shape.root",
+            "variables": ["matrix"]
+        }
+        a = IOROOTProcessor("WriterROOT")
+        b = IOROOTProcessor("ReaderROOT")
+        a.Configure(writer_config)
+        b.Configure(reader_config)
+        a.data = {"matrix": np.arange(24.).reshape(4, 2, 3)}
+        a.Run()
+        b.Run()
+        self.assertEqual(np.shape(b.data["matrix"]), (4, 2, 3))
+        self.assertTrue(np.allclose(b.data["matrix"], np.arange(24.).reshape(4, 2, 3)))
+
     def test_RIO(self):
         logger.info("IOR test")
         from morpho.processors.IO import IORProcessor
@@ -139,6 +188,30 @@ class IOTests(unittest.TestCase):
             logger.info("{} -> size = {}".format(key, len(data[key])))
             self.assertEqual(len(data[key]), 6)
 
+    def test_RIO_shape(self):
+        logger.info("IOR shape test")
+        import numpy as np
+        from morpho.processors.IO import IORProcessor
+        writer_config = {
+            "action": "write",
+            "filename": "myFile_shape.r",
+            "variables": ["matrix"]
+        }
+        reader_config = {
+            "action": "read",
+            "filename": "myFile_shape.r",
+            "variables": ["matrix"]
+        }
+        a = IORProcessor("writer")
+        b = IORProcessor("reader")
+        a.Configure(writer_config)
+        b.Configure(reader_config)
+        a.data = {"matrix": np.arange(24.).reshape(4, 2, 3)}
+        a.Run()
+        b.Run()
+        self.assertEqual(np.shape(b.data["matrix"]), (4, 2, 3))
+        self.assertTrue(np.allclose(b.data["matrix"], np.arange(24.).reshape(4, 2, 3)))
+
     def test_CVSIO(self):
         logger.info("IOCVS test")
         from morpho.processors.IO import IOCVSProcessor
@@ -172,5 +245,54 @@ class IOTests(unittest.TestCase):
             print(6)
             self.assertEqual(len(data[key]), 6)
 
+    def test_StanCSVIO(self):
+        logger.info("StanCSVIO test")
+        from morpho.processors.IO import IOStanCSVProcessor
+
+        header = "lp__,accept_stat__,stepsize__,treedepth__,n_leapfrog__,divergent__,energy__,x,theta.1,theta.2\n"
+        for iChain in range(2):
+            with open("myTest_samples_{}.csv".format(iChain), "w") as f:
+                f.write("# model = anon_model\n" + header)
+                for iDraw in range(10):
+                    if iDraw == 4:
+                        f.write("# Adaptation terminated\n")
+                    f.write("-1,0.9,0.5,2,3,0,1,{},{},2\n".format(iDraw, iChain))
+                # Draw being written by Stan
+                f.write("-1,0.9")
+
+        reader_config = {
+            "action": "read",
+            "filename": "myTest_samples.csv",
+            "variables": ["x", "theta[2]"],
+            "chain": 2,
+            "chunk_size": 3
+        }
+        a = IOStanCSVProcessor("ReaderStanCSV")
+        a.Configure(reader_config)
+        self.assertTrue(a.Run())
+        data = a.data
+        self.assertEqual(data.n_chains, 2)
+        self.assertEqual(data.warmup, 4)
+        self.assertEqual(list(data["x"][:10]), list(range(10)))
+        self.assertIn("theta[2]", data)
+        self.assertNotIn("theta[1]", data)
+        self.assertIn("n_leapfrog__", data)
+        self.assertAlmostEqual(data["mean"]["x"], 6.5)
+
+        # Sampling without adaptation (e.g. continued chunk): no warmup draws
+        with open("myTest_noadapt.csv", "w") as f:
+            f.write(header + "-1,0.9,0.5,2,3,0,1,1,1,2\n"*5)
+            f.write("\n#  Elapsed Time: 0.01 seconds (Warm-up)\n")
+        a = IOStanCSVProcessor("ReaderStanCSV")
+        a.Configure(dict(reader_config, filename="myTest_noadapt.csv", chain=1))
+        self.assertTrue(a.Run())
+        self.assertEqual(a.data.warmup, 0)
+        # Known number of warmup draws
+        a = IOStanCSVProcessor("ReaderStanCSV")
+        a.Configure(dict(reader_config, filename="myTest_noadapt.csv", chain=1, warmup=2))
+        self.assertTrue(a.Run())
+        self.assertEqual(a.data.warmup, 2)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,52 @@
+'''
+Test the simulation-based calibration of the linear model of the model_test example.
+Date: 10/18/26
+'''
+
+import unittest
+
+from morpho.utilities import morphologging
+logger = morphologging.getLogger(__name__)
+
+
+class SBCTest(unittest.TestCase):
+
+    def test(self):
+        logger.info("Simulation-based calibration")
+        from morpho.processors.analysis import SimulationBasedCalibration
+
+        sbc_config = {
+            "sampler": {
+                "model_code": "../../examples/model_test/models/model_fit.stan",
+                "input_data": {"N": 0, "x": [], "y": []},
+                "interestParams": ["slope", "intercept", "sigma"],
+                "iter": 400,
+                "warmup": 300
+            },
+            "generator": {
+                "model_code": "../../examples/model_test/models/model_generator.stan",
+                "input_data": {"xmin": 1, "xmax": 10},
+                "interestParams": ["x", "y"],
+                "iter": 200
+            },
+            "analyzer": {
+                "model_code": "../../examples/model_test/models/model_fit.stan",
+                "interestParams": ["slope", "intercept", "sigma"],
+                "iter": 400
+            },
+            "parameters": ["slope", "intercept", "sigma"],
+            "size_name": "N",
+            "n_replications": 4,
+            "n_workers": 2,
+            "seed": 1234
+        }
+        sbc = SimulationBasedCalibration("sbc")
+        self.assertTrue(sbc.Configure(sbc_config))
+        self.assertTrue(sbc.Run())
+        self.assertEqual(len(sbc.results["replications"]), 4)
+        for rank in sbc.results["rank"]["slope"]:
+            self.assertTrue(0 <= rank <= 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -6,6 +6,8 @@ Date: Feb 27 2018
 
 import unittest
 
+import numpy as np
+
 from morpho.utilities import morphologging
 logger = morphologging.getLogger(__name__)
 
@@ -40,6 +42,247 @@ class SamplingTests(unittest.TestCase):
         # Because we need this generator for the LinearFit analysis, we return the data, and not a bool
         return pystanProcessor.results
 
+    def test_PyStanApproximation(self):
+        logger.info("PyStanApproximation test")
+        from morpho.processors.sampling import PyStanApproximationProcessor
+
+        approximation_config = {
+            "model_code": "model.stan",
+            "input_data": {
+                "slope": 1,
+                "intercept": -2,
+                "xmin": 1,
+                "xmax": 10,
+                "sigma": 1.6
+            },
+            "method": "vb",
+            "output_samples": 200,
+            "interestParams": ['x', 'y'],
+        }
+
+        approximationProcessor = PyStanApproximationProcessor("approximationProcessor")
+        self.assertTrue(approximationProcessor.Configure(approximation_config))
+        self.assertTrue(approximationProcessor.Run())
+        self.assertEqual(len(approximationProcessor.results["y"]), 200)
+        self.assertEqual(sum(approximationProcessor.results["is_sample"]), 200)
+
+    def test_PyStanLaplace(self):
+        logger.info("PyStanLaplace test")
+        from morpho.processors.sampling import PyStanLaplaceProcessor
+
+        laplace_config = {
+            "model_code": "model.stan",
+            "input_data": {
+                "slope": 1,
+                "intercept": -2,
+                "xmin": 1,
+                "xmax": 10,
+                "sigma": 1.6
+            },
+            "output_samples": 500,
+            "interestParams": ['x', 'y'],
+        }
+
+        laplaceProcessor = PyStanLaplaceProcessor("laplaceProcessor")
+        self.assertTrue(laplaceProcessor.Configure(laplace_config))
+        self.assertTrue(laplaceProcessor.Run())
+        self.assertEqual(len(laplaceProcessor.results["x"]), 500)
+        self.assertTrue(all(1 <= x <= 10 for x in laplaceProcessor.results["x"]))
+
+    def test_PyStanMultiFit(self):
+        logger.info("PyStanMultiFit test")
+        from morpho.processors.sampling import PyStanMultiFitProcessor
+
+        multifit_config = {
+            "model_code": "model.stan",
+            "input_data": {
+                "xmin": 1,
+                "xmax": 10,
+                "sigma": 1.6
+            },
+            "datasets": {
+                "steep": {"slope": 2, "intercept": -2},
+                "flat": {"slope": 0.5, "intercept": 1}
+            },
+            "iter": 100,
+            "interestParams": ['x', 'y'],
+            "n_workers": 2,
+            "seed": 1234
+        }
+
+        multiFitProcessor = PyStanMultiFitProcessor("multiFitProcessor")
+        self.assertTrue(multiFitProcessor.Configure(multifit_config))
+        self.assertTrue(multiFitProcessor.Run())
+        self.assertEqual(list(multiFitProcessor.results), ["steep", "flat"])
+        self.assertEqual(len(multiFitProcessor.results["flat"]["y"]), 100)
+        self.assertEqual(multiFitProcessor.failed, [])
+
+    def test_PyStanChainId(self):
+        logger.info("PyStanChainId test")
+        from morpho.processors.sampling import PyStanSamplingProcessor
+
+        chain_config = {
+            "model_code": "model.stan",
+            "input_data": {
+                "slope": 1,
+                "intercept": -2,
+                "xmin": 1,
+                "xmax": 10,
+                "sigma": 1.6
+            },
+            "iter": 100,
+            "chain": 4,
+            "interestParams": ['x', 'y'],
+            "seed": 1234
+        }
+
+        def run(config):
+            pystanProcessor = PyStanSamplingProcessor("chainProcessor")
+            self.assertTrue(pystanProcessor.Configure(config))
+            self.assertTrue(pystanProcessor.Run())
+            return pystanProcessor.results
+        all_chains = run(chain_config)
+        # The fourth chain is rerun alone
+        alone = run(dict(chain_config, chain=1, chain_id=3))
+        self.assertEqual(alone["seeds"]["chain_id"], [3])
+        self.assertTrue(np.array_equal(alone["y"], all_chains.chain(3)["y"]))
+
+    def test_PyStanChunks(self):
+        logger.info("PyStanChunks test")
+        from morpho.processors.sampling import PyStanSamplingProcessor
+        from morpho.utilities import SampleTable, converged
+
+        chunks_config = {
+            "model_code": "model.stan",
+            "input_data": {
+                "slope": 1,
+                "intercept": -2,
+                "xmin": 1,
+                "xmax": 10,
+                "sigma": 1.6
+            },
+            "iter": 200,
+            "chain": 2,
+            "chunk_iter": 50,
+            "interestParams": ['x', 'y'],
+            "target_rhat": 1.1,
+            "target_ess": {"x": 150},
+            "seed": 1234
+        }
+
+        # Convergence check on independent and on shifted chains
+        rng = np.random.RandomState(1234)
+        draws = rng.normal(size=2000)
+        self.assertTrue(converged(SampleTable({"x": draws}, n_chains=2), ["x"], 1.1, {"x": 150}))
+        draws[1000:] += 3
+        self.assertFalse(converged(SampleTable({"x": draws}, n_chains=2), ["x"], 1.1, {"x": 150}))
+
+        pystanProcessor = PyStanSamplingProcessor("chunksProcessor")
+        self.assertTrue(pystanProcessor.Configure(chunks_config))
+        self.assertTrue(pystanProcessor.Run())
+        results = pystanProcessor.results
+        n_samples = results.n_iterations - results.warmup
+        self.assertEqual(n_samples % 50, 0)
+        self.assertEqual(len(results["seeds"]["chunks"]), n_samples//50)
+        self.assertLessEqual(results["Rhat"]["x"], 1.1)
+
+    def test_PyStanCheckpoint(self):
+        logger.info("PyStanCheckpoint test")
+        import tempfile
+        from morpho.processors.sampling import PyStanSamplingProcessor
+
+        checkpoint_config = {
+            "model_code": "model.stan",
+            "input_data": {
+                "slope": 1,
+                "intercept": -2,
+                "xmin": 1,
+                "xmax": 10,
+                "sigma": 1.6
+            },
+            "iter": 200,
+            "chunk_iter": 50,
+            "interestParams": ['x', 'y'],
+            "checkpoint_dir": tempfile.mkdtemp(),
+            "seed": 1234
+        }
+
+        def run(config):
+            pystanProcessor = PyStanSamplingProcessor("checkpointProcessor")
+            self.assertTrue(pystanProcessor.Configure(config))
+            self.assertTrue(pystanProcessor.Run())
+            return pystanProcessor.results
+        first = run(checkpoint_config)
+        self.assertEqual(len(first["y"]), 200)
+        # A finished checkpoint of the same configuration gives the same draws
+        self.assertTrue(np.array_equal(run(checkpoint_config)["y"], first["y"]))
+        # The checkpoint of other data is not resumed
+        changed = dict(checkpoint_config, input_data=dict(checkpoint_config["input_data"], slope=5))
+        second = run(changed)
+        self.assertEqual(len(second["y"]), 200)
+        self.assertFalse(np.array_equal(second["y"], first["y"]))
+        self.assertTrue(np.array_equal(run(changed)["y"], second["y"]))
+
+    def test_PyStanResultCache(self):
+        logger.info("PyStanResultCache test")
+        import tempfile
+        from concurrent.futures import ThreadPoolExecutor
+        from morpho.processors.sampling import PyStanSamplingProcessor
+
+        cache_config = {
+            "model_code": "model.stan",
+            "input_data": {
+                "slope": 1,
+                "intercept": -2,
+                "xmin": 1,
+                "xmax": 10,
+                "sigma": 1.6
+            },
+            "iter": 100,
+            "interestParams": ['x', 'y'],
+            "result_cache": True,
+            "result_cache_dir": tempfile.mkdtemp(),
+            "seed": 1234
+        }
+
+        first = PyStanSamplingProcessor("cacheProcessor")
+        self.assertTrue(first.Configure(cache_config))
+        self.assertTrue(first.Run())
+        # The cached results are used without preparing or loading the model
+        second = PyStanSamplingProcessor("cacheProcessor")
+        self.assertTrue(second.Configure(cache_config))
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            self.assertIsNone(second.Prepare(executor))
+        self.assertTrue(second.Run())
+        self.assertFalse(hasattr(second, "stanModel"))
+        self.assertTrue(np.array_equal(second.results["y"], first.results["y"]))
+
+    def test_StanGradientBenchmark(self):
+        logger.info("StanGradientBenchmark test")
+        from morpho.processors.diagnostics import StanGradientBenchmark
+
+        benchmark_config = {
+            "model_code": "model.stan",
+            "input_data": {
+                "slope": 1,
+                "intercept": -2,
+                "xmin": 1,
+                "xmax": 10,
+                "sigma": 1.6
+            },
+            "iter": 1000,
+            "chain": 2,
+            "n_points": 5,
+            "pilot_iter": 100
+        }
+
+        benchmark = StanGradientBenchmark("benchmark")
+        self.assertTrue(benchmark.Configure(benchmark_config))
+        self.assertTrue(benchmark.Run())
+        self.assertEqual(benchmark.results["n_unconstrained"], 2)
+        self.assertGreater(benchmark.results["grad_log_prob"]["evals_per_second"], 0)
+        self.assertGreater(benchmark.results["estimated_wall_time"], 0)
+
     def test_LinearFitRooFitSampler(self):
         logger.info("LinearFitRooFitSampler test")
         from morpho.processors.sampling import LinearFitRooFitLikelihoodProcessor
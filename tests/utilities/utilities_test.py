@@ -0,0 +1,490 @@
+'''
+This scripts aims at testing utilities used by the processors.
+Date: 10/18/26
+'''
+
+import os
+import unittest
+
+import numpy as np
+
+from morpho.utilities import morphologging
+logger = morphologging.getLogger(__name__)
+
+
+class FakeStanFit(object):
+    '''
+    Minimal StanFit output: random draws of the flatnames and lp__ and
+    random sampler diagnostics
+    '''
+
+    diagnostics = ['accept_stat__', 'stepsize__', 'n_leapfrog__',
+                   'treedepth__', 'divergent__', 'energy__']
+
+    def __init__(self, flatnames, n_iter, n_chains, seed=1234, diagnostics=None):
+        rng = np.random.RandomState(seed)
+        if diagnostics is not None:
+            self.diagnostics = diagnostics
+        self.flatnames = list(flatnames)
+        self.sim = {'n_save': [n_iter]*n_chains, 'chains': n_chains}
+        self._samples = rng.normal(size=(n_iter, n_chains, len(flatnames) + 1))
+        self._diagnostics = [{key: rng.uniform(size=n_iter) for key in self.diagnostics}
+                             for _ in range(n_chains)]
+
+    def extract(self, permuted=False, inc_warmup=True):
+        return self._samples
+
+    def get_sampler_params(self, inc_warmup=True):
+        return self._diagnostics
+
+
+def reference_extraction(conf, fit):
+    '''
+    Per-flatname extraction loop of the original pystanLoader
+    '''
+    samples = fit.extract(permuted=False, inc_warmup=True)
+    diagnostics = fit.get_sampler_params(inc_warmup=True)
+    desired_var = [a_name for a_name in fit.flatnames
+                   if any(a_name.startswith(a_key + '[') or a_name == a_key
+                          for a_key in conf['interestParams'])]
+    output = {key: [] for key in desired_var + fit.diagnostics +
+              ['lp_prob', 'delta_energy__', 'is_sample']}
+    for iChain in range(conf['chains']):
+        for iEvent in range(len(samples)):
+            for iKey, key in enumerate(fit.flatnames):
+                if key in desired_var:
+                    output[key].append(samples[iEvent][iChain][iKey])
+            for key in fit.diagnostics:
+                output[key].append(diagnostics[iChain][key][iEvent])
+            energy = diagnostics[iChain]['energy__']
+            output['delta_energy__'].append(
+                energy[iEvent] - energy[iEvent - 1] if iEvent > 0 else 0)
+            output['lp_prob'].append(samples[iEvent][iChain][len(fit.flatnames)])
+            output['is_sample'].append(0 if iEvent < conf['warmup'] else 1)
+    return output
+
+
+class UtilitiesTests(unittest.TestCase):
+
+    def test_SampleTable(self):
+        logger.info("SampleTable test")
+        from morpho.utilities import SampleTable
+
+        # 2 chains of 5 iterations, 2 of them being warmup
+        x = np.arange(10, dtype=float)
+        table = SampleTable({"x": x}, n_chains=2, warmup=2,
+                            entries={"mean": {"x": 4.5}})
+        self.assertEqual(table.n_iterations, 5)
+        self.assertEqual(list(table["chain"]), [0]*5 + [1]*5)
+        self.assertEqual(list(table["iteration"]), list(range(5))*2)
+        self.assertEqual(list(table["is_sample"]), [0, 0, 1, 1, 1]*2)
+        self.assertEqual(table["mean"]["x"], 4.5)
+
+        chain = table.chain(1)
+        self.assertTrue(np.shares_memory(chain["x"], table["x"]))
+        self.assertEqual(list(chain["x"]), [5., 6., 7., 8., 9.])
+        self.assertEqual(table.draws("x").shape, (2, 3))
+        self.assertTrue(np.shares_memory(table.draws("x"), table["x"]))
+        post_warmup = table.post_warmup()
+        # The draws of several chains are only gathered when accessed
+        self.assertFalse(post_warmup.is_loaded("x"))
+        self.assertEqual(list(post_warmup["x"]), [2., 3., 4., 7., 8., 9.])
+        self.assertEqual(list(post_warmup["iteration"]), [2, 3, 4]*2)
+        self.assertTrue(np.shares_memory(chain.post_warmup()["x"], table["x"]))
+
+        # The warmup of the following tables is dropped
+        from morpho.utilities import concatenate_tables
+        joined = concatenate_tables([table, SampleTable({"x": -x}, n_chains=2, warmup=1)])
+        self.assertEqual(list(joined.chain(0)["x"]), [0., 1., 2., 3., 4., -1., -2., -3., -4.])
+        self.assertEqual(joined["is_sample"].sum(), 14)
+
+    def test_LazySampleTable(self):
+        logger.info("Lazy SampleTable test")
+        from morpho.utilities import SampleTable
+
+        calls = []
+
+        def loader():
+            calls.append(1)
+            return np.arange(4, dtype=float)
+        table = SampleTable(n_draws=4)
+        table.add_lazy_column("x", loader)
+        self.assertIn("x", table.keys())
+        self.assertFalse(table.is_loaded("x"))
+        self.assertEqual(len(calls), 0)
+        self.assertEqual(table["x"][3], 3.)
+        self.assertEqual(table["x"][0], 0.)
+        self.assertEqual(len(calls), 1)
+
+    def test_Summary(self):
+        logger.info("Summary test")
+        from morpho.utilities import summary
+
+        rng = np.random.RandomState(1234)
+        # Independent draws: n_eff close to the number of draws, Rhat close to 1
+        draws = rng.normal(size=(1000, 4, 2))
+        values = summary.summarize(draws)
+        for key in summary.summary_names:
+            self.assertEqual(values[key].shape, (2,))
+        self.assertTrue(np.all(np.abs(values["Rhat"] - 1.) < 0.01))
+        self.assertTrue(np.all(values["n_eff"] > 3000))
+        # AR(1) chains with rho=0.9: n_eff ~ N*(1-rho)/(1+rho)
+        ar = np.zeros((10000, 4, 1))
+        noise = rng.normal(size=ar.shape)
+        for i in range(1, len(ar)):
+            ar[i] = 0.9*ar[i-1] + noise[i]
+        n_eff = summary.summarize(ar)["n_eff"][0]
+        self.assertTrue(0.7 < n_eff/(40000*0.1/1.9) < 1.3)
+        # Bulk ESS is insensitive to heavy tails
+        self.assertTrue(abs(summary.normal_ppf(0.975) - 1.959964) < 1e-6)
+        cauchy = rng.standard_cauchy(size=(1000, 4, 1))
+        self.assertTrue(summary.bulk_effective_sample_size(cauchy)[0] > 3000)
+        # Shifted chain: Rhat much larger than 1
+        draws[:, 0] += 3
+        self.assertTrue(np.all(summary.summarize(draws)["Rhat"] > 1.1))
+
+    def test_ExtractData(self):
+        logger.info("Extraction test")
+        try:
+            from morpho.utilities import pystanLoader
+        except ImportError:
+            self.skipTest("pystanLoader cannot be imported")
+
+        # x is a 2x3 matrix, flattened in column-major order by Stan
+        flatnames = ["a"] + ["x[{},{}]".format(i, j) for j in range(1, 4) for i in range(1, 3)]
+        fit = FakeStanFit(flatnames, n_iter=5, n_chains=2)
+        conf = {"interestParams": ["a", "x"], "warmup": 2, "chains": 2}
+        reference = reference_extraction(conf, fit)
+
+        table = pystanLoader.extract_data_from_outputdata(conf, fit)
+        # The columns are only converted when accessed
+        self.assertFalse(table.is_loaded("x[2,3]"))
+        for key, values in reference.items():
+            self.assertTrue(np.allclose(table[key], values), key)
+        self.assertEqual(list(table["chain"]), [0]*5 + [1]*5)
+        self.assertEqual(table.post_warmup().n_iterations, 3)
+
+        # Indexed parameters kept as arrays of shape (draws, 2, 3)
+        table = pystanLoader.extract_data_from_outputdata(dict(conf, keep_shape=True), fit)
+        self.assertEqual(table["x"].shape, (10, 2, 3))
+        for i in range(1, 3):
+            for j in range(1, 4):
+                key = "x[{},{}]".format(i, j)
+                self.assertTrue(np.allclose(table["x"][:, i-1, j-1], reference[key]), key)
+
+        # Slices and wildcards
+        table = pystanLoader.extract_data_from_outputdata(
+            dict(conf, interestParams=["x[1:2,3]"]), fit)
+        self.assertEqual(sorted(pystanLoader.summary_columns(table)), ["x[1,3]", "x[2,3]"])
+        self.assertTrue(np.allclose(table["x[2,3]"], reference["x[2,3]"]))
+        table = pystanLoader.extract_data_from_outputdata(dict(conf, interestParams=["?"]), fit)
+        self.assertEqual(sorted(pystanLoader.summary_columns(table)), sorted(flatnames))
+
+    def test_ExtractFixedParam(self):
+        logger.info("Fixed_param extraction test")
+        try:
+            from morpho.utilities import pystanLoader
+        except ImportError:
+            self.skipTest("pystanLoader cannot be imported")
+
+        # The Fixed_param sampler only reports accept_stat__
+        fit = FakeStanFit(["a", "b"], n_iter=4, n_chains=2, diagnostics=["accept_stat__"])
+        table = pystanLoader.extract_data_from_outputdata(
+            {"interestParams": ["a", "b"], "warmup": 0, "chains": 2}, fit)
+        self.assertIn("accept_stat__", table)
+        for key in ["stepsize__", "energy__", "delta_energy__"]:
+            self.assertNotIn(key, table)
+        # All the lazy columns can be loaded (e.g. before caching or pickling)
+        table.materialize()
+        self.assertEqual(len(table["a"]), 8)
+
+    def test_FlatnameIndex(self):
+        logger.info("FlatnameIndex test")
+        try:
+            from morpho.utilities.pystanLoader import FlatnameIndex
+        except ImportError:
+            self.skipTest("pystanLoader cannot be imported")
+
+        flatnames = ["a", "m[1,1]", "m[2,1]", "m[1,2]", "m[2,2]",
+                     "theta[1]", "theta[2]", "theta[3]", "sigma_a", "sigma_b"]
+        index = FlatnameIndex(flatnames)
+
+        def names(interestParams):
+            return [flatnames[i] for i in index.resolve(interestParams)[0]]
+        self.assertEqual(names(["theta[2:]", "a"]), ["a", "theta[2]", "theta[3]"])
+        self.assertEqual(names(["m[:,2]"]), ["m[1,2]", "m[2,2]"])
+        self.assertEqual(names(["sigma_*", "m[2,1]"]), ["m[2,1]", "sigma_a", "sigma_b"])
+        self.assertEqual(names(["unknown"]), [])
+        self.assertEqual(list(index.resolve(["m", "a"])[1]), ["m"])
+
+    def test_StanModelCache(self):
+        logger.info("StanModelCache test")
+        import tempfile
+        from morpho.utilities import StanModelCache, stanCache
+
+        cache = StanModelCache(tempfile.mkdtemp(), max_entries=2)
+        filenames = [cache.filename("hash{}".format(i), "test") for i in range(3)]
+        self.assertIsNone(cache.load(filenames[0]))
+        for i, cache_fn in enumerate(filenames):
+            # Lock taken while compiling
+            open(cache_fn + ".lock", "w").close()
+            cache.save({"model": i}, cache_fn, model_name="test")
+        # The least recently used model has been removed, but not its lock
+        # (other processes may be waiting on it)
+        self.assertIsNone(cache.load(filenames[0]))
+        self.assertTrue(os.path.exists(filenames[0] + ".lock"))
+        # The manifest is only written when it changes
+        manifest_fn = os.path.join(cache.cache_dir, "manifest.json")
+        os.utime(manifest_fn, (0, 0))
+        self.assertTrue(cache.is_cached(filenames[1]))
+        self.assertEqual(os.path.getmtime(manifest_fn), 0)
+        self.assertEqual(cache.load(filenames[2]), {"model": 2})
+        self.assertEqual(sorted(cache.manifest()),
+                         sorted(os.path.basename(a_fn) for a_fn in filenames[1:]))
+        # Models loaded once are shared within the process
+        model = cache.get_model("", "hash2", "test")
+        self.assertIs(cache.get_model("", "hash2", "test"), model)
+        self.assertIs(stanCache.registered_model("hash2"), model)
+        stanCache.clear_registry()
+        self.assertIsNone(stanCache.registered_model("hash2"))
+
+    def test_SamplingResultCache(self):
+        logger.info("SamplingResultCache test")
+        import tempfile
+        from morpho.utilities import SampleTable, SamplingResultCache, result_key
+
+        key = result_key("model", {"N": 10}, {"iter": 100, "data": {"N": 10}}, 1234)
+        self.assertEqual(key, result_key("model", {"N": 10}, {"iter": 100}, 1234))
+        # The number of processes and the CSV files do not change the draws
+        self.assertEqual(key, result_key("model", {"N": 10}, {"iter": 100, "n_jobs": 4,
+                                                            "sample_file": "s.csv"}, 1234))
+        self.assertNotEqual(key, result_key("model", {"N": 10}, {"iter": 100}, 1235))
+        self.assertNotEqual(key, result_key("model", {"N": 11}, {"iter": 100}, 1234))
+
+        cache = SamplingResultCache(tempfile.mkdtemp(), max_entries=1)
+        self.assertIsNone(cache.load_results(key))
+        table = SampleTable(n_draws=4)
+        table.add_lazy_column("x", lambda: np.arange(4.))
+        cache.save_results(key, table)
+        self.assertEqual(list(cache.load_results(key)["x"]), [0., 1., 2., 3.])
+        # The least recently used results are removed
+        cache.save_results("other", SampleTable({"x": np.zeros(2)}))
+        self.assertIsNone(cache.load_results(key))
+        # Results which cannot be loaded are not cached
+        table = SampleTable(n_draws=4)
+        table.add_lazy_column("x", lambda: {}["x"])
+        cache.save_results(key, table)
+        self.assertIsNone(cache.load_results(key))
+
+    def test_Precompile(self):
+        logger.info("Precompile test")
+        import argparse
+        import tempfile
+        from morpho.utilities import StanModelCache, precompile, resolve_includes
+        try:
+            from morpho.processors.sampling import PyStanSamplingProcessor
+        except ImportError:
+            self.skipTest("PyStanSamplingProcessor cannot be imported")
+
+        directory = tempfile.mkdtemp()
+        for name in ("fit", "generator"):
+            with open(os.path.join(directory, name + ".stan"), "w") as f:
+                f.write("parameters {{ real {}; }}\nmodel {{}}\n".format(name))
+        fit = {"model_code": os.path.join(directory, "fit.stan"), "cache_dir": directory}
+        generator = dict(fit, model_code=os.path.join(directory, "generator.stan"))
+        config_dict = {
+            "processors-toolbox": {"processors": [
+                {"type": "morpho.processors.sampling:PyStanMultiFitProcessor", "name": "multifit"},
+                {"type": "morpho.processors.analysis:SimulationBasedCalibration", "name": "sbc"},
+                {"type": "morpho.processors.sampling:GaussianSamplingProcessor", "name": "gaussian"}
+            ]},
+            "multifit": dict(fit, datasets=[{"N": 1}]),
+            "sbc": {"sampler": fit, "generator": generator, "analyzer": fit},
+            "gaussian": {"iter": 10}
+        }
+        models = precompile.models_from_config(config_dict)
+        self.assertEqual([a_model["model_code"] for a_model in models],
+                         [fit["model_code"], fit["model_code"], generator["model_code"],
+                          fit["model_code"]])
+
+        # The models already cached are not compiled again
+        cache = StanModelCache(directory)
+        for name in ("fit", "generator"):
+            key = resolve_includes(os.path.join(directory, name + ".stan")).key
+            cache.save({"model": name}, cache.filename(key, "anon_model"))
+        self.assertTrue(precompile.precompile_models(models, n_jobs=1))
+        args = argparse.Namespace(config=None, directory=directory, function_files_location=None,
+                                  model_name="anon_model", cache_dir=directory,
+                                  compile_profile="default", march_native=False,
+                                  n_jobs=1, force_recreate=False)
+        self.assertTrue(precompile.run_precompile(args))
+
+    def test_IncludeGraph(self):
+        logger.info("IncludeGraph test")
+        import tempfile
+        from morpho.utilities import resolve_includes
+
+        directory = tempfile.mkdtemp()
+
+        def write(filename, text):
+            with open(os.path.join(directory, filename), 'w') as f:
+                f.write(text)
+        write("model.stan", "functions {\n  include=outer;\n}\nmodel {}\n")
+        write("outer.functions", "  include=inner;\nreal outer(real x) { return inner(x); }\n")
+        write("inner.stan", "real inner(real x) { return x; }\n")
+        includes = resolve_includes(os.path.join(directory, "model.stan"), directory)
+        self.assertEqual(len(includes.files()), 3)
+        self.assertNotIn("include", includes.expand())
+        self.assertIn("real inner(real x)", includes.expand())
+        # Changing an included file changes the key
+        key = includes.key
+        write("inner.stan", "real inner(real x) { return 2*x; }\n")
+        os.utime(os.path.join(directory, "inner.stan"), (0, 0))
+        self.assertNotEqual(resolve_includes(
+            os.path.join(directory, "model.stan"), directory).key, key)
+        # Circular includes are detected
+        write("inner.stan", "include=outer;\n")
+        os.utime(os.path.join(directory, "inner.stan"), (1, 1))
+        with self.assertRaises(ValueError):
+            resolve_includes(os.path.join(directory, "model.stan"), directory)
+
+    def test_ParametersDetection(self):
+        logger.info("Parameters detection test")
+        import tempfile
+        from morpho.utilities import has_parameters_block
+
+        self.assertTrue(has_parameters_block("parameters {\n  real x;\n}\nmodel {}"))
+        self.assertFalse(has_parameters_block("parameters { }\nmodel {}"))
+        self.assertFalse(has_parameters_block("transformed parameters {\n  real x = 1;\n}"))
+        self.assertFalse(has_parameters_block("// parameters { real x; }\nmodel {}"))
+        self.assertFalse(has_parameters_block('model { print("parameters { real x; }"); }'))
+        self.assertTrue(has_parameters_block('model { print("a \\" b"); }\nparameters { real x; }'))
+
+        # The Fixed_param sampler is used for models without parameters
+        try:
+            from morpho.processors.sampling import PyStanSamplingProcessor
+        except ImportError:
+            self.skipTest("PyStanSamplingProcessor cannot be imported")
+        directory = tempfile.mkdtemp()
+        for name, code in [("generator", 'generated quantities { real y = 1; }\n'),
+                           ("fit", 'parameters { real x; }\nmodel { print("parameters {"); }\n')]:
+            with open(os.path.join(directory, name + ".stan"), "w") as f:
+                f.write(code)
+        for name, algorithm, fixed_param in [("generator", None, True), ("fit", None, False),
+                                             ("generator", "NUTS", False),
+                                             ("fit", "Fixed_param", True)]:
+            processor = PyStanSamplingProcessor(name)
+            self.assertTrue(processor.Configure({
+                "model_code": os.path.join(directory, name + ".stan"),
+                "iter": 10, "algorithm": algorithm}))
+            self.assertEqual(processor._use_fixed_param(), fixed_param)
+
+    def test_Seeding(self):
+        logger.info("Seeding test")
+        from morpho.utilities import derive_seed, processor_seed
+
+        # Derived seeds only depend on the master seed and the keys
+        self.assertEqual(derive_seed(1234, 7, "sampler"), derive_seed(1234, 7, "sampler"))
+        seeds = {derive_seed(1234, job_id, "sampler") for job_id in range(1000)}
+        self.assertEqual(len(seeds), 1000)
+        self.assertNotEqual(derive_seed(1234, 7, "sampler"), derive_seed(1235, 7, "sampler"))
+        self.assertTrue(all(0 < seed < 2**31 - 1 for seed in seeds))
+        self.assertEqual(processor_seed({"seed": 42}, "sampler"), 42)
+        self.assertTrue(0 < processor_seed({}, "sampler") < 2**31 - 1)
+
+    def test_SamplingCheckpoint(self):
+        logger.info("SamplingCheckpoint test")
+        import tempfile
+        from morpho.utilities import SampleTable, SamplingCheckpoint
+
+        directory = os.path.join(tempfile.mkdtemp(), "checkpoint")
+        config = {"iter": 10, "interestParams": ["x"]}
+        checkpoint = SamplingCheckpoint(directory)
+        self.assertIsNone(checkpoint.load(config))
+        tables = [SampleTable({"x[1]": np.arange(8.)}, n_chains=2, warmup=2)]
+        checkpoint.save(tables, {"n_iter": 4, "stepsize": np.float64(0.5)}, config)
+        tables.append(SampleTable({"x[1]": np.arange(4.)}, n_chains=2))
+        checkpoint.save(tables, {"n_iter": 6, "stepsize": np.float64(0.4)}, config)
+
+        loaded, state = SamplingCheckpoint(directory).load(config)
+        self.assertEqual(state, {"n_iter": 6, "stepsize": 0.4})
+        self.assertEqual(len(loaded), 2)
+        self.assertEqual(loaded[0].warmup, 2)
+        self.assertEqual(list(loaded[1]["x[1]"]), [0., 1., 2., 3.])
+        # A checkpoint of another configuration is ignored
+        self.assertIsNone(checkpoint.load(dict(config, iter=20)))
+
+    def test_ChunkedSampling(self):
+        logger.info("ChunkedSampling test")
+        import tempfile
+        from morpho.utilities import ChunkedSampling, SampleTable, converged
+
+        calls = []
+
+        def sample(chunk_args):
+            # Chains of iid draws; without inv_metric, the chunks are re-adapted
+            calls.append(chunk_args)
+            rng = np.random.RandomState(chunk_args["seed"])
+            n_draws = chunk_args["chains"]*chunk_args["iter"]
+            table = SampleTable({"x": rng.normal(size=n_draws)}, n_chains=chunk_args["chains"],
+                                warmup=chunk_args["warmup"])
+            return table, {"init": [{"x": 0.}], "stepsize": 0.5}
+
+        def first_args(sampling_args, n_samples):
+            return dict(sampling_args, iter=10 + n_samples, warmup=10)
+
+        sampling_args = {"chains": 2, "seed": 1234}
+        checkpoint_dir = tempfile.mkdtemp()
+        chunks = ChunkedSampling(sample, 100, 40, readapt_warmup=5,
+                                 checkpoint_dir=checkpoint_dir, checkpoint_config={"n": 100})
+        results = chunks.run(sampling_args, first_args)
+        self.assertEqual([(a_call["iter"], a_call["warmup"]) for a_call in calls],
+                         [(50, 10), (45, 5), (25, 5)])
+        self.assertEqual(calls[1]["control"], {"stepsize": 0.5})
+        self.assertEqual(len(chunks.chunk_seeds), 3)
+        self.assertEqual(results.n_iterations - results.warmup, 100)
+        self.assertEqual(results["sampler_state"]["stepsize"], 0.5)
+        self.assertIn("x", results["mean"])
+
+        # A finished sampling of the same configuration is resumed without sampling
+        del calls[:]
+        resumed = chunks.run(sampling_args, first_args)
+        self.assertEqual(calls, [])
+        self.assertTrue(np.array_equal(resumed["x"], results["x"]))
+
+        # With targets, chunks are added until convergence
+        chunks = ChunkedSampling(sample, 100, 40, readapt_warmup=5, max_iter=500,
+                                 target_rhat=1.1, target_ess={"x": 400})
+        results = chunks.run(sampling_args, first_args)
+        self.assertGreater(len(chunks.chunk_seeds), 1)
+        self.assertTrue(converged(results, ["x"], 1.1, {"x": 400}))
+
+    def test_ProgressMonitor(self):
+        logger.info("ProgressMonitor test")
+        import json
+        import tempfile
+        from morpho.utilities import ProgressMonitor, chain_sample_files
+
+        directory = tempfile.mkdtemp()
+        sample_files = chain_sample_files(os.path.join(directory, "samples.csv"), 2)
+        self.assertEqual(os.path.basename(sample_files[1]), "samples_1.csv")
+        side_file = os.path.join(directory, "progress.json")
+        monitor = ProgressMonitor("test", 2, 10, 5, side_file=side_file,
+                                  sample_files=sample_files).start()
+        for iChain, n_draws in enumerate([6, 3]):
+            with open(sample_files[iChain], 'w') as f:
+                f.write("# comment\nlp__,n_leapfrog__,x\n")
+                f.write("0,3,1\n"*n_draws)
+                # Draw being written
+                f.write("0,3")
+        progress = monitor.report()
+        self.assertEqual(progress["iterations"], 9)
+        self.assertEqual([a_chain["phase"] for a_chain in progress["chains"]], ["sampling", "warmup"])
+        self.assertGreater(progress["leapfrog_per_second"], 0)
+        monitor.stop()
+        with open(side_file, 'r') as f:
+            self.assertEqual(json.load(f)["phase"], "done")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -7,6 +7,8 @@
 cd tests/IO && python3 IO_test.py || exit 1
 cd ../misc && python3 misc_test.py || exit 1
 cd ../sampling && python3 sampling_test.py || exit 1
+cd ../utilities && python3 utilities_test.py || exit 1
+cd ../analysis && python3 sbc_test.py || exit 1
 
 cd ../../examples
 morpho -c linear_fit/scripts/morpho_linear.yaml || exit 1